@@ -1,95 +1,444 @@
-from flask import Flask, flash, request, redirect, url_for, render_template, session, jsonify
+from flask import Flask, flash, request, redirect, url_for, render_template, session, jsonify, make_response
 from werkzeug.utils import secure_filename
-from reading_data import read_attribute_file, read_matrix
-from calc_render import read_input, make_x_graph, node_calculation, network_calculations, make_dash
-from dash.dependencies import Input, Output, State
-from temp_e_i import calc_ei
-import dash
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from memory_budget import plan_analysis, measure_stage, MemoryBudgetError
+from job_pool import admitted, submit, submit_cached, ServerBusyError
+from http_cache import analysis_etag, not_modified, tag_response, compress_response
 import os
 import json
+import threading
+from collections import OrderedDict
+
+# Heavy libraries (pandas, networkx, scipy, dash, sklearn) are imported inside the stages that use them,
+# so the upload page answers before any of them are loaded. Check with `python import_report.py`.
 
 app = Flask(__name__)
-dash_app = dash.Dash(__name__, server=app, url_base_pathname="/dash/")
+dash_app = None
+dash_app_lock = threading.Lock()
+layout_etag = None # ETag of the analysis whose layout the Dash app is showing
+
+def get_dash_app():
+    """Creates the Dash app the first time it is needed, mounted under /dash/"""
+    global dash_app
+    with dash_app_lock:
+        if dash_app is not None:
+            return dash_app
+
+        import dash
+        # The layout changes with every analysis (and shows a preview meanwhile), the callbacks are registered once
+        dash_app = dash.Dash(__name__, server=Flask(__name__), requests_pathname_prefix="/dash/", routes_pathname_prefix="/",
+                             suppress_callback_exceptions=True)
+        dash_app.layout = dash.html.P("Upload a network to visualize it.")
+        register_callbacks(dash_app)
+
+        # The layout holds every Cytoscape element, so repeat loads are answered from the browser cache
+        @dash_app.server.before_request
+        def layout_not_modified():
+            if request.path.endswith("_dash-layout") and not_modified(request, layout_etag):
+                return tag_response(make_response("", 304), layout_etag)
+
+        @dash_app.server.after_request
+        def cache_dash_response(response):
+            if request.path.endswith("_dash-layout") and response.status_code == 200 and layout_etag:
+                tag_response(response, layout_etag)
+            return compress_response(request, response)
+    return dash_app
+
+def dash_wsgi(environ, start_response):
+    return get_dash_app().server(environ, start_response)
+
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {"/dash": dash_wsgi})
 
 app.secret_key = 'PLEASE_SAVE_THIS_SOMEWHERE_ELSE'
 
-app.config["UPLOAD_FOLDER"] = "Uploads/"
+@app.after_request
+def compress_page(response):
+    return compress_response(request, response)
 
 ALLOWED_EXTENSIONS = {'csv'}
 
+MAX_DATASETS = 8
+datasets = OrderedDict() # Parsed uploads by dataset id, most recently used last
+live_graphs = {} # Editable copies of the networks by dataset id, replayed from the shared edit log (see find_live_graph)
+edit_lock = threading.Lock()
+panels = OrderedDict() # Longitudinal uploads by id, most recently used last (see longitudinal)
+views = {} # What the Dash callbacks need of every analysed network, by dataset id (see create_network_graph)
+raster_scenes = {} # Laid-out ties of the networks shown as map tiles, by dataset id (see raster_tiles)
+
 degree_centrality, betweenness_centrality, closeness_centrality = {}, {}, {}
 
+def remember_dataset(dataset):
+    """Keeps a parsed upload in this process, evicting the least recently used ones"""
+    from graph_store import release
+
+    datasets[dataset["id"]] = dataset
+    datasets.move_to_end(dataset["id"])
+    while len(datasets) > MAX_DATASETS:
+        evicted_id, _ = datasets.popitem(last=False)
+        live_graphs.pop(evicted_id, None)
+        views.pop(evicted_id, None)
+        raster_scenes.pop(evicted_id, None)
+        release(evicted_id)
+
+def find_dataset(dataset_id):
+    """The parsed upload with this id, from this process or from the shared store (see graph_store)"""
+    from graph_store import load_dataset
+
+    dataset = datasets.get(dataset_id)
+    if dataset is None and dataset_id is not None:
+        dataset = load_dataset(dataset_id)
+        if dataset is not None:
+            remember_dataset(dataset)
+    return dataset
+
+def remember_panel(longitudinal):
+    """Keeps a longitudinal upload in this process, evicting the least recently used ones"""
+    panels[longitudinal["id"]] = longitudinal
+    panels.move_to_end(longitudinal["id"])
+    while len(panels) > MAX_DATASETS:
+        panels.popitem(last=False)
+
+def find_panel(panel_id):
+    """The longitudinal upload with this id, from this process or from the results store, or None"""
+    import results_store
+
+    if not isinstance(panel_id, str):
+        return None
+
+    longitudinal = panels.get(panel_id)
+    if longitudinal is None:
+        longitudinal = results_store.lookup(panel_id, "panel", {})
+        if longitudinal is results_store.MISSING:
+            return None
+        remember_panel(longitudinal)
+    return longitudinal
+
+def find_live_graph(dataset_id):
+    """The editable copy of a dataset's network in this process, built on first use (see live_graph).
+    The edits themselves are a log in the results store, so every server process replays the same edits in the
+    same order; with the store turned off the log, and so the edits, only live in this process."""
+    from calc_render import build_input
+    from live_graph import make_live_graph
+
+    live = live_graphs.get(dataset_id)
+    if live is None:
+        dataset = find_dataset(dataset_id)
+        if dataset is None:
+            return None
+        g_dict, _, _ = build_input(dataset["matrix"], dataset["attributes"].copy())
+        live = live_graphs[dataset_id] = make_live_graph(g_dict)
+        live["edits"] = []
+    return live
+
+def replay_edits(live, edits):
+    """Applies the edits of the log this live graph has not seen yet, in log order.
+    Returns the error each of them raised, or None; invalid edits are skipped the same way by every process."""
+    import live_graph
+
+    errors = []
+    for edit in edits[len(live["edits"]):]:
+        try:
+            live_graph.apply_edit(live, edit)
+            errors.append(None)
+        except (LookupError, ValueError) as e:
+            errors.append(e)
+        live["edits"].append(edit)
+    return errors
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route('/', methods = ['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
-        relational_file = request.files.get('relational')
+        # Several relational files are the waves of one longitudinal network (see longitudinal)
+        relational_files = [file for file in request.files.getlist('relational') if file.filename]
+        relational_file = relational_files[0] if relational_files else None
         attribute_file = request.files.get('attribute')
         
         if not relational_file and not attribute_file:
             error = "No file selected. Please upload a .csv file"
             return render_template('index.html', error = error)
 
-        filenames = {'relational_file': None, 'attribute_file': None}
-
-        for file in [relational_file, attribute_file]:
-            if file and allowed_file(file.filename):
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
-
-                if file == relational_file:
-                    filenames["relational"] = file.filename
-                else:
-                    filenames["attribute"] = file.filename
-            elif file:
+        for file in relational_files + [attribute_file]:
+            if file and not allowed_file(file.filename):
                 error = "Invalid file format! Please upload a .csv file"
                 return render_template('index.html', error = error)
 
-        session["filenames"] = filenames # Storing uploaded files in session to be read & processed later
+        if not relational_file:
+            error = "Please upload the relational .csv file"
+            return render_template('index.html', error = error)
+
+        # Parse the uploads once, straight from the request, into the dataset used by every later stage
+        from reading_data import read_uploaded_network
+
+        if len(relational_files) > 1:
+            return upload_waves(relational_files, attribute_file)
+        try:
+            dataset = read_uploaded_network(relational_file.stream, attribute_file.stream if attribute_file else None)
+        except ValueError as e:
+            return render_template('index.html', error = str(e))
+
+        # Published to the host's shared store, so the other server processes do not parse it again
+        from graph_store import share_dataset
+        remember_dataset(share_dataset(dataset))
+
+        session["dataset"] = dataset["id"] # Storing the dataset id in session to be processed later
         return redirect(url_for('visualize'))
     return render_template('index.html')
 
-def create_network_graph(filenames):
+def upload_waves(relational_files, attribute_file):
+    """Parses every wave of a longitudinal upload in file name order; the attribute file belongs to the panel.
+    Only the first wave and the diffs between waves are kept, in this process and in the results store, so the
+    other server processes find them too; a wave becomes a dataset of its own when it is opened (see open_wave)."""
+    import results_store
+    from reading_data import read_uploaded_network
+    from longitudinal import wave_order, load_waves
+
+    names = [secure_filename(file.filename) for file in relational_files]
+    order = wave_order(names)
+    waves = []
+    try:
+        for position, i in enumerate(order):
+            attribute_stream = attribute_file.stream if attribute_file and position == 0 else None
+            waves.append(read_uploaded_network(relational_files[i].stream, attribute_stream))
+    except ValueError as e:
+        return render_template('index.html', error = str(e))
+
+    longitudinal = load_waves(waves, [names[i] for i in order])
+    remember_panel(longitudinal)
+    results_store.store(longitudinal["id"], "panel", {}, longitudinal)
+
+    session["waves"] = longitudinal["id"]
+    return redirect(url_for('show_waves'))
+
+def dataset_plan(dataset):
+    """
+    Memory plan of an uploaded dataset; a network whose ties all have value 1 is binary (see memory_budget)
+    """
+    row_names, _, _, _, values = dataset["matrix"]
+    return plan_analysis(len(row_names), len(values), binary=bool((values == 1).all()))
+
+def create_network_graph(dataset, report=None):
+    """Analyses a dataset and shows it in the Dash app. report(stage, value) is called as the centrality, ei and
+    structure stages finish and with "graph" once the Dash app shows the network (see measures_update)."""
     global degree_centrality, betweenness_centrality, closeness_centrality
-    relational_filename = filenames.get("relational")
-    attribute_filename = filenames.get("attribute")
+    from calc_render import build_input, make_x_graph, node_calculation, make_dash, colorable_attributes, \
+        calculate_force_positions, calculate_spectral_positions
+    from graph_index import build_csr_index, build_distance_oracle, BLOCK_VIEW_MIN_NODES, build_weight_index, weight_view
+    from blockmodeling import network_blocks
+    from mixing_matrix import attribute_ei
+    from attribute_encoding import category_dictionary
+    from network_metrics import global_metrics
+    from graph_store import load_csr_index, publish_csr_index, load_node_values, publish_node_values
+    from preview import central_actors, directed_matrix
+    from raster_tiles import use_raster, build_scene, tile_figure
+
+    if report is None:
+        report = lambda stage, value: None
+
+    # Plan every stage against the memory budget before allocating anything large
+    matrix = dataset["matrix"]
+    plan = dataset_plan(dataset)
+    stages = plan["stages"]
+    
+    g_dict, df2, adj_matrix_df = measure_stage(plan, "read_input", build_input, matrix, dataset["attributes"].copy(),
+                                               adjacency=stages["read_input"]["variant"]) # Produces dictionary to create graph
+    G = make_x_graph(g_dict) # Creates network graph
+
+    # The heavy stages run in the worker processes (see job_pool), in parallel, while this thread waits
+    # Each stage is first looked up in the results store, by dataset and stage parameters (see results_store)
+    dataset_id = dataset["id"]
+    # The CSR index and the centralities are shared by the server processes on this host (see graph_store)
+    csr_index = load_csr_index(dataset_id)
+    if csr_index is None:
+        csr_index = build_csr_index(g_dict) # Neighborhood and distance queries
+        publish_csr_index(dataset_id, csr_index)
+
+    centrality = load_node_values(dataset_id, "centrality", csr_index, stages["centrality"])
+    centrality_job = None
+    if centrality is None:
+        centrality_job = submit_cached(dataset_id, "centrality", stages["centrality"], measure_stage, plan, "centrality", node_calculation, G,
+                                betweenness_samples=stages["centrality"].get("samples"))
+
+    # E-I index of the network, of each group and of each node, for every attribute
+    ei_job = submit_cached(dataset_id, "ei", stages["ei"], measure_stage, plan, "ei", attribute_ei, adj_matrix_df, df2,
+                           packed=stages["ei"]["variant"] == "packed")
+
+    # Density, clustering, components, reciprocity and diameter, from the uploaded (directed) matrix
+    structure_job = None
+    if stages["structure"]["variant"] != "skip":
+        _, uploaded = directed_matrix(matrix)
+        structure_job = submit_cached(dataset_id, "structure", stages["structure"], measure_stage, plan, "structure", global_metrics, uploaded)
+
+    # Networks with too many ties for Cytoscape are drawn as map tiles on the server (see raster_tiles)
+    raster = use_raster(G.number_of_edges())
+
+    # Other large networks start collapsed to one node per block (structural equivalence or communities, as planned)
+    blocks_job = None
+    if stages["blockmodeling"]["variant"] != "skip" and len(g_dict) > BLOCK_VIEW_MIN_NODES and not raster:
+        blocks_job = submit_cached(dataset_id, "blockmodeling", stages["blockmodeling"], measure_stage, plan, "blockmodeling", network_blocks, adj_matrix_df,
+                            stages["blockmodeling"]["variant"], block_rows=stages["blockmodeling"].get("block_rows"))
+
+    # Force-directed (or, for large networks, spectral) positions for the whole network; the block view places its own nodes
+    layout_job = None
+    if stages["layout"]["variant"] != "skip" and blocks_job is None:
+        layout = calculate_force_positions if stages["layout"]["variant"] == "force" else calculate_spectral_positions
+        layout_job = submit_cached(dataset_id, "layout", stages["layout"], measure_stage, plan, "layout", layout, G)
+
+    if centrality_job is not None:
+        publish_node_values(dataset_id, "centrality", csr_index, centrality_job.result(), stages["centrality"])
+        centrality = load_node_values(dataset_id, "centrality", csr_index, stages["centrality"]) or centrality_job.result()
+    degree_centrality, betweenness_centrality, closeness_centrality = centrality
+    report("centrality", central_actors(betweenness_centrality))
+
+    # Landmark distances for the distance between two selected nodes
+    distance_oracle = None
+    if stages["distances"]["variant"] != "skip":
+        distance_oracle = submit_cached(dataset_id, "distances", stages["distances"], measure_stage, plan, "distances",
+                                        build_distance_oracle, csr_index, degree_centrality).result()
+
+    ei_results = ei_job.result()
+    report("ei", ei_results)
+    node_ei_indices = {attr_name: dict(zip(adj_matrix_df.index, result["nodes"])) for attr_name, result in ei_results.items()}
+    metrics = structure_job.result() if structure_job else None
+    report("structure", metrics)
+    blocks = blocks_job.result() if blocks_job else None
+
+    # The tiles are drawn from the finished layout; the Cytoscape view holds the nodes in the map's viewport
+    scene = None
+    if raster:
+        scene = build_scene(matrix, layout_job.result() if layout_job else None)
+        raster_scenes[dataset_id] = scene
+
+    weight_index = build_weight_index(g_dict)
+
+    # Everything the Dash callbacks need, found by the dataset id the layout carries (see register_callbacks)
+    views[dataset_id] = view = {
+        "g_dict": g_dict,
+        "csr_index": csr_index,
+        "categories": category_dictionary(df2), # Shared by the coloring (codes index the palette)
+        "centrality": (degree_centrality, betweenness_centrality, closeness_centrality),
+        "node_ei_indices": node_ei_indices,
+        "distance_oracle": distance_oracle,
+        "blocks": blocks,
+        "layout_job": layout_job,
+        "scene": scene,
+        "raster_view": {"rect": (0, 1, 0, 1), "elements": []},
+        "tile_url": f"/tiles/{dataset_id}/{{z}}/{{x}}/{{y}}.png",
+        # Ties sorted by weight for the threshold slider, and the degrees of the filtered view
+        "weight_index": weight_index,
+        "weight_state": weight_view(weight_index),
+        "weight_lock": threading.Lock(),
+    }
+
+    get_dash_app().layout = make_dash(g_dict, network_elements(view) if blocks is not None or scene is not None else None,
+                                      colorable_attributes(view["categories"]), weight_index["weights"],
+                                      positions=layout_positions(view),
+                                      poll_layout=layout_job is not None and not layout_job.done() and scene is None,
+                                      tiles=tile_figure(view["tile_url"]) if scene is not None else None,
+                                      dataset_id=dataset_id)
+
+    report("graph", None)
+
+    # @dash_app.callback(
+    #     Output('selected-node', 'data'),
+    #     Input('cytoscape-graph', 'tapNodeData')
+    # )
+    # def update_centrality(clicked_node):
+    #     if not clicked_node:
+    #         return {}
 
-    if not relational_filename and not attribute_filename:
-        return # Figure out error handling
+    #     node_id = clicked_node['id']
+    #     print(f"Node clicked: {node_id}", flush=True)
 
-    if relational_filename:
-        read_matrix('Uploads', relational_filename)
-    if attribute_filename:
-        read_attribute_file('Uploads', attribute_filename)
+    #     # data = {
+    #     #     "degree": degree_centrality.get(node_id, 0),
+    #     #     "closeness": closeness_centrality.get(node_id, 0),
+    #     #     "betweenness": betweenness_centrality.get(node_id, 0)
+    #     # }
 
-    relational_file = os.path.join(app.config['UPLOAD_FOLDER'], relational_filename)
-    attribute_file = os.path.join(app.config['UPLOAD_FOLDER'], attribute_filename)
-    
-    g_dict, df2, adj_matrix_df = read_input(relational_file, attribute_file) # Produces dictionary to create graph
-    G = make_x_graph(g_dict) # Creates network graph
+    #     # print(f"Sending data to JavaScript: {data}", flush=True)
 
-    degree_centrality, betweenness_centrality, closeness_centrality = node_calculation(G)
+    #     # return data
+    #     # return dash.dcc.Location(href=f"/visualize/{node_id}", id="redirect-location")
+    #     return redirect(url_for(f'visualize/{node_id}'))
     
+    return G, df2, adj_matrix_df, plan, ei_results, metrics
+
+def current_view(dataset_id):
+    """The view state of the network a Dash layout shows (see create_network_graph). A callback from a page of a
+    network this process has not analysed, e.g. since a restart, changes nothing until /visualize is loaded again."""
+    from dash.exceptions import PreventUpdate
+
+    view = views.get(dataset_id)
+    if view is None:
+        raise PreventUpdate
+    return view
+
+def layout_positions(view):
+    """The force layout once its stage has finished, otherwise None (the circular layout)"""
+    layout_job = view["layout_job"]
+    if layout_job is None or not layout_job.done() or layout_job.exception() is not None:
+        return None
+    return layout_job.result()
+
+def network_elements(view, expanded=(), threshold=None):
+    """The whole network without the ties below threshold, or the block view with the given blocks expanded.
+    Networks drawn as tiles show the nodes in the map's viewport instead."""
+    from calc_render import format_for_dash_cytoscape
+    from graph_index import block_view_elements
+
+    if view["scene"] is not None:
+        elements = view["raster_view"]["elements"]
+    elif view["blocks"] is None:
+        elements = format_for_dash_cytoscape(view["g_dict"], positions=layout_positions(view))
+    else:
+        img_matrix, labels, reduced_matrix = view["blocks"]
+        return block_view_elements(view["csr_index"], view["g_dict"], labels, img_matrix, reduced_matrix, expanded)
+    if threshold is None:
+        return elements
+    return [element for element in elements if 'source' not in element['data'] or element['data']['weight'] >= threshold]
+
+def register_callbacks(dash_app):
+    """Registers the callbacks of the network view (calc_render.make_dash) once, when the Dash app is created.
+    Each of them reads the network from views by the id in the layout's 'dataset-id' store."""
+    from calc_render import BLOCK_STYLESHEET, category_stylesheet
+    from graph_index import ego_elements, estimate_distance, shortest_path, threshold_position, move_threshold, \
+        view_metrics, weight_edge_elements
+    from raster_tiles import tile_images, viewport_rect, viewport_nodes, viewport_elements, VIEWPORT_MAX_NODES
+    from dash.dependencies import Input, Output, State
+    import dash
 
-    dash_app.layout = make_dash(g_dict)
     @dash_app.callback(
         [Output('node-attributes', 'children'), 
         Output('cytoscape-graph', 'stylesheet')],
-        Input('cytoscape-graph', 'selectedNodeData')  # Listens for node clicks
+        [Input('cytoscape-graph', 'selectedNodeData'),  # Listens for node clicks
+        Input('color-by', 'value')],
+        State('dataset-id', 'data')
     )
-    def display_node_attributes(selectedNodeData):
+    def display_node_attributes(selectedNodeData, color_by, dataset_id):
         """Displays attributes of the clicked node."""
+        view = current_view(dataset_id)
+        categories = view["categories"]
         default_stylesheet = [
             {'selector': 'node', 'style': {'content': 'data(label)'}},
             {'selector': 'edge', 'style': {'curve-style': 'bezier', 'target-arrow-shape': 'triangle'}}
-        ]
+        ] + BLOCK_STYLESHEET
+        if color_by in categories:
+            default_stylesheet += category_stylesheet(color_by, categories[color_by])
+
+        # Block nodes of the collapsed view are expanded by update_elements
+        selectedNodeData = [node for node in selectedNodeData or [] if 'block' not in node]
+
+        if selectedNodeData and len(selectedNodeData) == 2:
+            return display_distance(view, selectedNodeData[0]['id'], selectedNodeData[1]['id'], default_stylesheet)
 
         if selectedNodeData and len(selectedNodeData) > 0:
             node_id = selectedNodeData[0]['id']  # Get the node's ID
-            node_data = g_dict.get(node_id, {})
+            node_data = view["g_dict"].get(node_id, {})
             attributes = node_data.get('attributes', {})
-            centrality_values = (degree_centrality.get(node_id, 0), betweenness_centrality.get(node_id, 0), closeness_centrality.get(node_id, 0))
+            centrality_values = [measure.get(node_id, 0) for measure in view["centrality"]]
             centrality_measures = ['Degree Centrality', 'Betweenness Centrality', 'Closeness Centrality']
             # Generate attribute text
             attributes_text = [
@@ -102,6 +451,11 @@ def create_network_graph(filenames):
             for centrality_measure, value in zip(centrality_measures, centrality_values):
                 attributes_text.append(dash.html.P(f"{centrality_measure}: {value}"))
 
+            if view["node_ei_indices"]:
+                attributes_text.append(dash.html.H4("E-I Index"))
+                for attr_name, node_values in view["node_ei_indices"].items():
+                    attributes_text.append(dash.html.P(f"{attr_name}: {node_values.get(node_id, 0):.4f}"))
+
             highlighted_stylesheet = default_stylesheet + [
                 {'selector': f'node[id = "{node_id}"]',
                 'style': {'background-color': 'red', 'border-width': '3px', 'border-color': 'black'}}
@@ -109,59 +463,416 @@ def create_network_graph(filenames):
             return attributes_text, highlighted_stylesheet
         
         return dash.html.P("Click on a node to see its attributes."), default_stylesheet
-    # @dash_app.callback(
-    #     Output('selected-node', 'data'),
-    #     Input('cytoscape-graph', 'tapNodeData')
-    # )
-    # def update_centrality(clicked_node):
-    #     if not clicked_node:
-    #         return {}
 
-    #     node_id = clicked_node['id']
-    #     print(f"Node clicked: {node_id}", flush=True)
+    def display_distance(view, source, target, default_stylesheet):
+        """Shows how far apart two selected nodes are and a shortest path between them."""
+        distance_text = [dash.html.H4(f"Distance from {source} to {target}")]
+        if view["distance_oracle"] is not None:
+            lower, upper = estimate_distance(view["distance_oracle"], source, target)
+            if lower is not None:
+                estimate = f"{lower} to {upper}" if upper is not None and upper != lower else f"{lower}"
+                distance_text.append(dash.html.P(f"Landmark estimate: {estimate}"))
+
+        path = shortest_path(view["csr_index"], source, target)
+        if path is None:
+            distance_text.append(dash.html.P("These nodes are not connected."))
+            return distance_text, default_stylesheet
+
+        distance_text.append(dash.html.P(f"Distance: {len(path) - 1}"))
+        distance_text.append(dash.html.P("Path: " + " → ".join(path)))
+
+        path_stylesheet = default_stylesheet + [
+            {'selector': f'node[id = "{node}"]', 'style': {'background-color': 'red'}} for node in path
+        ] + [
+            {'selector': f'edge[source = "{a}"][target = "{b}"], edge[source = "{b}"][target = "{a}"]',
+            'style': {'line-color': 'red', 'width': 3}} for a, b in zip(path, path[1:])
+        ]
+        return distance_text, path_stylesheet
 
-    #     # data = {
-    #     #     "degree": degree_centrality.get(node_id, 0),
-    #     #     "closeness": closeness_centrality.get(node_id, 0),
-    #     #     "betweenness": betweenness_centrality.get(node_id, 0)
-    #     # }
+    @dash_app.callback(
+        [Output('cytoscape-graph', 'elements'),
+        Output('ego-status', 'children'),
+        Output('expanded-blocks', 'data'),
+        Output('applied-threshold', 'data', allow_duplicate=True)],
+        [Input('cytoscape-graph', 'tapNodeData'),
+        Input('ego-hops', 'value'),
+        Input('collapse-blocks', 'n_clicks')],
+        [State('expanded-blocks', 'data'),
+        State('weight-threshold', 'value'),
+        State('dataset-id', 'data')],
+        prevent_initial_call=True
+    )
+    def update_elements(tapNodeData, hops, n_clicks, expanded, threshold, dataset_id):
+        """Shows the k-hop neighborhood of the clicked node, or the whole network (expanding a block when it is clicked)
+        when no hop count is chosen. Only the elements on screen are sent to the browser."""
+        view = current_view(dataset_id)
+        trigger = dash.ctx.triggered_id
+        if trigger == 'collapse-blocks':
+            return network_elements(view), None, [], dash.no_update
+
+        if not hops:
+            if trigger == 'ego-hops':
+                return network_elements(view, expanded, threshold), None, dash.no_update, threshold
+            if tapNodeData and 'block' in tapNodeData and tapNodeData['block'] not in expanded:
+                expanded = expanded + [tapNodeData['block']]
+                status = dash.html.P(f"Expanded block {tapNodeData['block']} ({tapNodeData['size']} nodes)")
+                return network_elements(view, expanded), status, expanded, dash.no_update
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+        if not tapNodeData or 'block' in tapNodeData:
+            return dash.no_update, dash.html.P("Click on a node to see its neighborhood."), dash.no_update, dash.no_update
+
+        node_id = tapNodeData['id']
+        elements, truncated = ego_elements(view["csr_index"], view["g_dict"], node_id, hops)
+        num_nodes = sum(1 for element in elements if 'source' not in element['data'])
+        status = f"{hops}-hop neighborhood of {node_id}: {num_nodes} nodes"
+        if truncated:
+            status += " (cut off at the node limit)"
+        return elements, dash.html.P(status), dash.no_update, dash.no_update
 
-    #     # print(f"Sending data to JavaScript: {data}", flush=True)
+    @dash_app.callback(
+        [Output('cytoscape-graph', 'elements', allow_duplicate=True),
+        Output('weight-status', 'children'),
+        Output('applied-threshold', 'data')],
+        Input('weight-threshold', 'value'),
+        [State('applied-threshold', 'data'),
+        State('ego-hops', 'value'),
+        State('dataset-id', 'data')],
+        prevent_initial_call=True
+    )
+    def filter_ties(threshold, applied, hops, dataset_id):
+        """Hides the ties below the threshold weight. The new threshold is a binary search in the weight index, and only
+        the ties it hides or shows are sent, as a Patch of the elements; degrees and density follow incrementally."""
+        view = current_view(dataset_id)
+        weight_index = view["weight_index"]
+        position = threshold_position(weight_index, threshold)
+        with view["weight_lock"]:
+            metrics = view_metrics(weight_index, move_threshold(weight_index, view["weight_state"], position))
+        status = dash.html.P(f"{metrics['ties']} of {len(weight_index['weights'])} ties shown: density {metrics['density']:.4f}, "
+                             f"degree mean {metrics['mean_degree']:.2f}, max {metrics['max_degree']}")
+
+        # The neighborhood, block and tile views are redrawn from the slider when the whole network is shown again
+        if hops or view["blocks"] is not None or view["scene"] is not None:
+            return dash.no_update, status, dash.no_update
+
+        applied_position = threshold_position(weight_index, applied)
+        patch = dash.Patch()
+        if position > applied_position:
+            for element in weight_edge_elements(weight_index, applied_position, position):
+                patch.remove(element)
+        else:
+            patch.extend(weight_edge_elements(weight_index, position, applied_position))
+        return patch, status, threshold
 
-    #     # return data
-    #     # return dash.dcc.Location(href=f"/visualize/{node_id}", id="redirect-location")
-    #     return redirect(url_for(f'visualize/{node_id}'))
-    
-    return G, df2, adj_matrix_df
+    @dash_app.callback(
+        [Output('cytoscape-graph', 'layout'),
+        Output('layout-poll', 'disabled')],
+        Input('layout-poll', 'n_intervals'),
+        State('dataset-id', 'data'),
+        prevent_initial_call=True
+    )
+    def apply_force_layout(n_intervals, dataset_id):
+        """Moves the nodes to the force-directed positions once the layout stage has finished"""
+        view = current_view(dataset_id)
+        if view["layout_job"] is None or not view["layout_job"].done():
+            return dash.no_update, dash.no_update
+        positions = layout_positions(view)
+        if positions is None:
+            return dash.no_update, True
+        return {'name': 'preset', 'positions': positions, 'fit': True}, True
+
+    @dash_app.callback(
+        [Output('tile-map', 'figure'),
+        Output('cytoscape-graph', 'elements', allow_duplicate=True),
+        Output('raster-status', 'children')],
+        Input('tile-map', 'relayoutData'),
+        [State('ego-hops', 'value'),
+        State('dataset-id', 'data')],
+        prevent_initial_call=True
+    )
+    def show_viewport(relayout, hops, dataset_id):
+        """Loads the tiles of the map's new viewport, and shows its nodes as Cytoscape elements once there are few enough"""
+        view = current_view(dataset_id)
+        scene, raster_view = view["scene"], view["raster_view"]
+        if scene is None:
+            return dash.no_update, dash.no_update, dash.no_update
+
+        raster_view["rect"] = rect = viewport_rect(relayout, raster_view["rect"])
+        patch = dash.Patch()
+        patch['layout']['images'] = tile_images(view["tile_url"], *rect)
+
+        nodes = viewport_nodes(scene, rect)
+        if len(nodes) > VIEWPORT_MAX_NODES:
+            raster_view["elements"] = []
+            status = f"{len(nodes)} nodes in view: zoom in to {VIEWPORT_MAX_NODES} or fewer to interact with them."
+        else:
+            raster_view["elements"] = viewport_elements(scene, nodes, view["g_dict"])
+            status = f"{len(nodes)} nodes in view."
+
+        # The neighborhood view stays until the whole network is chosen again
+        elements = dash.no_update if hops else raster_view["elements"]
+        return patch, elements, dash.html.P(status)
+
+def progressive():
+    """Whether /visualize answers at once with a preview and fills in the analysis as it finishes (NETWORK_PROGRESSIVE=0 waits for it)"""
+    return os.environ.get("NETWORK_PROGRESSIVE", "1") != "0"
+
+analysis = None # Progressive analysis of the network in the Dash app (see start_analysis)
+analysis_lock = threading.Lock()
+
+def measures_update(values, stage, value):
+    """Folds a finished stage into the values of the measures sidebar (templates/measures.html)"""
+    if stage == "centrality":
+        values.update(central_actors=value, central_measure="Betweenness centrality")
+    elif stage == "ei":
+        values["ei_indices"] = [(attr_name, result["network"], result["groups"], None) for attr_name, result in value.items()]
+    elif stage == "structure":
+        values["metrics"] = value
+        if value:
+            values["network_density"] = value["density"]
+    elif stage == "density":
+        values["network_density"] = value
+    elif stage == "ei_tests":
+        values["ei_indices"] = [(attr_name, ei_index, group_indices, value[attr_name])
+                                for attr_name, ei_index, group_indices, _ in values["ei_indices"]]
+    elif stage == "graph":
+        values["preview"] = False
+
+def analyse(dataset, report):
+    """Runs the whole analysis of a dataset in one analysis slot, calling report(stage, value) as the stages finish"""
+    from calc_render import network_calculations
+    from temp_ei import ei_test
+
+    # One analysis slot per request; the stages themselves run in the worker processes
+    with admitted():
+        G, df2, adj_matrix_df, plan, ei_results, metrics = create_network_graph(dataset, report)
+        if not metrics:
+            report("density", network_calculations(G))
+
+        # Exact significance test of each attribute's E-I index against random tie placement
+        aligned_attributes = df2.reindex(adj_matrix_df.index)
+        ei_jobs = {attr_name: submit_cached(dataset["id"], "ei_test", {"attribute": attr_name}, ei_test, adj_matrix_df,
+                                            aligned_attributes[attr_name]) for attr_name in df2.columns}
+        report("ei_tests", {attr_name: job.result() for attr_name, job in ei_jobs.items()})
+
+def start_analysis(dataset, plan, etag):
+    """Shows a preview of the dataset in the Dash app and runs its analysis on a background thread.
+    Returns the progress of the analysis; one already running, or finished and still shown, is reused."""
+    global analysis, layout_etag
+    from calc_render import preview_dash
+    from preview import preview_network
+    import results_store
+
+    with analysis_lock:
+        current = analysis
+        if current is not None and current["etag"] == etag and not current["error"] and (not current["done"] or layout_etag == etag):
+            return current
+
+        # The force layout of an earlier analysis of this dataset, if the results store still has it
+        positions = None
+        if plan["stages"]["layout"]["variant"] != "skip":
+            positions = results_store.lookup(dataset["id"], "layout", plan["stages"]["layout"])
+            if positions is results_store.MISSING:
+                positions = None
+
+        preview = preview_network(dataset["matrix"], positions)
+        values = {"preview": True, "network_density": preview["density"], "metrics": None, "ei_indices": [],
+                  "central_actors": preview["central_actors"], "central_measure": "Degree"}
+        current = {"dataset_id": dataset["id"], "etag": etag, "values": values, "done": False, "error": None}
+        analysis = current
+
+        layout_etag = None
+        get_dash_app().layout = preview_dash(preview["elements"], f"Preview: the {preview['shown']} highest-degree of "
+                                             f"{preview['nodes']} nodes. The full network appears when the analysis finishes.")
+
+    threading.Thread(target=run_analysis, args=(current, dataset), daemon=True).start()
+    return current
+
+def run_analysis(current, dataset):
+    """Background thread of start_analysis"""
+    global layout_etag
+    try:
+        analyse(dataset, lambda stage, value: measures_update(current["values"], stage, value))
+        with analysis_lock:
+            if analysis is current:
+                layout_etag = current["etag"]
+    except (MemoryBudgetError, ServerBusyError) as e:
+        current["error"] = str(e)
+    except Exception:
+        app.logger.exception("Analysis of dataset %s failed", dataset["id"])
+        current["error"] = "The analysis of this network failed."
+    current["done"] = True
 
 @app.route('/visualize', methods = ['GET', 'POST'])
 # @app.route('/visualize/<node_id>', methods=['GET', 'POST']) 
 def visualize(node_id = None):
-    filenames = session.get("filenames", {})  # Retrieve filenames from session
-    
-    G, df2, adj_matrix_df = create_network_graph(filenames)
-
-    density = network_calculations(G) 
-
-    network_density = density
-
-    attribute_names = df2.columns.tolist()
-
-    df2.rename(columns={df2.columns[0]: "State"}, inplace=True)
-    attributes = df2.to_numpy()
-    
-    
-
-    attributes_col = []
-    ei_indices = []
-    for i in range(len(attributes[0])):
-        for row in attributes:
-            attributes_col.append(row[i])
-        ei_index = calc_ei(adj_matrix_df, attributes_col)
-        ei_indices.append(ei_index)
-
-    return render_template('visuals.html', network_density=network_density, 
-                           ei_indices=zip(attribute_names, ei_indices)) 
+    global layout_etag
+    dataset = find_dataset(session.get("dataset"))  # Retrieve the parsed upload from session
+    if dataset is None:
+        return render_template('index.html', error = "Please upload a network to visualize")
+
+    try:
+        plan = dataset_plan(dataset)
+    except MemoryBudgetError as e:
+        return render_template('index.html', error = str(e))
+
+    # The page only changes with the dataset and the analysis plan; a repeat view of the analysis
+    # the Dash app is already showing is answered with 304 Not Modified
+    etag = analysis_etag(dataset["id"], plan["stages"])
+    if etag == layout_etag and not_modified(request, etag):
+        return tag_response(make_response("", 304), etag)
+
+    # Answer at once with the preview; the page polls /progress for the stages as they finish
+    if progressive():
+        current = start_analysis(dataset, plan, etag)
+        response = make_response(render_template('visuals.html', progress=not current["done"], **current["values"]))
+        return tag_response(response, etag) if current["done"] else response
+
+    values = {"preview": False, "network_density": None, "metrics": None, "ei_indices": [], "central_actors": [], "central_measure": None}
+    try:
+        analyse(dataset, lambda stage, value: measures_update(values, stage, value))
+    except MemoryBudgetError as e:
+        return render_template('index.html', error = str(e))
+    except ServerBusyError as e:
+        return render_template('index.html', error = str(e)), 503, {"Retry-After": "10"}
+
+    layout_etag = etag
+    response = make_response(render_template('visuals.html', progress=False, **values))
+    return tag_response(response, etag)
+
+def raster_scene(dataset, plan):
+    """The tile scene of a dataset: from this process, or rebuilt from its layout in the results store.
+    None while the layout has not been computed."""
+    from raster_tiles import build_scene
+    import results_store
+
+    scene = raster_scenes.get(dataset["id"])
+    if scene is None:
+        positions = None
+        if plan["stages"]["layout"]["variant"] != "skip":
+            positions = results_store.lookup(dataset["id"], "layout", plan["stages"]["layout"])
+            if positions is results_store.MISSING:
+                return None
+        scene = raster_scenes[dataset["id"]] = build_scene(dataset["matrix"], positions)
+    return scene
+
+@app.route('/tiles/<dataset_id>/<int:z>/<int:x>/<int:y>.png', methods = ['GET'])
+def tile(dataset_id, z, x, y):
+    """One map tile of a network drawn on the server (see raster_tiles), cached per zoom level in the results store"""
+    from raster_tiles import valid_tile, tile_png
+    import results_store
+
+    dataset = find_dataset(dataset_id)
+    if dataset is None or not valid_tile(z, x, y):
+        return make_response("", 404)
+
+    # A tile only changes with the layout it is drawn from
+    plan = dataset_plan(dataset)
+    params = {"layout": plan["stages"]["layout"], "z": z, "x": x, "y": y}
+    etag = analysis_etag(dataset_id, "tile", params)
+    if not_modified(request, etag):
+        return tag_response(make_response("", 304), etag)
+
+    png = results_store.lookup(dataset_id, "tile", params)
+    if png is results_store.MISSING:
+        scene = raster_scene(dataset, plan)
+        if scene is None:
+            return make_response("", 404)
+        png = tile_png(scene, z, x, y)
+        results_store.store(dataset_id, "tile", params, png)
+
+    response = make_response(png)
+    response.headers["Content-Type"] = "image/png"
+    return tag_response(response, etag)
+
+@app.route('/progress', methods = ['GET'])
+def progress():
+    """The measures sidebar of the analysis in progress, and whether the full network and every stage are done"""
+    current = analysis
+    if current is None or current["dataset_id"] != session.get("dataset"):
+        return jsonify({"error": "Please upload a network to visualize"}), 404
+    return jsonify({"html": render_template('measures.html', **current["values"]), "graph": not current["values"]["preview"],
+                    "done": current["done"], "error": current["error"]})
+
+@app.route('/waves', methods = ['GET'])
+def show_waves():
+    """Density, E-I indices and the most central actors of every wave of the uploaded longitudinal network"""
+    from longitudinal import analyse_waves
+
+    longitudinal = find_panel(session.get("waves"))
+    if longitudinal is None:
+        return render_template('index.html', error = "Please upload the waves of a network")
+
+    try:
+        with admitted():
+            results = submit_cached(longitudinal["id"], "waves", {}, analyse_waves, longitudinal).result()
+    except ServerBusyError as e:
+        return render_template('index.html', error = str(e)), 503, {"Retry-After": "10"}
+
+    attributes = sorted({attr_name for result in results for attr_name in result["ei_indices"]})
+    for result in results:
+        result["top_betweenness"] = sorted(result["betweenness"].items(), key=lambda item: -item[1])[:3]
+    return render_template('waves.html', results=results, attributes=attributes)
+
+@app.route('/waves/<int:wave>', methods = ['GET'])
+def open_wave(wave):
+    """Opens one wave of the longitudinal network in the usual visualization"""
+    from graph_store import share_dataset
+    from longitudinal import wave_dataset, wave_dataset_id
+
+    longitudinal = find_panel(session.get("waves"))
+    if longitudinal is None or not 0 <= wave < len(longitudinal["names"]):
+        return redirect(url_for('show_waves'))
+
+    dataset_id = wave_dataset_id(longitudinal, wave)
+    if find_dataset(dataset_id) is None:
+        remember_dataset(share_dataset(wave_dataset(longitudinal, wave)))
+    session["dataset"] = dataset_id
+    return redirect(url_for('visualize'))
+
+@app.route('/edit', methods = ['POST'])
+def edit_network():
+    """Applies one edit (add/remove a tie or actor, change a weight) to the current network
+    and returns the updated metrics as JSON"""
+    import live_graph
+
+    import results_store
+
+    dataset_id = session.get("dataset")
+    edit = request.get_json(silent=True) or {}
+    action = edit.get("action")
+    if action not in live_graph.EDIT_FIELDS:
+        return jsonify({"error": f"Unknown action: {action}"}), 400
+    missing = [field for field in live_graph.EDIT_FIELDS[action] if field not in edit]
+    if missing:
+        return jsonify({"error": f"Missing field: {missing[0]}"}), 400
+
+    with edit_lock:
+        live = find_live_graph(dataset_id)
+        if live is None:
+            return jsonify({"error": "Please upload a network to edit"}), 404
+
+        if results_store.enabled():
+            edits = results_store.append(dataset_id, "edits", {}, edit)
+            if len(edits) <= len(live["edits"]):
+                # The log was evicted from the store since this process last read it: start over from the upload
+                live_graphs.pop(dataset_id, None)
+                live = find_live_graph(dataset_id)
+        else:
+            edits = live["edits"] + [edit]
+        error = replay_edits(live, edits)[-1]
+
+        if isinstance(error, LookupError):
+            return jsonify({"error": f"Unknown node: {error.args[0]}"}), 404
+        if error is not None:
+            return jsonify({"error": str(error)}), 400
+
+        result = live_graph.summary(live)
+        result["degree_centrality"] = {node: live_graph.degree_centrality(live, node)
+                                       for node in (edit.get("source"), edit.get("target"), edit.get("node"))
+                                       if node in live["degrees"]}
+    return jsonify(result)
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Each request gets its own thread; heavy stages go to the job_pool worker processes
+    app.run(host="0.0.0.0", port=5000, debug=True, threaded=True)
@@ -0,0 +1,66 @@
+#Categorical encoding of node attributes
+#
+# Attributes are factorized once when they are read: every column becomes a pandas categorical, i.e. an
+# int8/int16 code per node plus a dictionary of the distinct values. Group comparisons (E-I, mixing
+# matrices, coloring) then work on the integer codes, and string categories need no special handling.
+
+import numpy as np
+import pandas as pd
+
+def code_dtype(num_categories):
+    """
+    Smallest signed integer type holding every code and -1 for missing values
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def encode_column(column):
+    """
+    Converts one attribute column to a categorical. Categories are sorted where the values allow it,
+    so numeric codes keep their order; pandas picks int8 or int16 codes by the number of categories.
+    """
+    categories = pd.unique(column.dropna()).tolist()
+    # Whole numbers read as floats (because of a missing value) stay whole numbers
+    if categories and all(isinstance(value, float) and value.is_integer() for value in categories):
+        column = column.astype("Int64")
+        categories = [int(value) for value in categories]
+    try:
+        categories = sorted(categories)
+    except TypeError:
+        pass
+    return column.astype(pd.CategoricalDtype(categories))
+
+def encode_attributes(attributes):
+    """
+    Converts every attribute column to a categorical; the index (node names) is left as it is
+    """
+    return pd.DataFrame({attr_name: encode_column(attributes[attr_name]) for attr_name in attributes.columns},
+                        index=attributes.index)
+
+def attribute_codes(attribute_column):
+    """
+    Integer code of each node's attribute value (-1 where it is missing) and the list of categories.
+    Categorical columns are used as they are; anything else is factorized here.
+    """
+    if isinstance(attribute_column, (pd.Series, pd.Categorical)) and isinstance(attribute_column.dtype, pd.CategoricalDtype):
+        categorical = pd.Categorical(attribute_column)
+        return np.asarray(categorical.codes), list(categorical.categories)
+
+    codes, categories = pd.factorize(pd.Series(np.asarray(attribute_column, dtype=object).ravel()))
+    return codes.astype(code_dtype(len(categories))), list(categories)
+
+def category_dictionary(attributes):
+    """
+    Category list of every attribute column: code -> value
+    """
+    return {attr_name: list(attributes[attr_name].cat.categories) for attr_name in attributes.columns}
+
+def attribute_value(value):
+    """
+    A plain Python value for graph_dict and the Dash elements (numpy scalars are not JSON-serializable)
+    """
+    if pd.isna(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
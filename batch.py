@@ -0,0 +1,217 @@
+#Headless batch analysis of many networks at once
+#
+# Every relational CSV in the input directory is paired with the attribute CSV of the same name plus
+# --attribute-suffix (campnet.csv + campnet_attributes.csv). Each pair is analysed in a worker process
+# and written to the output directory as <name>.json (network measures) and <name>_nodes.parquet
+# (node measures; CSV when pyarrow is not installed), with summary.csv over all datasets.
+# A dataset whose files and options are unchanged since its last run is read back instead of recomputed.
+#
+#   python batch.py networks/ results/ --workers 8 --blockmodeling
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Bumped when the analysis changes, so older results are recomputed
+RESULTS_VERSION = 2
+
+def find_datasets(input_dir, attribute_suffix="_attributes"):
+    """
+    Pairs every relational CSV in input_dir with its attribute CSV.
+    Returns a list of (name, relational path, attribute path) sorted by name; datasets without attributes are skipped.
+    """
+    files = {os.path.splitext(name)[0]: os.path.join(input_dir, name)
+             for name in os.listdir(input_dir) if name.lower().endswith(".csv")}
+
+    datasets = []
+    for name, path in sorted(files.items()):
+        if name.endswith(attribute_suffix):
+            continue
+        attribute_path = files.get(name + attribute_suffix)
+        if attribute_path is None:
+            print(f"[batch] skipping {name}: no {name}{attribute_suffix}.csv", flush=True)
+            continue
+        datasets.append((name, path, attribute_path))
+
+    return datasets
+
+def dataset_key(relational_path, attribute_path, options):
+    """
+    Hash of both files and the analysis options, used to skip datasets that were already analysed
+    """
+    digest = hashlib.sha1(json.dumps([RESULTS_VERSION, options], sort_keys=True).encode())
+    # Each file is hashed on its own, so the key tells apart different splits of the same bytes
+    for path in (relational_path, attribute_path):
+        file_digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                file_digest.update(block)
+        digest.update(file_digest.digest())
+    return digest.hexdigest()
+
+def cached_result(result_path, key):
+    """
+    The stored result for this key, or None if there is none or it is out of date
+    """
+    if not os.path.exists(result_path):
+        return None
+    try:
+        with open(result_path) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return result if result.get("key") == key else None
+
+def write_node_table(nodes, output_path):
+    """
+    Writes the node measures as Parquet, or as CSV if no Parquet engine is installed. Returns the path written.
+    """
+    try:
+        nodes.to_parquet(output_path + ".parquet")
+        return output_path + ".parquet"
+    except ImportError:
+        nodes.to_csv(output_path + ".csv")
+        return output_path + ".csv"
+
+def analyze_dataset(name, relational_path, attribute_path, output_dir, options):
+    """
+    Runs the analysis of one dataset and writes its results. Runs in a worker process.
+    Returns the network-level result dictionary (also stored as <name>.json).
+    """
+    key = dataset_key(relational_path, attribute_path, options)
+    result_path = os.path.join(output_dir, f"{name}.json")
+    result = cached_result(result_path, key)
+    if result is not None:
+        result["cached"] = True
+        return result
+
+    import pandas as pd
+    from calc_render import read_input, make_x_graph, node_calculation, network_calculations
+    from memory_budget import plan_analysis
+    from bit_matrix import is_binary
+    from temp_ei import ei_test
+
+    start = time.perf_counter()
+    g_dict, df2, adj_matrix_df = read_input(relational_path, attribute_path)
+    G = make_x_graph(g_dict)
+    plan = plan_analysis(G.number_of_nodes(), G.number_of_edges(), binary=is_binary(adj_matrix_df))
+
+    degree_centrality, betweenness_centrality, closeness_centrality = node_calculation(
+        G, betweenness_samples=plan["stages"]["centrality"].get("samples"))
+    nodes = pd.DataFrame({
+        "degree_centrality": degree_centrality,
+        "betweenness_centrality": betweenness_centrality,
+        "closeness_centrality": closeness_centrality,
+    }).reindex(adj_matrix_df.index)
+
+    # E-I index of every attribute, on the attribute column aligned with the matrix rows
+    aligned_attributes = df2.reindex(adj_matrix_df.index)
+    ei_indices = {}
+    for attr_name in df2.columns:
+        observed_ei, p_value, confidence_interval, permutations = ei_test(adj_matrix_df, aligned_attributes[attr_name],
+                                                                          num_permutations=options["permutations"],
+                                                                          method=options["ei_method"])
+        ei_indices[str(attr_name)] = {"ei_index": float(observed_ei), "p_value": float(p_value),
+                                      "confidence_interval": [float(value) for value in confidence_interval],
+                                      "permutations": int(permutations)}
+
+    result = {
+        "dataset": name,
+        "key": key,
+        "nodes": G.number_of_nodes(),
+        "ties": G.number_of_edges(),
+        "density": network_calculations(G),
+        "ei_indices": ei_indices,
+    }
+
+    if options["blockmodeling"]:
+        from blockmodeling import network_blocks
+
+        variant = plan["stages"]["blockmodeling"]["variant"]
+        if variant == "skip" or G.number_of_nodes() < 2:
+            result["blocks"] = None
+        else:
+            img_matrix, labels, _ = network_blocks(adj_matrix_df, variant,
+                                                   block_rows=plan["stages"]["blockmodeling"].get("block_rows"))
+            nodes["block"] = labels
+            result["blocks"] = {"variant": variant, "num_blocks": len(set(labels)),
+                                "image_matrix": img_matrix.tolist()}
+
+    result["node_table"] = os.path.basename(write_node_table(nodes, os.path.join(output_dir, f"{name}_nodes")))
+    result["seconds"] = round(time.perf_counter() - start, 3)
+
+    with open(result_path, "w") as f:
+        json.dump(result, f, indent=2)
+
+    result["cached"] = False
+    return result
+
+def summary_row(result):
+    """
+    One row of summary.csv
+    """
+    row = {key: result.get(key) for key in ("dataset", "status", "cached", "nodes", "ties", "density", "seconds")}
+    for attr_name, ei in result.get("ei_indices", {}).items():
+        row[f"ei_{attr_name}"] = ei["ei_index"]
+        row[f"p_{attr_name}"] = ei["p_value"]
+    if result.get("blocks"):
+        row["num_blocks"] = result["blocks"]["num_blocks"]
+    return row
+
+def run_batch(input_dir, output_dir, workers=None, options=None, attribute_suffix="_attributes"):
+    """
+    Analyses every dataset in input_dir across a pool of worker processes and writes summary.csv.
+    Returns the list of per-dataset results; failed datasets get status "error" instead of stopping the batch.
+    """
+    import pandas as pd
+
+    options = dict({"permutations": 100, "ei_method": "analytic", "blockmodeling": False}, **(options or {}))
+    os.makedirs(output_dir, exist_ok=True)
+    datasets = find_datasets(input_dir, attribute_suffix)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_dataset, name, relational_path, attribute_path, output_dir, options): name
+                   for name, relational_path, attribute_path in datasets}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+                result["status"] = "ok"
+            except Exception as e:
+                result = {"dataset": name, "status": f"error: {e}"}
+            results.append(result)
+            print(f"[batch] {name}: {'cached' if result.get('cached') else result['status']}", flush=True)
+
+    results.sort(key=lambda result: result["dataset"])
+    pd.DataFrame([summary_row(result) for result in results]).to_csv(os.path.join(output_dir, "summary.csv"), index=False)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse a directory of relational/attribute CSV pairs in parallel")
+    parser.add_argument("input_dir", help="directory of relational CSVs and their attribute CSVs")
+    parser.add_argument("output_dir", help="directory for the per-dataset results and summary.csv")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--attribute-suffix", default="_attributes",
+                        help="name suffix of the attribute CSVs (default: _attributes)")
+    parser.add_argument("--ei-method", choices=["analytic", "sequential", "permutation"], default="analytic",
+                        help="E-I significance test (see temp_ei.ei_test)")
+    parser.add_argument("--permutations", type=int, default=100,
+                        help="permutations for --ei-method permutation, the most for --ei-method sequential")
+    parser.add_argument("--blockmodeling", action="store_true", help="also compute blocks and the image matrix")
+    args = parser.parse_args()
+
+    options = {"permutations": args.permutations, "ei_method": args.ei_method, "blockmodeling": args.blockmodeling}
+    results = run_batch(args.input_dir, args.output_dir, args.workers, options, args.attribute_suffix)
+
+    failed = [result for result in results if result["status"] != "ok"]
+    cached = sum(1 for result in results if result.get("cached"))
+    print(f"[batch] {len(results)} datasets, {cached} cached, {len(failed)} failed", flush=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
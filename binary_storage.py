@@ -0,0 +1,210 @@
+#Binary on-disk format for network data, readable through np.memmap without parsing or copying
+#
+# Each stored object is a directory of .npy files plus a small meta.json:
+#   dense  - values.npy (n x m matrix), labels.npy, columns.npy
+#   csr    - indptr.npy, indices.npy, data.npy (CSR triplets), labels.npy, columns.npy
+#   table  - table.npy, a structured array with one typed field per attribute column
+#
+# The format is written and read by the file functions of reading_data, transforming_data and blockmodeling;
+# the web app keeps parsed uploads in shared memory instead (see graph_store).
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# pandas' name for the blank first header cell of a matrix CSV, which holds the node labels
+UNNAMED_LABELS = "Unnamed: 0"
+
+def label_array(labels):
+    """
+    Converts node labels to a fixed-width unicode array, which can be memory-mapped
+    """
+    return np.array([str(label) for label in labels], dtype=str)
+
+def write_meta(output_path, meta):
+    """
+    Writes meta.json, removing arrays left over from an object previously saved at the same path
+    """
+    os.makedirs(output_path, exist_ok=True)
+    for name in os.listdir(output_path):
+        if name.endswith(".npy"):
+            os.remove(os.path.join(output_path, name))
+    with open(os.path.join(output_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+def read_meta(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f)
+
+def split_labels(frame):
+    """
+    Splits a matrix DataFrame into its node labels and numeric values.
+    If the first column holds the labels (as when a matrix CSV is read without index_col) it is used, otherwise the index.
+    """
+    if len(frame.columns) > 0 and not pd.api.types.is_numeric_dtype(frame.iloc[:, 0]):
+        return frame.iloc[:, 0].to_numpy(), frame.iloc[:, 1:]
+    return frame.index.to_numpy(), frame
+
+def save_dense_matrix(matrix, output_path, labels=None, columns=None, label_name=None):
+    """
+    Saves a dense matrix as values.npy in the output_path directory.
+    label_name is the name of the label column the matrix was read with, kept for load_matrix_frame.
+    """
+    values = np.ascontiguousarray(np.asarray(matrix))
+    if labels is None:
+        labels = range(values.shape[0])
+    if columns is None:
+        columns = labels if values.shape[0] == values.shape[1] else range(values.shape[1])
+
+    write_meta(output_path, {"format": "dense", "shape": list(values.shape), "dtype": values.dtype.str,
+                             "label_name": label_name})
+    np.save(os.path.join(output_path, "values.npy"), values)
+    np.save(os.path.join(output_path, "labels.npy"), label_array(labels))
+    np.save(os.path.join(output_path, "columns.npy"), label_array(columns))
+
+    return output_path
+
+def save_sparse_matrix(matrix, output_path, labels=None, columns=None, label_name=None):
+    """
+    Saves a scipy sparse matrix as CSR triplets (indptr, indices, data) in the output_path directory.
+    label_name is the name of the label column the matrix was read with, kept for load_matrix_frame.
+    """
+    import scipy.sparse
+
+    matrix = scipy.sparse.csr_matrix(matrix)
+    matrix.sort_indices()
+    if labels is None:
+        labels = range(matrix.shape[0])
+    if columns is None:
+        columns = labels if matrix.shape[0] == matrix.shape[1] else range(matrix.shape[1])
+
+    write_meta(output_path, {"format": "csr", "shape": list(matrix.shape), "nnz": int(matrix.nnz),
+                             "label_name": label_name})
+    np.save(os.path.join(output_path, "indptr.npy"), matrix.indptr)
+    np.save(os.path.join(output_path, "indices.npy"), matrix.indices)
+    np.save(os.path.join(output_path, "data.npy"), matrix.data)
+    np.save(os.path.join(output_path, "labels.npy"), label_array(labels))
+    np.save(os.path.join(output_path, "columns.npy"), label_array(columns))
+
+    return output_path
+
+def save_matrix_frame(frame, output_path, sparse=False):
+    """
+    Saves a matrix DataFrame (labels in the index or the first column) in the binary format
+    """
+    import scipy.sparse
+
+    labels, values = split_labels(frame)
+    columns = values.columns.to_numpy()
+    label_name = frame.columns[0] if len(values.columns) < len(frame.columns) else frame.index.name
+    label_name = None if label_name is None else str(label_name)
+    if sparse:
+        return save_sparse_matrix(scipy.sparse.csr_matrix(values.fillna(0).to_numpy()), output_path, labels, columns,
+                                  label_name)
+    return save_dense_matrix(values.to_numpy(), output_path, labels, columns, label_name)
+
+def save_attribute_table(attributes, output_path):
+    """
+    Saves an attribute DataFrame as a typed structured array.
+    The first column is the node id; numeric columns keep their dtype and the rest are stored as fixed-width strings.
+    """
+    fields = []
+    columns = []
+    for name in attributes.columns:
+        column = attributes[name]
+        if pd.api.types.is_bool_dtype(column) or pd.api.types.is_numeric_dtype(column):
+            values = column.to_numpy()
+        else:
+            values = label_array(column.fillna(""))
+        fields.append((str(name), values.dtype))
+        columns.append(values)
+
+    table = np.empty(len(attributes), dtype=fields)
+    for (name, _), values in zip(fields, columns):
+        table[name] = values
+
+    write_meta(output_path, {"format": "table", "rows": len(attributes), "columns": [name for name, _ in fields]})
+    np.save(os.path.join(output_path, "table.npy"), table)
+
+    return output_path
+
+def load_array(path, name):
+    """
+    Memory-maps one of the stored arrays read-only
+    """
+    return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+def open_network_data(path):
+    """
+    Opens a stored object without reading its values into memory.
+    Dense matrices come back as a read-only np.memmap, CSR matrices as a scipy csr_matrix over memory-mapped
+    arrays, and attribute tables as a memory-mapped structured array. Returns (data, labels, columns);
+    labels and columns are None for tables.
+    """
+    meta = read_meta(path)
+
+    if meta["format"] == "table":
+        return load_array(path, "table"), None, None
+
+    labels = load_array(path, "labels")
+    columns = load_array(path, "columns")
+
+    if meta["format"] == "dense":
+        return load_array(path, "values"), labels, columns
+
+    import scipy.sparse
+    matrix = scipy.sparse.csr_matrix((load_array(path, "data"), load_array(path, "indices"), load_array(path, "indptr")),
+                                     shape=tuple(meta["shape"]), copy=False)
+    return matrix, labels, columns
+
+def read_matrix_rows(path, rows):
+    """
+    Reads only the given rows of a stored matrix as a dense array, touching nothing else on disk
+    """
+    meta = read_meta(path)
+    rows = np.atleast_1d(rows)
+
+    if meta["format"] == "dense":
+        return np.array(load_array(path, "values")[rows])
+
+    indptr = load_array(path, "indptr")
+    indices = load_array(path, "indices")
+    data = load_array(path, "data")
+    result = np.zeros((len(rows), meta["shape"][1]), dtype=data.dtype)
+    for k, row in enumerate(rows):
+        start, end = indptr[row], indptr[row + 1]
+        result[k, indices[start:end]] = data[start:end]
+
+    return result
+
+def sparse_matrix_frame(matrix, labels, columns):
+    """
+    A sparse DataFrame of a scipy matrix whose absent cells read as 0, like the cells of a dense matrix
+    """
+    frame = pd.DataFrame.sparse.from_spmatrix(matrix, index=np.array(labels), columns=np.array(columns))
+    return frame.astype(pd.SparseDtype(matrix.dtype, 0))
+
+def load_matrix_frame(path, labels_as_column=False):
+    """
+    Loads a stored matrix as a DataFrame indexed by node labels. Dense values stay memory-mapped.
+    With labels_as_column the labels come back as the first column instead, the shape of a matrix CSV
+    read without index_col.
+    """
+    matrix, labels, columns = open_network_data(path)
+    if hasattr(matrix, "tocoo"):
+        frame = sparse_matrix_frame(matrix, labels, columns)
+    else:
+        frame = pd.DataFrame(matrix, index=np.array(labels), columns=np.array(columns), copy=False)
+
+    if labels_as_column:
+        frame = frame.reset_index(names=read_meta(path).get("label_name") or UNNAMED_LABELS)
+    return frame
+
+def load_attribute_table(path):
+    """
+    Loads a stored attribute table as a DataFrame indexed by its first column
+    """
+    table, _, _ = open_network_data(path)
+    frame = pd.DataFrame({name: np.asarray(table[name]) for name in table.dtype.names})
+    return frame.set_index(frame.columns[0])
@@ -0,0 +1,134 @@
+#Bit-packed adjacency for binary networks
+#
+# A binary network needs one bit per cell rather than a float64: every row is packed with np.packbits into
+# 64-bit words, 64x smaller than the dense matrix. Tie counts become popcounts of AND-ed rows and group masks,
+# and the matches similarity of two rows is the popcount of their XOR.
+
+import numpy as np
+import scipy.sparse
+
+from temp_e_i import as_sparse
+
+WORD_BITS = 64
+
+# Rows unpacked to booleans at once while packing a matrix
+PACK_CHUNK_ROWS = 512
+
+def num_words(num_columns):
+    return -(-num_columns // WORD_BITS)
+
+def pack_rows(rows):
+    """
+    Packs a 2-D boolean array into 64-bit words, one row of words per row; the padding bits are 0
+    """
+    rows = np.asarray(rows, dtype=bool)
+    packed = np.zeros((rows.shape[0], num_words(rows.shape[1]) * 8), dtype=np.uint8)
+    bits = np.packbits(rows, axis=1)
+    packed[:, :bits.shape[1]] = bits
+    return packed.view(np.uint64)
+
+def popcount(words):
+    """
+    Number of set bits along the last axis
+    """
+    return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+def is_binary(matrix):
+    """
+    True if every cell of the matrix (dense, sparse or a sparse DataFrame) is 0 or 1
+    """
+    sparse_matrix = as_sparse(matrix)
+    if sparse_matrix is not None:
+        return bool(np.all((sparse_matrix.data == 0) | (sparse_matrix.data == 1)))
+    try:
+        values = np.asarray(matrix, dtype=float)
+    except (TypeError, ValueError):
+        return False
+    return bool(np.all((values == 0) | (values == 1)))
+
+def chunk_rows(matrix, symmetric=False):
+    """
+    Yields (start, boolean rows) of the matrix PACK_CHUNK_ROWS at a time, never densifying more than one chunk.
+    symmetric ORs every cell with its transpose (a tie in either direction), as clean_matrix does.
+    """
+    sparse_matrix = as_sparse(matrix)
+    if sparse_matrix is not None:
+        rows = sparse_matrix.tocsr()
+        columns = rows.T.tocsr() if symmetric else None
+    else:
+        values = np.asarray(matrix, dtype=float)
+
+    n = matrix.shape[0]
+    for start in range(0, n, PACK_CHUNK_ROWS):
+        stop = min(start + PACK_CHUNK_ROWS, n)
+        if sparse_matrix is not None:
+            chunk = np.zeros((stop - start, matrix.shape[1]), dtype=bool)
+            block = rows[start:stop].tocoo()
+            chunk[block.row, block.col] = block.data > 0
+            if symmetric:
+                block = columns[start:stop].tocoo()
+                chunk[block.row, block.col] |= block.data > 0
+        else:
+            chunk = values[start:stop] > 0
+            if symmetric:
+                chunk |= values[:, start:stop].T > 0
+        yield start, chunk
+
+def pack_matrix(matrix):
+    """
+    Packs the cells of the matrix (ties in their uploaded direction, self-ties included).
+    Returns a dictionary with the words (rows x words) and the number of columns.
+    """
+    words = np.zeros((matrix.shape[0], num_words(matrix.shape[1])), dtype=np.uint64)
+    for start, chunk in chunk_rows(matrix):
+        words[start:start + len(chunk)] = pack_rows(chunk)
+    return {"words": words, "num_columns": matrix.shape[1]}
+
+def pack_ties(matrix):
+    """
+    Packs the symmetric, binary ties without self-loops, as mixing_matrix.symmetric_ties counts them
+    """
+    n = matrix.shape[0]
+    words = np.zeros((n, num_words(n)), dtype=np.uint64)
+    for start, chunk in chunk_rows(matrix, symmetric=True):
+        chunk[np.arange(len(chunk)), np.arange(start, start + len(chunk))] = False
+        words[start:start + len(chunk)] = pack_rows(chunk)
+    return {"words": words, "num_columns": n}
+
+def bit_density(ties):
+    """
+    Density of packed symmetric ties: every tie is set in both rows, so the set bits over n(n-1) ordered pairs
+    """
+    n = ties["num_columns"]
+    if n < 2:
+        return 0
+    return int(popcount(ties["words"]).sum()) / (n * (n - 1))
+
+def group_tie_counts(ties, codes, num_groups):
+    """
+    Ties from every node into every group (n x num_groups): popcount(row AND group mask).
+    codes are the integer group codes of the nodes (-1 for none); such nodes belong to no group mask.
+    """
+    words = ties["words"]
+    counts = np.zeros((words.shape[0], num_groups), dtype=np.int64)
+    for group in range(num_groups):
+        mask = pack_rows((codes == group)[None, :])[0]
+        counts[:, group] = popcount(words & mask)
+    return counts
+
+def bit_matches(packed, block_rows=None):
+    """
+    The matches similarity of every pair of rows: the share of columns where they agree,
+    1 - popcount(row_i XOR row_j) / columns. block_rows rows are compared at once to bound the memory.
+    """
+    words = packed["words"]
+    n = words.shape[0]
+    if block_rows is None:
+        block_rows = max(n, 1)
+
+    result = np.zeros((n, n))
+    for start in range(0, n, block_rows):
+        block = words[start:start + block_rows]
+        result[start:start + block_rows] = popcount(block[:, None, :] ^ words[None, :, :])
+
+    return 1 - result / packed["num_columns"]
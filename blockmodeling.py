@@ -1,9 +1,11 @@
 #Processes required for blockmodeling, positional analysis, and structural equivalence
-import networkx as nx
 import numpy as np
 import pandas as pd
 import os
-from sklearn.cluster import AgglomerativeClustering
+
+from binary_storage import save_dense_matrix, split_labels
+from bit_matrix import is_binary, pack_matrix, pack_ties, bit_matches, bit_density, group_tie_counts
+from attribute_encoding import attribute_codes, encode_column
 
 # Similarity measures for matrices
 
@@ -19,24 +21,35 @@ def pearson_correlation(matrix):
             result[i, j] = np.corrcoef(matrix.iloc[i, :], matrix.iloc[j, :])[0, 1]
     return result
 
-def matches(matrix):
+def matches(matrix, block_rows=None):
     """
     Computes the matches similarities for each cell by its row and column vectors
     Matches check for the number of times the row vector values matches with the column vector values as a percentage
     Matches are better equipped for binary data
+    Rows are compared block_rows at a time (all at once by default) to bound the size of the comparison array
+    Binary matrices are compared as bit-packed rows, by XOR and popcount (see bit_matrix)
     """
-    n = matrix.shape[0]
+    if is_binary(matrix):
+        return bit_matches(pack_matrix(matrix), block_rows)
+
+    values = np.asarray(matrix)
+    n = values.shape[0]
+    if block_rows is None:
+        block_rows = max(n, 1)
+
     result = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            matches = np.sum(matrix.iloc[i, :] == matrix.iloc[j, :])
-            result[i, j] = matches / matrix.shape[1]
+    for start in range(0, n, block_rows):
+        block = values[start:start + block_rows]
+        result[start:start + block_rows] = np.sum(block[:, None, :] == values[None, :, :], axis=2)
+    result /= values.shape[1]
+
     return result
 
 def agglomerative_clustering(similarity_matrix, num_blocks=2):
     """
     Runs a hierarchical agglomerative clustering algorithm on the similarity matrix
     """
+    from sklearn.cluster import AgglomerativeClustering
 
     # Convert the similarity matrix to a distance matrix
     distance_matrix = 1 - similarity_matrix
@@ -49,12 +62,12 @@ def agglomerative_clustering(similarity_matrix, num_blocks=2):
 
     return labels
 
-def binary_hierarchical_clustering(matrix, num_blocks=2):
+def binary_hierarchical_clustering(matrix, num_blocks=2, block_rows=None):
     """
     Performs hierarchical clustering on a binary matrix using the matches similarity measure.
     """
     # Compute the similarity matrix using matches
-    similarity_matrix = matches(matrix)
+    similarity_matrix = matches(matrix, block_rows)
 
     # Perform agglomerative clustering
     labels = agglomerative_clustering(similarity_matrix, num_blocks)
@@ -94,15 +107,22 @@ def organize_label(labels):
 
     return sorted(labels)
 
+def sort_codes(column):
+    """
+    Categorical codes of a column, whose categories are sorted (see attribute_encoding), with missing values last
+    """
+    codes, categories = attribute_codes(encode_column(column))
+    return np.where(codes >= 0, codes, len(categories))
+
 def organize_blocks(matrix, attribute_matrix):
     """
     Organize the rows in matrix by the block value in the attribute matrix
     """
-    # Sort the attribute matrix by 'Block' and then by the first column alphabetically
-    sorted_attributes = attribute_matrix.sort_values(by=['Block', attribute_matrix.columns[0]])
+    # Sort by the codes of 'Block' and then of the first column, whose categories are in alphabetical order
+    order = np.lexsort((sort_codes(attribute_matrix[attribute_matrix.columns[0]]), sort_codes(attribute_matrix['Block'])))
 
     # Reorder the rows in the matrix based on the sorted attribute matrix
-    sorted_matrix = matrix.loc[sorted_attributes.index, :]
+    sorted_matrix = matrix.loc[attribute_matrix.index[order], :]
 
     return sorted_matrix
 
@@ -110,8 +130,8 @@ def reduced_block_matrix(matrix):
     """
     Returns a reduced block matrix, a matrix with individual blocks as rows and columns with the values representing their densities
     """
-    # Get the unique blocks
-    unique_blocks = np.unique(matrix.iloc[:, -1])
+    # Get the unique blocks and the block code of every row
+    unique_blocks, block_codes = np.unique(matrix.iloc[:, -1], return_inverse=True)
 
     # Initialize the reduced block matrix
     reduced_matrix = np.zeros((len(unique_blocks), len(unique_blocks)))
@@ -120,8 +140,8 @@ def reduced_block_matrix(matrix):
     for i, block_i in enumerate(unique_blocks):
         for j, block_j in enumerate(unique_blocks):
             # Get the indices of the nodes in each block
-            indices_i = np.where(matrix.iloc[:, -1] == block_i)[0]
-            indices_j = np.where(matrix.iloc[:, -1] == block_j)[0]
+            indices_i = np.flatnonzero(block_codes == i)
+            indices_j = np.flatnonzero(block_codes == j)
 
             # Calculate the density between the two blocks
             density = np.sum(np.sum(matrix.iloc[indices_i, indices_j].applymap(lambda x: x if isinstance(x, (int, float)) else 0))) / ((i - j) ** 2)
@@ -140,12 +160,13 @@ def image_matrix(reduced_matrix, alpha=0.5):
 
     return image_matrix
 
-def binary_blockmodeling(matrix, num_blocks=2):
+def binary_blockmodeling(matrix, num_blocks=2, block_rows=None):
     """
     Performs blockmodeling on a binary matrix using hierarchical clustering.
+    block_rows limits the memory of the similarity computation (see memory_budget.plan_analysis)
     """
     # Perform hierarchical clustering on the binary matrix
-    labels = binary_hierarchical_clustering(matrix, num_blocks)
+    labels = binary_hierarchical_clustering(matrix, num_blocks, block_rows)
     #print("Labels:", labels)
 
     # Label the blocks in the attribute matrix
@@ -170,25 +191,233 @@ def binary_blockmodeling(matrix, num_blocks=2):
 
     return (img_matrix, labels)
 
+# Community detection: a near-linear alternative to structural-equivalence blocks for large networks
+
+def community_ties(matrix):
+    """
+    Returns the matrix as a symmetric, weighted scipy CSR matrix without self-loops.
+    Dense matrices may hold the node names in their first column, as for binary_blockmodeling.
+    """
+    import scipy.sparse
+    from temp_e_i import as_sparse
+
+    ties = as_sparse(matrix)
+    if ties is None:
+        _, values = split_labels(matrix) if isinstance(matrix, pd.DataFrame) else (None, matrix)
+        ties = scipy.sparse.coo_matrix(np.nan_to_num(np.asarray(values, dtype=float)))
+
+    ties = ties.tocoo()
+    off_diagonal = ties.row != ties.col
+    ties = scipy.sparse.csr_matrix((np.abs(ties.data[off_diagonal]).astype(float),
+                                    (ties.row[off_diagonal], ties.col[off_diagonal])), shape=ties.shape)
+    ties = ties.maximum(ties.T).tocsr()
+    ties.eliminate_zeros()
+    return ties
+
+def local_moving(ties, resolution=1.0, rng=None, max_passes=10):
+    """
+    Moves each node to the neighboring community with the largest modularity gain until no node moves.
+    ties may have self-loops (from aggregation); returns community labels 0..k-1 and whether any node moved.
+    The loop runs over plain lists, which is much faster than numpy calls on a handful of neighbors at a time.
+    """
+    n = ties.shape[0]
+    indptr = ties.indptr.tolist()
+    indices = ties.indices.tolist()
+    weights = ties.data.tolist()
+    degrees = np.asarray(ties.sum(axis=1)).ravel().tolist()
+    scale = resolution / sum(degrees)  # resolution / 2m
+
+    communities = list(range(n))
+    community_degrees = list(degrees)
+    order = rng.permutation(n).tolist()
+    moved_any = False
+
+    for _ in range(max_passes):
+        moved = 0
+        for node in order:
+            # Weight from the node into each neighboring community
+            links = {}
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[k]
+                if neighbor != node:
+                    community = communities[neighbor]
+                    links[community] = links.get(community, 0) + weights[k]
+            if not links:
+                continue
+
+            current = communities[node]
+            degree = degrees[node]
+            community_degrees[current] -= degree
+
+            best = current
+            best_gain = links.get(current, 0) - community_degrees[current] * degree * scale
+            for community, weight in links.items():
+                gain = weight - community_degrees[community] * degree * scale
+                if gain > best_gain + 1e-12:
+                    best, best_gain = community, gain
+
+            communities[node] = best
+            community_degrees[best] += degree
+            if best != current:
+                moved += 1
+
+        if moved == 0:
+            break
+        moved_any = True
+
+    _, communities = np.unique(communities, return_inverse=True)
+    return communities, moved_any
+
+def louvain_communities(matrix, resolution=1.0, seed=0):
+    """
+    Louvain modularity communities: local moving on a CSR graph, then each community collapsed into one node, until
+    nothing moves. Every pass is linear in the ties, so this runs on networks far beyond binary_blockmodeling.
+    Returns labels numbered from 1 in row order, like binary_hierarchical_clustering.
+    """
+    import scipy.sparse
+
+    ties = community_ties(matrix)
+    n = ties.shape[0]
+    rng = np.random.default_rng(seed)
+    labels = np.arange(n)
+
+    if ties.nnz == 0:
+        return (labels + 1).tolist()
+
+    while True:
+        communities, moved = local_moving(ties, resolution, rng)
+        if not moved:
+            break
+        labels = communities[labels]
+
+        # Collapse each community into a node; its internal ties become a self-loop
+        membership = scipy.sparse.csr_matrix((np.ones(len(communities)), (np.arange(len(communities)), communities)))
+        ties = (membership.T @ ties @ membership).tocsr()
+
+    # Number blocks by their first member, so the labels do not depend on internal ids
+    _, first = np.unique(labels, return_index=True)
+    order = np.argsort(np.argsort(first))
+    return (order[labels] + 1).tolist()
+
+def modularity(matrix, labels, resolution=1.0):
+    """
+    Modularity of a partition (labels in row order)
+    """
+    import scipy.sparse
+
+    ties = community_ties(matrix)
+    _, codes = np.unique(labels, return_inverse=True)
+    membership = scipy.sparse.csr_matrix((np.ones(len(codes)), (np.arange(len(codes)), codes)))
+    mixing = (membership.T @ ties @ membership).toarray()
+    total_weight = mixing.sum()
+    if total_weight == 0:
+        return 0
+    community_degrees = mixing.sum(axis=1)
+    return float(np.trace(mixing) / total_weight - resolution * np.sum((community_degrees / total_weight) ** 2))
+
+def sparse_block_densities(matrix, labels):
+    """
+    Reduced block matrix from the ties alone: tie density within and between every pair of blocks (blocks in label order)
+    """
+    import scipy.sparse
+
+    ties = community_ties(matrix)
+    ties.data[:] = 1
+    _, codes = np.unique(labels, return_inverse=True)
+    membership = scipy.sparse.csr_matrix((np.ones(len(codes)), (np.arange(len(codes)), codes)))
+    block_ties = (membership.T @ ties @ membership).toarray()
+
+    return block_densities(block_ties, codes)
+
+def packed_block_densities(ties, labels):
+    """
+    Reduced block matrix from bit-packed ties (bit_matrix.pack_ties): popcounts of each row against each block's mask
+    """
+    _, codes = np.unique(labels, return_inverse=True)
+    block_ties = np.zeros((codes.max() + 1, codes.max() + 1))
+    np.add.at(block_ties, codes, group_tie_counts(ties, codes, codes.max() + 1))
+
+    return block_densities(block_ties, codes)
+
+def block_densities(block_ties, codes):
+    """
+    Tie counts between blocks divided by the number of node pairs between them (ordered pairs within a block)
+    """
+    sizes = np.bincount(codes).astype(float)
+    pairs = np.outer(sizes, sizes)
+    np.fill_diagonal(pairs, sizes * (sizes - 1))
+    return np.divide(block_ties, pairs, out=np.zeros_like(block_ties), where=pairs > 0)
+
+def community_blockmodeling(matrix, resolution=1.0, alpha=None, seed=0):
+    """
+    Blockmodel from modularity communities, with the same (image matrix, labels) output as binary_blockmodeling.
+    Runs on sparse matrices and never builds an n x n array. A block pair is a 1 in the image matrix when its density
+    is above alpha, by default the density of the whole network.
+    """
+    labels = louvain_communities(matrix, resolution, seed)
+    reduced_matrix = sparse_block_densities(matrix, labels)
+
+    if alpha is None:
+        n = len(labels)
+        ties = community_ties(matrix)
+        alpha = ties.nnz / (n * (n - 1)) if n > 1 else 0
+
+    return (image_matrix(reduced_matrix, alpha), labels)
+
+def default_num_blocks(num_nodes):
+    """
+    Number of structural-equivalence blocks when none is given: about the square root of half the nodes
+    """
+    return max(2, int(round(np.sqrt(num_nodes / 2))))
+
+def network_blocks(matrix, variant="communities", block_rows=None, num_blocks=None):
+    """
+    Blocks for the collapsed view, with the blockmodeling variant chosen by memory_budget.plan_analysis:
+    "exact" and "blocked" cluster by structural equivalence, "communities" by modularity.
+    Returns (image matrix, labels, reduced block matrix); the image matrix marks block pairs denser than the network.
+    """
+    num_nodes = matrix.shape[0]
+    # Binary networks are clustered and reduced from bit-packed rows, without a dense float copy
+    packed = variant != "communities" and is_binary(matrix)
+    if variant == "communities":
+        labels = louvain_communities(matrix)
+    elif packed:
+        labels = binary_hierarchical_clustering(matrix, min(num_blocks or default_num_blocks(num_nodes), num_nodes), block_rows)
+    else:
+        values = matrix.sparse.to_dense() if hasattr(matrix, "sparse") and isinstance(matrix, pd.DataFrame) \
+            and all(isinstance(dtype, pd.SparseDtype) for dtype in matrix.dtypes) else matrix
+        labels = binary_hierarchical_clustering(values, min(num_blocks or default_num_blocks(num_nodes), num_nodes), block_rows)
+
+    if packed:
+        ties = pack_ties(matrix)
+        reduced_matrix = packed_block_densities(ties, labels)
+        density = bit_density(ties)
+    else:
+        reduced_matrix = sparse_block_densities(matrix, labels)
+        ties = community_ties(matrix)
+        density = ties.nnz / (num_nodes * (num_nodes - 1)) if num_nodes > 1 else 0
+
+    return (image_matrix(reduced_matrix, density), labels, reduced_matrix)
+
 def block_dictionary(matrix, labels):
     """
     Creates a dictionary with the block number as the key and the corresponding nodes as the value.
+    Node names come from the first column of the matrix if it holds them, otherwise from its index.
     """
-    block_dict = {}
-    for i in range(len(labels)):
-        if labels[i] not in block_dict:
-            block_dict[labels[i]] = []
-        block_dict[labels[i]].append(matrix.iloc[i, 0])
+    names, _ = split_labels(matrix)
+    names = np.asarray(list(names), dtype=object)
+
+    # Blocks in increasing numerical order, each with its members in node order
+    blocks, codes = np.unique(labels, return_inverse=True)
+    block_dict = {block: names[codes == code].tolist() for code, block in enumerate(blocks.tolist())}
 
-    # Sort the block_dict by increasing numerical order of the keys
-    block_dict = dict(sorted(block_dict.items()))
-    
     return block_dict
 
-def save_matrix(matrix, file_name, output_dir):
+def save_matrix(matrix, file_name, output_dir, storage="csv"):
     """
     Saves the matrix to a CSV file in the specified output directory.
     If the matrix has an extra row on top (likely a label), adds a corresponding column with matching values.
+    storage="npy" saves a memory-mappable binary directory instead (see binary_storage).
     """
 
     # Ensure the matrix is a DataFrame
@@ -198,6 +427,12 @@ def save_matrix(matrix, file_name, output_dir):
     # Ensure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
 
+    if storage != "csv":
+        output_path = os.path.join(output_dir, f"{file_name}_blockmodeling")
+        save_dense_matrix(matrix.to_numpy(), output_path)
+        print(f"Matrix saved to {output_path}")
+        return
+
     # Save the matrix to a CSV file
     output_path = os.path.join(output_dir, f"{file_name}_blockmodeling.csv")
     matrix.reset_index(drop=True, inplace=True)
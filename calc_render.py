@@ -1,22 +1,21 @@
 import pandas as pd
 import networkx as nx
-import scipy
+import scipy.sparse
 import numpy as np
 import os
 import json
-import dash
-import dash_cytoscape as cyto
-from dash import html, dcc
 import math
-from temp_ei import*
-from dash.dependencies import Input, Output
-from dash import dcc, html, Input, Output, State
 
-import transforming_data as transform
-from scipy.stats import norm
+from reading_data import read_sparse_matrix
+from attribute_encoding import encode_attributes, attribute_value
+from graph_index import BLOCK_COLORS
 
-def read_input(edges, attributes = 0):
-    """Takes in two csv files. The directionality of the edge will be FROM rows TO columns"""
+def read_input(edges, attributes = 0, adjacency = "dense"):
+    """Takes in two csv files. The directionality of the edge will be FROM rows TO columns.
+    adjacency="sparse" never builds the dense matrix (see read_sparse_input)"""
+
+    if adjacency == "sparse" and attributes != 0:
+        return read_sparse_input(edges, attributes)
     
     df1 = pd.read_csv(edges, index_col=0)
     block_display = 0
@@ -29,7 +28,7 @@ def read_input(edges, attributes = 0):
     
         return rel_dict
     else:
-        df2 = pd.read_csv(attributes, index_col=0)
+        df2 = encode_attributes(pd.read_csv(attributes, index_col=0))
 
     graph_dict = {}
     seen_edges = set()
@@ -56,7 +55,9 @@ def read_input(edges, attributes = 0):
             attribute_dict[row] = df2.loc[row].to_dict()  # Convert row to dictionary
             graph_dict.setdefault(row, {}).setdefault("attributes", {})
             for attr_name in df2.columns:  # Use the correct column names from df2
-                graph_dict[row]["attributes"][attr_name] = int(df2.at[row, attr_name])
+                value = attribute_value(df2.at[row, attr_name])
+                if value is not None:
+                    graph_dict[row]["attributes"][attr_name] = value
 
     # Create adjacency matrix
     nodes = list(graph_dict.keys())  # Extract all nodes
@@ -76,6 +77,67 @@ def read_input(edges, attributes = 0):
         return graph_dict, adj_matrix_df
 
 
+def read_sparse_input(edges, attributes):
+    """Same output as read_input, but the matrix is read row by row keeping only nonzero cells,
+    and the adjacency DataFrame is sparse. Used when the dense matrix would not fit in memory."""
+
+    matrix = read_sparse_matrix(edges)
+    df2 = encode_attributes(pd.read_csv(attributes, index_col=0))
+
+    return build_input(matrix, df2, adjacency="sparse")
+
+def build_input(matrix, df2, adjacency="sparse"):
+    """Builds the read_input outputs from an already parsed matrix, so uploads are only parsed once.
+    matrix is the (row names, column names, rows, columns, values) tuple from reading_data.parse_matrix_lines
+    and df2 the attribute DataFrame indexed by node. adjacency="dense" returns a dense adjacency DataFrame."""
+
+    row_names, col_names, rows, cols, values = matrix
+    df2.index = df2.index.astype(str)  # Node names read from the matrix are strings
+
+    graph_dict = {}
+    seen_edges = set()
+
+    # Triplets are in row order, so each row's nonzero cells are one contiguous slice
+    row_bounds = np.searchsorted(rows, np.arange(len(row_names) + 1))
+
+    for i, row in enumerate(row_names):
+        for k in range(row_bounds[i], row_bounds[i + 1]):
+            col = col_names[cols[k]]
+            edge = tuple(sorted((row, col)))
+
+            # Stopping double counting and self-loops
+            if edge not in seen_edges and row != col:
+                graph_dict.setdefault(row, {}).setdefault("targets", {})
+                graph_dict.setdefault(col, {}).setdefault("targets", {})
+                graph_dict[row]["targets"][col] = values[k]
+                seen_edges.add(edge)
+
+        # match node from new file
+        if row in df2.index:
+            graph_dict.setdefault(row, {}).setdefault("attributes", {})
+            for attr_name in df2.columns:
+                value = attribute_value(df2.at[row, attr_name])
+                if value is not None:
+                    graph_dict[row]["attributes"][attr_name] = value
+
+    # Create sparse adjacency matrix
+    nodes = list(graph_dict.keys())
+    node_indices = {node: i for i, node in enumerate(nodes)}
+    sources, targets, weights = [], [], []
+
+    for node, data in graph_dict.items():
+        for target, weight in data.get("targets", {}).items():
+            sources.append(node_indices[node])
+            targets.append(node_indices[target])
+            weights.append(weight)
+
+    adj_matrix = scipy.sparse.csr_matrix((weights, (sources, targets)), shape=(len(nodes), len(nodes)))
+    if adjacency == "dense":
+        adj_matrix_df = pd.DataFrame(adj_matrix.toarray(), index=nodes, columns=nodes)
+    else:
+        adj_matrix_df = pd.DataFrame.sparse.from_spmatrix(adj_matrix, index=nodes, columns=nodes)
+
+    return graph_dict, df2, adj_matrix_df
 
 def make_x_graph(graph_dict, directed=False):
     """makes dict from input reader function above and makes it an object in networkx. This
@@ -96,16 +158,21 @@ def make_x_graph(graph_dict, directed=False):
 
     return G
 
-def node_calculation(G):
+def node_calculation(G, betweenness_samples=None):
+    """betweenness_samples estimates betweenness from that many source nodes instead of all of them"""
     dc = nx.degree_centrality(G)
-    bc = nx.betweenness_centrality(G)
+    bc = nx.betweenness_centrality(G, k=betweenness_samples, seed=0 if betweenness_samples else None)
     cc = nx.closeness_centrality(G)
     return dc,bc,cc
 
 def network_calculations(G):
+    """Density of G. An undirected tie covers both ordered pairs, so it counts twice.
+    network_metrics.global_metrics returns density with the rest of the global structure."""
     m = len(G.edges)
     n = len(G.nodes)
-    d = m/(n*(n-1))
+    if n < 2:
+        return 0
+    d = m/(n*(n-1)) if G.is_directed() else 2*m/(n*(n-1))
 
     #node_groups = {"A": "Group1", "B": "Group1", "C": "Group2", "D": "Group2"}
     #E = sum(1 for u, v in G.edges if node_groups[u] != node_groups[v])
@@ -113,11 +180,12 @@ def network_calculations(G):
     #ei_index = (E - I) / (E + I) if (E + I) != 0 else 0    
     return d
  
-def format_for_dash_cytoscape(graph_dict, G):
-    """Converts the graph dictionary into a format suitable for Dash Cytoscape (directed edges)."""
+def format_for_dash_cytoscape(graph_dict, G = None, positions = None):
+    """Converts the graph dictionary into a format suitable for Dash Cytoscape (directed edges).
+    positions (node -> {"x", "y"}, e.g. from calculate_force_positions) replace the circular layout."""
     
     elements = []
-    node_positions = calculate_positions(graph_dict, G)  # Get node positions dynamically
+    node_positions = positions if positions is not None else calculate_positions(graph_dict, G)  # Get node positions dynamically
 
     # Add nodes with positions
     for node, data in graph_dict.items():
@@ -136,9 +204,8 @@ def format_for_dash_cytoscape(graph_dict, G):
 
     return elements
 
-def calculate_positions(graph_dict, G):
+def calculate_positions(graph_dict, G = None):
     """Dynamically spaces out nodes in a circular layout."""
-    dc, bc, cc = node_calculation(G)
     num_nodes = len(graph_dict)
     angle_step = 2 * math.pi / max(num_nodes, 1)  # Angle between nodes
 
@@ -153,6 +220,38 @@ def calculate_positions(graph_dict, G):
 
     return positions
 
+def calculate_force_positions(G):
+    """Force-directed (Fruchterman-Reingold) layout of G, scaled to the canvas of calculate_positions.
+    Nodes are returned in G's order, with plain floats so the positions can go straight into the Dash layout."""
+    layout = nx.spring_layout(G, seed=0)
+    radius = 600
+    center_x, center_y = 300, 300
+    return {node: {"x": center_x + radius * float(x), "y": center_y + radius * float(y)} for node, (x, y) in layout.items()}
+
+def calculate_spectral_positions(G):
+    """Spectral layout of G for networks too large for the force layout: the second and third eigenvectors of the
+    normalized adjacency matrix (the smoothest ways to spread the nodes along the ties), scaled like calculate_force_positions.
+    The largest eigenvalues converge in seconds on hundreds of thousands of ties, unlike networkx's smallest-Laplacian solve."""
+    from scipy.sparse.linalg import eigsh
+
+    nodes = list(G.nodes())
+    if len(nodes) < 4:
+        return calculate_positions({node: {} for node in nodes})
+
+    adjacency = nx.to_scipy_sparse_array(G, nodelist=nodes, weight=None, format='csr')
+    degrees = np.maximum(np.asarray(adjacency.sum(axis=1)).ravel(), 1)
+    scale = scipy.sparse.diags(1 / np.sqrt(degrees))
+    values, vectors = eigsh(scale @ adjacency @ scale, k=3, which='LA', tol=1e-4, v0=np.sqrt(degrees))
+
+    # The largest eigenvector is the trivial one (proportional to sqrt(degree))
+    order = np.argsort(-values)
+    layout = vectors[:, order[1:3]] / np.sqrt(degrees)[:, None]
+    layout = layout / max(np.abs(layout).max(), 1e-12)
+
+    radius = 600
+    center_x, center_y = 300, 300
+    return {node: {"x": center_x + radius * float(x), "y": center_y + radius * float(y)} for node, (x, y) in zip(nodes, layout)}
+
 def calculate_grid_positions(graph_dict, G = None):
     """Dynamically spaces out nodes in a grid layout."""
     num_nodes = len(graph_dict)
@@ -213,12 +312,84 @@ def calculate_circular_positions(graph_dict, G):
     return positions
 
 
-def make_dash(g_dict):
-    """Creates a Dash visualization. Displays attributes of a node when clicked."""
-    
+# Styles of the collapsed block view: block nodes sized by members, ties between blocks undirected
+BLOCK_STYLESHEET = [
+    {'selector': 'node[color]', 'style': {'background-color': 'data(color)'}},
+    {'selector': '.block', 'style': {'shape': 'round-rectangle', 'width': 'mapData(size, 1, 1000, 30, 120)',
+                                     'height': 'mapData(size, 1, 1000, 30, 120)'}},
+    {'selector': '.block-tie', 'style': {'target-arrow-shape': 'none', 'line-color': '#bbbbbb', 'width': 1}},
+    {'selector': '.image-tie', 'style': {'line-color': '#555555', 'width': 4}},
+]
+
+def colorable_attributes(categories):
+    """Attributes that can be used in a Cytoscape data selector (plain identifiers)"""
+    return [attr_name for attr_name in categories if isinstance(attr_name, str) and attr_name.isidentifier()]
+
+def category_stylesheet(attr_name, categories):
+    """Colors nodes by the category code of attr_name: one rule per category, not one per node"""
+    return [{'selector': f'node[{attr_name} = {json.dumps(attribute_value(value))}]',
+             'style': {'background-color': BLOCK_COLORS[code % len(BLOCK_COLORS)]}}
+            for code, value in enumerate(categories)]
+
+# Weights shown as slider marks one by one up to this many distinct values; beyond it, at quantiles
+MAX_WEIGHT_MARKS = 20
+
+def weight_slider(weights):
+    """Slider for the minimum tie weight shown, over the sorted weights of graph_index.build_weight_index.
+    Hidden when every tie has the same weight."""
+    from dash import html, dcc
+
+    distinct = np.unique(weights)
+    if len(distinct) <= MAX_WEIGHT_MARKS:
+        marks, step = distinct, None
+    else:
+        marks, step = np.unique(np.quantile(weights, np.linspace(0, 1, 6))), (distinct[-1] - distinct[0]) / 100
+    low, high = (float(distinct[0]), float(distinct[-1])) if len(distinct) else (0, 0)
+
+    return html.Div([
+        html.Label('Minimum tie weight'),
+        dcc.Slider(id='weight-threshold', min=low, max=high, value=low, step=step,
+                   marks={float(mark): f'{mark:g}' for mark in marks}),
+        dcc.Store(id='applied-threshold', data=low),
+        html.Div(id='weight-status'),
+    ], style={'display': 'block' if len(distinct) > 1 else 'none'})
+
+def preview_dash(elements, status):
+    """Layout shown while the analysis runs (see preview.preview_network): the preview elements without the
+    interactive controls, whose callbacks belong to the finished analysis"""
+    import dash_cytoscape as cyto
+    from dash import html
+
+    return html.Div([
+        html.P(status),
+        cyto.Cytoscape(
+            id='preview-graph',
+            elements=elements,
+            layout={'name': 'preset'},
+            style={'width': '100%', 'height': '300px'},
+            stylesheet=[
+                {'selector': 'node', 'style': {'label': 'data(label)'}},
+                {'selector': 'edge', 'style': {'curve-style': 'bezier', 'line-color': '#bbbbbb'}}
+            ]
+        ),
+    ])
+
+def make_dash(g_dict, elements=None, color_attributes=(), weights=(), positions=None, poll_layout=False, tiles=None,
+              dataset_id=None):
+    """Creates a Dash visualization. Displays attributes of a node when clicked.
+    elements replaces the full network, e.g. with the collapsed block view (graph_index.block_view_elements),
+    positions the circular layout of the full network (see format_for_dash_cytoscape).
+    color_attributes are offered for coloring the nodes by category (see category_stylesheet),
+    weights (sorted) set the range of the tie weight slider (see weight_slider).
+    poll_layout checks every second for the force layout, which moves the nodes once it is ready.
+    tiles is the Plotly figure of a network drawn as map tiles (see raster_tiles.tile_figure), shown above the
+    Cytoscape view of the nodes in its viewport.
+    dataset_id is stored in the layout for the callbacks, which find the network's view state by it (see app.views)."""
+    import dash_cytoscape as cyto
+    from dash import html, dcc
+
     # Create Cytoscape elements
-    G = make_x_graph(g_dict)
-    cytoscape_elements = format_for_dash_cytoscape(g_dict, G)
+    cytoscape_elements = elements if elements is not None else format_for_dash_cytoscape(g_dict, positions=positions)
 
     # dash_app = dash.Dash(__name__, server = app, url_base_pathname="/dash/")
     # Dash App
@@ -226,6 +397,29 @@ def make_dash(g_dict):
 
     return html.Div([
         html.Div([
+            # Neighborhood of the clicked node (see graph_index.ego_elements)
+            dcc.RadioItems(
+                id='ego-hops',
+                options=[{'label': 'Whole network', 'value': 0}] +
+                        [{'label': f'{k}-hop neighborhood', 'value': k} for k in (1, 2, 3)],
+                value=0,
+                inline=True
+            ),
+            dcc.Dropdown(
+                id='color-by',
+                options=[{'label': attr_name, 'value': attr_name} for attr_name in color_attributes],
+                placeholder='Color nodes by attribute',
+                clearable=True
+            ),
+            weight_slider(weights),
+            html.Button('Collapse blocks', id='collapse-blocks', n_clicks=0, hidden=elements is None or tiles is not None),
+            dcc.Graph(id='tile-map', figure=tiles or {}, config={'scrollZoom': True, 'displayModeBar': False},
+                      style={'height': '400px', 'display': 'block' if tiles else 'none'}),
+            html.Div(id='raster-status'),
+            dcc.Store(id='dataset-id', data=dataset_id),
+            dcc.Store(id='expanded-blocks', data=[]),
+            dcc.Interval(id='layout-poll', interval=1000, disabled=not poll_layout),
+            html.Div(id='ego-status'),
             cyto.Cytoscape(
             id='cytoscape-graph',
             elements=cytoscape_elements,
@@ -234,7 +428,7 @@ def make_dash(g_dict):
             stylesheet=[
                 {'selector': 'node', 'style': {'label': 'data(label)', 'background-color': 'data(color)'}},
                 {'selector': 'edge', 'style': {'curve-style': 'bezier', 'target-arrow-shape': 'triangle'}}
-            ]
+            ] + BLOCK_STYLESHEET
         ),
         ], style={'width': '70%', 'display': 'inline-block'}),
 
@@ -298,6 +492,8 @@ def make_dash(g_dict):
     # app.run_server(debug=True)
 
 if __name__ == '__main__':
+    from temp_ei import ei_test
+
     # Phase 1
     g_dict, df2, matrix = read_input("campnet.csv", "campattr.csv")
     make_dash(g_dict)
@@ -312,7 +508,7 @@ if __name__ == '__main__':
     for i in range(len(attributes[0])):
         for row in attributes:
             attributes_col.append(row[i])
-        observed_ei, p_value, confidence_interval = ei_test(matrix, attributes_col, num_permutations=50)
+        observed_ei, p_value, confidence_interval, _ = ei_test(matrix, attributes_col, num_permutations=50)
         print(observed_ei, p_value, confidence_interval)
 
     # Phase 2
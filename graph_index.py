@@ -0,0 +1,394 @@
+#CSR adjacency index for fast neighborhood queries
+#
+# The index is built once per dataset from the graph_dict of read_input. Ties are stored in both
+# directions, so a k-hop query is k vectorized frontier expansions over the indptr/indices arrays.
+# The distance oracle keeps breadth-first distances from a few landmark nodes to bound any
+# distance in O(landmarks); exact paths come from a bidirectional search.
+# A second index keeps the ties sorted by weight, so the view can be filtered by a minimum weight.
+
+import numpy as np
+import scipy.sparse
+
+# Largest ego network returned to the browser
+MAX_EGO_NODES = 500
+
+# Landmarks kept by the distance oracle (from the highest degree nodes)
+DEFAULT_LANDMARKS = 16
+
+def build_csr_index(graph_dict):
+    """
+    Builds an undirected CSR index of the graph_dict.
+    Returns a dictionary with the node list, the node -> position map and the CSR indptr/indices arrays.
+    """
+    nodes = list(graph_dict.keys())
+    node_indices = {node: i for i, node in enumerate(nodes)}
+    sources, targets = [], []
+
+    for node, data in graph_dict.items():
+        for target in data.get("targets", {}):
+            sources.append(node_indices[node])
+            targets.append(node_indices[target])
+
+    n = len(nodes)
+    ties = scipy.sparse.csr_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)), shape=(n, n))
+    ties = (ties + ties.T).tocsr()
+    ties.sort_indices()
+
+    return {
+        "nodes": nodes,
+        "node_indices": node_indices,
+        "indptr": ties.indptr,
+        "indices": ties.indices,
+    }
+
+def neighbors(index, positions):
+    """
+    All neighbors of the nodes at the given positions, with repeats
+    """
+    indptr = index["indptr"]
+    starts, ends = indptr[positions], indptr[positions + 1]
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.empty(0, dtype=index["indices"].dtype)
+
+    # Gather the concatenated slices indices[start:end] without a Python loop
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return index["indices"][offsets + np.arange(lengths.sum())]
+
+def ego_nodes(index, node, hops=1, max_nodes=MAX_EGO_NODES):
+    """
+    Positions of the nodes within hops ties of node, in breadth-first order, and whether the result was cut at max_nodes.
+    The center node comes first; when a hop would go over max_nodes, only part of it is kept.
+    """
+    if node not in index["node_indices"]:
+        raise ValueError(f"Node {node} does not exist.")
+
+    center = index["node_indices"][node]
+    visited = np.zeros(len(index["nodes"]), dtype=bool)
+    visited[center] = True
+    found = [np.array([center])]
+    frontier = found[0]
+    count = 1
+
+    for _ in range(hops):
+        reached = np.unique(neighbors(index, frontier))
+        frontier = reached[~visited[reached]]
+        if len(frontier) == 0:
+            break
+        if count + len(frontier) > max_nodes:
+            found.append(frontier[:max_nodes - count])
+            return np.concatenate(found), True
+        visited[frontier] = True
+        found.append(frontier)
+        count += len(frontier)
+
+    return np.concatenate(found), False
+
+def ego_subgraph(index, graph_dict, node, hops=1, max_nodes=MAX_EGO_NODES):
+    """
+    The k-hop ego network of node as a graph_dict (ties among the kept nodes only), ready for
+    format_for_dash_cytoscape. Returns the graph_dict and whether it was cut at max_nodes.
+    """
+    positions, truncated = ego_nodes(index, node, hops, max_nodes)
+    kept = [index["nodes"][i] for i in positions]
+    kept_set = set(kept)
+
+    ego_dict = {}
+    for member in kept:
+        data = graph_dict.get(member, {})
+        ego_dict[member] = {
+            "targets": {target: weight for target, weight in data.get("targets", {}).items() if target in kept_set},
+            "attributes": data.get("attributes", {}),
+        }
+
+    return ego_dict, truncated
+
+def ego_elements(index, graph_dict, node, hops=1, max_nodes=MAX_EGO_NODES):
+    """
+    Dash Cytoscape elements of the k-hop ego network of node, and whether it was cut at max_nodes
+    """
+    from calc_render import format_for_dash_cytoscape
+
+    ego_dict, truncated = ego_subgraph(index, graph_dict, node, hops, max_nodes)
+    return format_for_dash_cytoscape(ego_dict), truncated
+
+def expand(index, positions):
+    """
+    Every tie leaving the nodes at the given positions, as parallel (source, target) arrays
+    """
+    lengths = index["indptr"][positions + 1] - index["indptr"][positions]
+    return np.repeat(positions, lengths), neighbors(index, positions)
+
+def bfs_distances(index, source):
+    """
+    Hop distance from the node at position source to every node, -1 where it cannot be reached
+    """
+    distances = np.full(len(index["nodes"]), -1, dtype=np.int32)
+    distances[source] = 0
+    frontier = np.array([source])
+    level = 0
+
+    while len(frontier) > 0:
+        level += 1
+        reached = np.unique(neighbors(index, frontier))
+        frontier = reached[distances[reached] < 0]
+        distances[frontier] = level
+
+    return distances
+
+def build_distance_oracle(index, degree_centrality=None, num_landmarks=DEFAULT_LANDMARKS):
+    """
+    Precomputes breadth-first distances from the num_landmarks most central nodes.
+    Landmarks are ranked by degree_centrality (node -> value) when given, otherwise by degree in the index.
+    """
+    num_nodes = len(index["nodes"])
+    if degree_centrality:
+        ranking = np.array([degree_centrality.get(node, 0) for node in index["nodes"]])
+    else:
+        ranking = np.diff(index["indptr"])
+    landmarks = np.argsort(-ranking, kind="stable")[:min(num_landmarks, num_nodes)]
+
+    distances = np.empty((len(landmarks), num_nodes), dtype=np.int32)
+    for k, landmark in enumerate(landmarks):
+        distances[k] = bfs_distances(index, landmark)
+
+    return {"index": index, "landmarks": landmarks, "distances": distances}
+
+def estimate_distance(oracle, u, v):
+    """
+    Bounds on the hop distance between u and v from the landmark distances alone, in O(landmarks).
+    Returns (lower, upper); upper is None when no landmark reaches both nodes, and both are None
+    when a landmark shows the nodes are in different components.
+    """
+    node_indices = oracle["index"]["node_indices"]
+    for node in (u, v):
+        if node not in node_indices:
+            raise ValueError(f"Node {node} does not exist.")
+
+    to_u = oracle["distances"][:, node_indices[u]]
+    to_v = oracle["distances"][:, node_indices[v]]
+    if u == v:
+        return 0, 0
+
+    # A landmark reaching exactly one of the nodes separates them
+    if np.any((to_u < 0) != (to_v < 0)):
+        return None, None
+
+    both = (to_u >= 0) & (to_v >= 0)
+    if not both.any():
+        return 1, None
+
+    # Triangle inequality through every landmark
+    lower = max(1, int(np.max(np.abs(to_u[both] - to_v[both]))))
+    upper = int(np.min(to_u[both] + to_v[both]))
+    return lower, upper
+
+def shortest_path(index, u, v):
+    """
+    An exact shortest path from u to v as a list of nodes, by bidirectional breadth-first search.
+    Returns None when there is no path.
+    """
+    node_indices = index["node_indices"]
+    for node in (u, v):
+        if node not in node_indices:
+            raise ValueError(f"Node {node} does not exist.")
+
+    source, target = node_indices[u], node_indices[v]
+    if source == target:
+        return [u]
+
+    num_nodes = len(index["nodes"])
+    # Parent of each reached node on the side that reached it; -1 unreached, the start points to itself
+    parents = [np.full(num_nodes, -1, dtype=np.int64), np.full(num_nodes, -1, dtype=np.int64)]
+    depths = [np.full(num_nodes, -1, dtype=np.int64), np.full(num_nodes, -1, dtype=np.int64)]
+    frontiers = [np.array([source]), np.array([target])]
+    for side, start in enumerate((source, target)):
+        parents[side][start] = start
+        depths[side][start] = 0
+
+    meeting = None
+    while meeting is None and len(frontiers[0]) > 0 and len(frontiers[1]) > 0:
+        # Expand the smaller frontier by one full level
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        origins, reached = expand(index, frontiers[side])
+        new = parents[side][reached] < 0
+        reached, first = np.unique(reached[new], return_index=True)
+        parents[side][reached] = origins[new][first]
+        depths[side][reached] = depths[side][frontiers[side][0]] + 1
+        frontiers[side] = reached
+
+        # All new nodes are at the same depth, so the best meeting point is the one closest to the other side
+        met = reached[depths[1 - side][reached] >= 0]
+        if len(met) > 0:
+            meeting = met[np.argmin(depths[1 - side][met])]
+
+    if meeting is None:
+        return None
+
+    path = [meeting]
+    while path[-1] != source:
+        path.append(parents[0][path[-1]])
+    path.reverse()
+    while path[-1] != target:
+        path.append(parents[1][path[-1]])
+
+    return [index["nodes"][i] for i in path]
+
+# Networks with more nodes than this open on the collapsed block view
+BLOCK_VIEW_MIN_NODES = 150
+
+# Colors of the blocks in the collapsed view, reused when there are more blocks
+BLOCK_COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+
+def block_color(code):
+    """Color of a block by its code, its position among the sorted block labels (as in attribute_encoding)"""
+    return BLOCK_COLORS[int(code) % len(BLOCK_COLORS)]
+
+def tie_weight(graph_dict, u, v):
+    """
+    Weight of the tie between u and v, whichever of them it was read from
+    """
+    weight = graph_dict.get(u, {}).get("targets", {}).get(v)
+    if weight is None:
+        weight = graph_dict.get(v, {}).get("targets", {}).get(u, 1)
+    return weight
+
+def block_view_elements(index, graph_dict, labels, image, reduced_matrix, expanded=()):
+    """
+    Dash Cytoscape elements of the collapsed block graph: one node per block and an edge between every pair of blocks
+    with ties, drawn bold (class "image-tie") where the image matrix has a 1.
+    Blocks listed in expanded are replaced by their members, with the ties among expanded members and one edge from
+    each member to every collapsed block it has ties into. Nothing outside the expanded blocks is sent to the client.
+    labels are the block numbers in index order; image and reduced_matrix (block densities) are in sorted block order.
+    """
+    from calc_render import calculate_positions
+
+    labels = np.asarray(labels)
+    blocks, block_codes, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    expanded = {block for block in expanded if block in set(blocks.tolist())}
+    centers = calculate_positions({int(block): None for block in blocks})
+    nodes = index["nodes"]
+    elements = []
+
+    member_positions = np.flatnonzero(np.isin(labels, list(expanded))) if expanded else np.empty(0, dtype=int)
+
+    for code, block in enumerate(blocks.tolist()):
+        center = centers[block]
+        if block not in expanded:
+            elements.append({
+                'data': {'id': f'block-{block}', 'label': f'Block {block} ({sizes[code]})', 'block': block,
+                         'size': int(sizes[code]), 'color': block_color(code)},
+                'position': center,
+                'classes': 'block'
+            })
+            continue
+
+        # Members on a small circle around where the block was
+        members = np.flatnonzero(block_codes == code)
+        radius = 40 + 8 * np.sqrt(len(members))
+        for k, position in enumerate(members):
+            node = nodes[position]
+            angle = 2 * np.pi * k / len(members)
+            node_data = {'id': node, 'label': node, 'member_of': block, 'color': block_color(code)}
+            node_data.update(graph_dict.get(node, {}).get("attributes", {}))
+            elements.append({'data': node_data,
+                             'position': {'x': float(center['x'] + radius * np.cos(angle)),
+                                          'y': float(center['y'] + radius * np.sin(angle))}})
+
+    # Ties between collapsed blocks, weighted by density
+    image = np.asarray(image)
+    for i, j in zip(*np.nonzero(np.triu(np.asarray(reduced_matrix), k=1))):
+        if blocks[i] not in expanded and blocks[j] not in expanded:
+            elements.append({'data': {'source': f'block-{blocks[i]}', 'target': f'block-{blocks[j]}',
+                                      'weight': round(float(reduced_matrix[i][j]), 4)},
+                             'classes': 'block-tie image-tie' if image[i][j] else 'block-tie'})
+
+    # Ties of the expanded members
+    sources, targets = expand(index, member_positions)
+    target_labels = labels[targets]
+    inside = np.isin(target_labels, list(expanded))
+
+    keep = inside & (sources < targets)
+    for u, v in zip(sources[keep].tolist(), targets[keep].tolist()):
+        elements.append({'data': {'source': nodes[u], 'target': nodes[v], 'weight': tie_weight(graph_dict, nodes[u], nodes[v])}})
+
+    for u, block in sorted(set(zip(sources[~inside].tolist(), target_labels[~inside].tolist()))):
+        elements.append({'data': {'source': nodes[u], 'target': f'block-{block}'}, 'classes': 'block-tie'})
+
+    return elements
+
+# Ties sorted by weight once per dataset, so filtering the view by a minimum weight is a binary search
+
+def build_weight_index(graph_dict):
+    """
+    Ties of the graph_dict (each once, in the direction it was read) in ascending order of weight.
+    Returns a dictionary with the node list, the tie ends as node positions and the sorted weights.
+    """
+    nodes = list(graph_dict.keys())
+    node_indices = {node: i for i, node in enumerate(nodes)}
+    sources, targets, weights = [], [], []
+
+    for node, data in graph_dict.items():
+        for target, weight in data.get("targets", {}).items():
+            sources.append(node_indices[node])
+            targets.append(node_indices[target])
+            weights.append(weight)
+
+    weights = np.asarray(weights, dtype=float)
+    order = np.argsort(weights, kind="stable")
+    return {
+        "nodes": nodes,
+        "sources": np.asarray(sources, dtype=np.int64)[order],
+        "targets": np.asarray(targets, dtype=np.int64)[order],
+        "weights": weights[order],
+    }
+
+def threshold_position(weight_index, threshold):
+    """
+    Position of the first tie with weight >= threshold; the ties from there on are shown
+    """
+    if threshold is None:
+        return 0
+    return int(np.searchsorted(weight_index["weights"], threshold, side="left"))
+
+def weight_view(weight_index):
+    """
+    Degrees of the view with every tie shown; move_threshold keeps them up to date as the threshold changes
+    """
+    n = len(weight_index["nodes"])
+    degrees = np.bincount(weight_index["sources"], minlength=n) + np.bincount(weight_index["targets"], minlength=n)
+    return {"position": 0, "degrees": degrees}
+
+def move_threshold(weight_index, view, position):
+    """
+    Shows the ties from position on: only the degrees at the ends of the ties hidden or shown by the move are updated
+    """
+    start, stop = sorted((view["position"], position))
+    change = -1 if position > view["position"] else 1
+    np.add.at(view["degrees"], weight_index["sources"][start:stop], change)
+    np.add.at(view["degrees"], weight_index["targets"][start:stop], change)
+    view["position"] = position
+    return view
+
+def view_metrics(weight_index, view):
+    """
+    Ties, density and degrees of the filtered view
+    """
+    n = len(weight_index["nodes"])
+    ties = len(weight_index["weights"]) - view["position"]
+    return {
+        "ties": ties,
+        "density": 2 * ties / (n * (n - 1)) if n > 1 else 0,
+        "mean_degree": float(view["degrees"].mean()) if n else 0,
+        "max_degree": int(view["degrees"].max()) if n else 0,
+    }
+
+def weight_edge_elements(weight_index, start, stop):
+    """
+    Edge elements of the ties between two positions of the index, as format_for_dash_cytoscape draws them
+    """
+    nodes = weight_index["nodes"]
+    return [{'data': {'source': nodes[u], 'target': nodes[v], 'weight': weight}}
+            for u, v, weight in zip(weight_index["sources"][start:stop].tolist(),
+                                    weight_index["targets"][start:stop].tolist(),
+                                    weight_index["weights"][start:stop].tolist())]
@@ -0,0 +1,315 @@
+#Shared-memory store of parsed networks, so every server process on a host holds one copy
+#
+# With several server processes (e.g. gunicorn -w 4 app:app) the process that receives an upload parses it
+# and publishes it here: the tie triplets, the categorical attribute codes, the CSR index and the centrality
+# arrays go into multiprocessing.shared_memory segments named after the dataset id. Every process, the
+# publisher included, then attaches to them read-only by that id instead of holding its own copy.
+# Each segment starts with a JSON header (array dtypes, shapes and offsets, node names, categories), so the
+# segment names are the whole registry. NETWORK_SHARED_STORE=0 turns the store off.
+#
+# A segment belongs to no process in particular: it counts the processes using it, and whichever process
+# releases it last (on eviction or at exit) removes it from the host. The count and the ready flag, written
+# once the segment is complete, are only read and changed under a host-wide file lock. A process that dies
+# without releasing its segments leaves them in /dev/shm until the host restarts.
+
+import atexit
+import json
+import os
+import struct
+import tempfile
+from collections.abc import Mapping
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows frees a segment itself once no process has it open
+    fcntl = None
+
+# POSIX shared memory names are short on some systems: prefix + 16 hex digits + part stays under 31 characters
+SEGMENT_PREFIX = "ng"
+ALIGN = 64
+# Ready flag, number of processes using the segment, length of the JSON header
+SEGMENT_HEADER = struct.Struct("<QQQ")
+READY = 1
+
+held = {}    # segments this process uses, the ones it published included; each counts once in their users
+retired = [] # released segments, closed once none of their arrays is referenced any more
+
+LOCK_PATH = os.path.join(tempfile.gettempdir(), "network_graph_store.lock")
+
+def enabled():
+    return os.environ.get("NETWORK_SHARED_STORE", "1") != "0"
+
+def segment_name(dataset_id, part):
+    return f"{SEGMENT_PREFIX}{dataset_id[:16]}_{part}"
+
+def aligned(num_bytes):
+    return -(-num_bytes // ALIGN) * ALIGN
+
+@contextmanager
+def host_lock():
+    """
+    Exclusive lock, across the processes of this host, over the ready flags and user counts of all segments
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(LOCK_PATH, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def untracked_segment(name, create=False, size=0):
+    """
+    Opens or creates a segment that is not removed when this process exits, since other processes may still use it
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Before Python 3.13 every segment is registered with the resource tracker, which would unlink it when
+        # this process exits
+        from multiprocessing import resource_tracker
+
+        segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+def unlink(segment):
+    """
+    Removes a segment opened by untracked_segment from the host
+    """
+    if getattr(segment, "_track", True):
+        # Before Python 3.13 unlink also unregisters the segment from the resource tracker, which must know it
+        from multiprocessing import resource_tracker
+
+        resource_tracker.register(segment._name, "shared_memory")
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+def publish(dataset_id, part, arrays, header=None):
+    """
+    Copies the arrays (name -> numpy array) and a JSON-serializable header into a new segment.
+    Returns False if the store is off, the part is already published, or there is no room for it.
+    """
+    if not enabled():
+        return False
+
+    layout, size = {}, 0
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, list(array.shape), size]
+        size += aligned(array.nbytes)
+    meta = json.dumps({"arrays": layout, "header": header or {}}).encode()
+    data_start = aligned(SEGMENT_HEADER.size + len(meta))
+
+    name = segment_name(dataset_id, part)
+    try:
+        segment = untracked_segment(name, create=True, size=data_start + max(size, 1))
+    except OSError:
+        # FileExistsError included: the part is already published
+        return False
+
+    try:
+        segment.buf[SEGMENT_HEADER.size:SEGMENT_HEADER.size + len(meta)] = meta
+        for array_name, array in arrays.items():
+            dtype, shape, offset = layout[array_name]
+            np.ndarray(shape, dtype, buffer=segment.buf, offset=data_start + offset)[...] = array
+    except BaseException:
+        segment.close()
+        unlink(segment)
+        raise
+
+    # The ready flag goes in last: until then readers treat the part as not yet published
+    with host_lock():
+        SEGMENT_HEADER.pack_into(segment.buf, 0, READY, 1, len(meta))
+    held[name] = segment
+    return True
+
+def open_published(name):
+    """
+    Attaches to a complete segment and counts this process among its users, or returns None.
+    A segment still being written, or already released by its last user, is closed again.
+    """
+    try:
+        segment = untracked_segment(name)
+    except (OSError, ValueError):
+        # Not there, or created but not yet sized (an empty segment cannot be mapped)
+        return None
+
+    with host_lock():
+        if segment.size >= SEGMENT_HEADER.size:
+            ready, users, meta_length = SEGMENT_HEADER.unpack_from(segment.buf, 0)
+            if ready == READY and users > 0:
+                SEGMENT_HEADER.pack_into(segment.buf, 0, ready, users + 1, meta_length)
+                return segment
+    segment.close()
+    return None
+
+def attach(dataset_id, part):
+    """
+    The arrays (read-only views of the shared memory) and header of a published part, or None
+    """
+    if not enabled():
+        return None
+
+    name = segment_name(dataset_id, part)
+    segment = held.get(name)
+    if segment is None:
+        segment = open_published(name)
+        if segment is None:
+            return None
+        held[name] = segment
+
+    meta_length = SEGMENT_HEADER.unpack_from(segment.buf, 0)[2]
+    meta = json.loads(bytes(segment.buf[SEGMENT_HEADER.size:SEGMENT_HEADER.size + meta_length]))
+    data_start = aligned(SEGMENT_HEADER.size + meta_length)
+    arrays = {}
+    for array_name, (dtype, shape, offset) in meta["arrays"].items():
+        array = np.ndarray(shape, dtype, buffer=segment.buf, offset=data_start + offset)
+        array.flags.writeable = False
+        arrays[array_name] = array
+
+    return arrays, meta["header"]
+
+def stop_using(segment):
+    """
+    Takes this process off the users of a segment and removes the segment from the host if it was the last one
+    """
+    with host_lock():
+        ready, users, meta_length = SEGMENT_HEADER.unpack_from(segment.buf, 0)
+        SEGMENT_HEADER.pack_into(segment.buf, 0, ready, max(users - 1, 0), meta_length)
+        if users <= 1:
+            unlink(segment)
+
+def release(dataset_id):
+    """
+    Stops using every part of a dataset; a part no other process uses is removed from the host.
+    Arrays still referenced stay readable, the memory is freed once the last of them is gone.
+    """
+    prefix = segment_name(dataset_id, "")
+    for name in [name for name in held if name.startswith(prefix)]:
+        segment = held.pop(name)
+        stop_using(segment)
+        retired.append(segment)
+
+    for segment in list(retired):
+        try:
+            segment.close()
+            retired.remove(segment)
+        except BufferError:
+            pass
+
+@atexit.register
+def release_all():
+    for segment in held.values():
+        stop_using(segment)
+    held.clear()
+
+# Parsed uploads (reading_data.read_uploaded_network)
+
+def publish_dataset(dataset):
+    """
+    Publishes the tie triplets and the categorical attribute codes of a parsed upload
+    """
+    row_names, col_names, rows, cols, values = dataset["matrix"]
+    attributes = dataset["attributes"]
+
+    arrays = {"rows": rows, "cols": cols, "values": values}
+    columns = []
+    for i, attr_name in enumerate(attributes.columns):
+        arrays[f"attribute_{i}"] = attributes[attr_name].cat.codes.to_numpy()
+        columns.append([attr_name, attributes[attr_name].cat.categories.tolist()])
+
+    header = {"row_names": list(row_names), "col_names": list(col_names), "attributes": columns,
+              "attribute_index": attributes.index.tolist(), "attribute_index_name": attributes.index.name}
+    return publish(dataset["id"], "upload", arrays, header)
+
+def load_dataset(dataset_id):
+    """
+    A parsed upload read from the store, with the same shape as read_uploaded_network returns, or None
+    """
+    import pandas as pd
+
+    published = attach(dataset_id, "upload")
+    if published is None:
+        return None
+    arrays, header = published
+
+    attributes = pd.DataFrame({attr_name: pd.Categorical.from_codes(arrays[f"attribute_{i}"], categories)
+                               for i, (attr_name, categories) in enumerate(header["attributes"])},
+                              index=pd.Index(header["attribute_index"], name=header["attribute_index_name"]))
+    matrix = (header["row_names"], header["col_names"], arrays["rows"], arrays["cols"], arrays["values"])
+    return {"id": dataset_id, "matrix": matrix, "attributes": attributes}
+
+def share_dataset(dataset):
+    """
+    Publishes a freshly parsed upload and returns it as read from the store, so this process does not keep
+    a private copy; returns the dataset unchanged when the store is off or full
+    """
+    publish_dataset(dataset)
+    return load_dataset(dataset["id"]) or dataset
+
+# Analysis results by node
+
+def publish_csr_index(dataset_id, index):
+    """
+    Publishes a graph_index.build_csr_index
+    """
+    return publish(dataset_id, "csr", {"indptr": index["indptr"], "indices": index["indices"]},
+                   {"nodes": index["nodes"]})
+
+def load_csr_index(dataset_id):
+    published = attach(dataset_id, "csr")
+    if published is None:
+        return None
+    arrays, header = published
+    nodes = header["nodes"]
+    return {"nodes": nodes, "node_indices": {node: i for i, node in enumerate(nodes)},
+            "indptr": arrays["indptr"], "indices": arrays["indices"]}
+
+class NodeValues(Mapping):
+    """
+    Read-only node -> value mapping over an array in node order, used in place of the centrality dicts
+    """
+    def __init__(self, node_indices, values):
+        self.node_indices = node_indices
+        self.values = values
+
+    def __getitem__(self, node):
+        return float(self.values[self.node_indices[node]])
+
+    def __iter__(self):
+        return iter(self.node_indices)
+
+    def __len__(self):
+        return len(self.node_indices)
+
+def publish_node_values(dataset_id, part, index, measures, params=None):
+    """
+    Publishes node measures (a list of node -> value dicts) as arrays in the order of the CSR index.
+    params are the parameters they were computed with; load_node_values only returns measures with the same ones.
+    """
+    arrays = {str(i): np.array([measure.get(node, 0) for node in index["nodes"]], dtype=float)
+              for i, measure in enumerate(measures)}
+    return publish(dataset_id, part, arrays, {"params": params})
+
+def load_node_values(dataset_id, part, index, params=None):
+    """
+    The published node measures as NodeValues mappings, or None
+    """
+    published = attach(dataset_id, part)
+    if published is None:
+        return None
+    arrays, header = published
+    if header["params"] != json.loads(json.dumps(params)):
+        return None
+    return [NodeValues(index["node_indices"], arrays[str(i)]) for i in range(len(arrays))]
@@ -0,0 +1,57 @@
+#HTTP caching for the analysis pages: ETags from the dataset and analysis parameters, and gzip for large bodies
+#
+# The analysis of a dataset only changes when the upload or the analysis parameters do, so its page and
+# Dash layout are tagged with a hash of both. A browser that sends the tag back in If-None-Match gets
+# 304 Not Modified without any of the analysis being redone.
+
+import gzip
+import hashlib
+import json
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_TYPES = ("text/html", "application/json", "text/css", "application/javascript", "text/javascript")
+
+def analysis_etag(*parts):
+    """
+    Strong ETag from the dataset id and the analysis parameters (anything JSON-serializable)
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def not_modified(request, etag):
+    """
+    True if the request already holds the current version of the resource, plain or gzipped
+    """
+    return etag is not None and (etag in request.if_none_match or f"{etag}-gzip" in request.if_none_match)
+
+def tag_response(response, etag):
+    """
+    Adds the ETag and asks the browser to revalidate on every view (answered with a 304 while the tag matches)
+    """
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def compress_response(request, response):
+    """
+    Gzips a large text or JSON response when the client accepts it. Streamed and file responses are left alone.
+    """
+    if response.direct_passthrough or response.is_streamed or response.status_code < 200 \
+            or response.status_code in (204, 304) or "Content-Encoding" in response.headers \
+            or response.mimetype not in COMPRESSIBLE_TYPES or "gzip" not in request.accept_encodings:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+
+    # A compressed body is a different representation, so it gets its own tag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + "-gzip", weak)
+
+    return response
@@ -0,0 +1,67 @@
+#Reports the import-time cost of each module loaded when the app starts, to catch cold start regressions
+
+import argparse
+import subprocess
+import sys
+
+# Libraries that should only be imported once a network is analysed, never at startup
+HEAVY_MODULES = ["pandas", "numpy", "scipy", "networkx", "dash", "dash_cytoscape", "sklearn", "plotly"]
+
+def measure_imports(module="app"):
+    """
+    Imports the module in a fresh interpreter with -X importtime.
+    Returns a list of (module, self microseconds, cumulative microseconds) in import order.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    return timings
+
+def top_level_costs(timings):
+    """
+    Sums the self time of every module by its top-level package
+    """
+    costs = {}
+    for name, self_us, _ in timings:
+        package = name.split(".")[0]
+        costs[package] = costs.get(package, 0) + self_us
+    return costs
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module import cost of the app at startup")
+    parser.add_argument("--module", default="app", help="module to import (default: app)")
+    parser.add_argument("--top", type=int, default=15, help="number of packages to list")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the total import time exceeds this")
+    args = parser.parse_args()
+
+    timings = measure_imports(args.module)
+    costs = top_level_costs(timings)
+    total_us = sum(costs.values())
+
+    print(f"{'package':<30}{'ms':>10}")
+    for package, cost in sorted(costs.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{package:<30}{cost / 1000:>10.1f}")
+    print(f"{'total':<30}{total_us / 1000:>10.1f}")
+
+    failures = []
+    heavy = [package for package in HEAVY_MODULES if package in costs]
+    if heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if args.max_ms is not None and total_us / 1000 > args.max_ms:
+        failures.append(f"total import time {total_us / 1000:.1f} ms exceeds {args.max_ms} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
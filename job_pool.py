@@ -0,0 +1,96 @@
+#Bounded process pool for the heavy analysis stages, with admission control
+#
+# Request threads submit the CPU-bound stages (centralities, E-I, global metrics, blocks) here and wait
+# on the futures, so the GIL is free for cheap requests (node clicks, static pages) while a big network
+# is analysed. At most NETWORK_MAX_JOBS analyses run or wait at once; beyond that requests are turned
+# away with ServerBusyError instead of queueing without bound. NETWORK_WORKERS=0 runs stages inline.
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+
+# Worker processes, and analyses admitted at once (running or waiting for a worker)
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+DEFAULT_MAX_JOBS = 8
+
+class ServerBusyError(RuntimeError):
+    """
+    Raised when the analysis queue is full; the request should be retried later
+    """
+
+pool = None
+pool_lock = threading.Lock()
+admission = None
+
+def num_workers():
+    return int(os.environ.get("NETWORK_WORKERS", DEFAULT_WORKERS))
+
+def max_jobs():
+    return int(os.environ.get("NETWORK_MAX_JOBS", DEFAULT_MAX_JOBS))
+
+def get_pool():
+    """
+    Starts the worker processes the first time they are needed
+    """
+    global pool, admission
+    with pool_lock:
+        if admission is None:
+            admission = threading.BoundedSemaphore(max_jobs())
+        if pool is None and num_workers() > 0:
+            # spawn, not fork: forking a threaded server can copy held locks into the workers
+            pool = ProcessPoolExecutor(max_workers=num_workers(), mp_context=multiprocessing.get_context("spawn"))
+    return pool
+
+@contextmanager
+def admitted():
+    """
+    Holds one of the analysis slots for the duration of the block; raises ServerBusyError if none is free
+    """
+    get_pool()
+    if not admission.acquire(blocking=False):
+        raise ServerBusyError("The server is busy analysing other networks. Please try again in a moment.")
+    try:
+        yield
+    finally:
+        admission.release()
+
+def submit(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) in a worker process and returns its Future.
+    func and its arguments must be picklable (module-level functions, graphs, DataFrames).
+    """
+    executor = get_pool()
+    if executor is not None:
+        return executor.submit(func, *args, **kwargs)
+
+    # Inline mode: run now and hand back an already completed Future
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def submit_cached(dataset_id, analysis, params, func, *args, **kwargs):
+    """
+    Like submit, but checks the results store first (see results_store): a stored result comes back as an
+    already completed Future without sending anything to the workers, and a computed one is stored by the worker.
+    """
+    import results_store
+
+    value = results_store.lookup(dataset_id, analysis, params)
+    if value is results_store.MISSING:
+        return submit(results_store.cached_call, dataset_id, analysis, params, func, *args, **kwargs)
+
+    future = Future()
+    future.set_result(value)
+    return future
+
+def shutdown():
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+            pool = None
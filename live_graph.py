@@ -0,0 +1,234 @@
+#Incremental edits to a network with live metric maintenance
+#
+# A live graph is a dictionary wrapping a copy of the graph_dict from read_input and of its networkx graph,
+# so edits never reach the graph the visualization and its indexes were built from.
+# Density, degrees and the internal/external tie counts of every attribute are updated in O(1)
+# per edit; betweenness and closeness are marked stale and recomputed on the next request.
+
+import copy
+
+import networkx as nx
+
+from calc_render import make_x_graph
+
+# Metrics that need a full pass over the graph
+EXPENSIVE_METRICS = {
+    "betweenness": nx.betweenness_centrality,
+    "closeness": nx.closeness_centrality,
+}
+
+# Fields every edit action needs, besides the optional weight and attributes
+EDIT_FIELDS = {
+    "add_edge": ("source", "target"),
+    "remove_edge": ("source", "target"),
+    "update_weight": ("source", "target", "weight"),
+    "add_node": ("node",),
+    "remove_node": ("node",),
+}
+
+class UnknownNodeError(LookupError):
+    """An edit names a node that is not in the network"""
+
+def make_live_graph(graph_dict, G=None):
+    """
+    Wraps a copy of a graph_dict (and optionally of its already built networkx graph) for incremental edits.
+    The tie counts are taken once here; every later edit updates them in place.
+    """
+    graph_dict = copy.deepcopy(graph_dict)
+    G = make_x_graph(graph_dict) if G is None else G.copy()
+
+    live = {
+        "graph_dict": graph_dict,
+        "G": G,
+        "num_nodes": G.number_of_nodes(),
+        "num_edges": G.number_of_edges(),
+        "degrees": dict(G.degree()),
+        "attribute_counts": {},
+        "metrics": {},
+        "stale": set(EXPENSIVE_METRICS),
+    }
+
+    for u, v in G.edges():
+        count_tie(live, u, v, 1)
+
+    return live
+
+def node_attributes(live, node):
+    return live["graph_dict"].get(node, {}).get("attributes", {})
+
+def count_tie(live, u, v, change):
+    """
+    Adds change (+1 or -1) to the internal or external tie count of every attribute both nodes have
+    """
+    attributes_u = node_attributes(live, u)
+    attributes_v = node_attributes(live, v)
+
+    for attr_name, value in attributes_u.items():
+        if attr_name not in attributes_v:
+            continue
+        counts = live["attribute_counts"].setdefault(attr_name, {"internal": 0, "external": 0})
+        if value == attributes_v[attr_name]:
+            counts["internal"] += change
+        else:
+            counts["external"] += change
+
+def mark_stale(live):
+    live["stale"].update(EXPENSIVE_METRICS)
+
+def add_node(live, node, attributes=None):
+    """
+    Adds an isolated node with the given attributes
+    """
+    if node in live["G"]:
+        raise ValueError(f"Node {node} already exists.")
+
+    live["graph_dict"][node] = {"targets": {}, "attributes": dict(attributes or {})}
+    live["G"].add_node(node, **(attributes or {}))
+    live["num_nodes"] += 1
+    live["degrees"][node] = 0
+    mark_stale(live)
+
+def remove_node(live, node):
+    """
+    Removes a node and all of its ties
+    """
+    if node not in live["G"]:
+        raise ValueError(f"Node {node} does not exist.")
+
+    for neighbor in list(live["G"].neighbors(node)):
+        remove_edge(live, node, neighbor)
+
+    # All ties are gone, so only the node's own entry is left
+    del live["graph_dict"][node]
+    live["G"].remove_node(node)
+    live["num_nodes"] -= 1
+    del live["degrees"][node]
+    mark_stale(live)
+
+def add_edge(live, u, v, weight=1):
+    """
+    Adds a tie between u and v, creating missing nodes. Updates the weight if the tie already exists.
+    """
+    if u == v:
+        raise ValueError("Self-loops are not counted in this network.")
+    if live["G"].has_edge(u, v):
+        update_weight(live, u, v, weight)
+        return
+
+    for node in (u, v):
+        if node not in live["G"]:
+            add_node(live, node)
+
+    live["graph_dict"][u].setdefault("targets", {})[v] = weight
+    live["G"].add_edge(u, v, weight=weight)
+    live["num_edges"] += 1
+    live["degrees"][u] += 1
+    live["degrees"][v] += 1
+    count_tie(live, u, v, 1)
+    mark_stale(live)
+
+def remove_edge(live, u, v):
+    """
+    Removes the tie between u and v, whichever of them it was read from
+    """
+    if not live["G"].has_edge(u, v):
+        raise ValueError(f"There is no tie between {u} and {v}.")
+
+    # read_input stores each tie once, under the node it was first seen from
+    for source, target in ((u, v), (v, u)):
+        live["graph_dict"].get(source, {}).get("targets", {}).pop(target, None)
+
+    live["G"].remove_edge(u, v)
+    live["num_edges"] -= 1
+    live["degrees"][u] -= 1
+    live["degrees"][v] -= 1
+    count_tie(live, u, v, -1)
+    mark_stale(live)
+
+def update_weight(live, u, v, weight):
+    """
+    Changes the weight of an existing tie. Centralities are unweighted, so nothing becomes stale.
+    """
+    if not live["G"].has_edge(u, v):
+        raise ValueError(f"There is no tie between {u} and {v}.")
+
+    for source, target in ((u, v), (v, u)):
+        targets = live["graph_dict"].get(source, {}).get("targets", {})
+        if target in targets:
+            targets[target] = weight
+    live["G"][u][v]["weight"] = weight
+
+def apply_edit(live, edit):
+    """
+    Applies one edit given as a dictionary with an action from EDIT_FIELDS and its fields.
+    Unlike add_edge, ties are only added between existing nodes: new nodes come from an add_node edit.
+    Raises UnknownNodeError for a node that is not in the network and ValueError for any other invalid edit.
+    """
+    action = edit.get("action")
+    if action not in EDIT_FIELDS:
+        raise ValueError(f"Unknown action: {action}")
+    missing = [field for field in EDIT_FIELDS[action] if field not in edit]
+    if missing:
+        raise ValueError(f"Missing field: {missing[0]}")
+
+    if action != "add_node":
+        for field in ("source", "target", "node"):
+            if field in EDIT_FIELDS[action] and edit[field] not in live["G"]:
+                raise UnknownNodeError(edit[field])
+
+    if action == "add_edge":
+        add_edge(live, edit["source"], edit["target"], edit.get("weight", 1))
+    elif action == "remove_edge":
+        remove_edge(live, edit["source"], edit["target"])
+    elif action == "update_weight":
+        update_weight(live, edit["source"], edit["target"], edit["weight"])
+    elif action == "add_node":
+        add_node(live, edit["node"], edit.get("attributes"))
+    else:
+        remove_node(live, edit["node"])
+
+def density(live):
+    """
+    Density of the undirected network: ties over possible pairs
+    """
+    n = live["num_nodes"]
+    if n < 2:
+        return 0
+    return 2 * live["num_edges"] / (n * (n - 1))
+
+def degree_centrality(live, node):
+    n = live["num_nodes"]
+    if n < 2:
+        return 0
+    return live["degrees"][node] / (n - 1)
+
+def ei_index(live, attr_name):
+    """
+    Whole-network E-I index of an attribute from the maintained tie counts
+    """
+    counts = live["attribute_counts"].get(attr_name, {"internal": 0, "external": 0})
+    total = counts["internal"] + counts["external"]
+    if total == 0:
+        return 0
+    return (counts["external"] - counts["internal"]) / total
+
+def get_metric(live, name):
+    """
+    Returns an expensive node metric (betweenness or closeness), recomputing it only if an edit made it stale
+    """
+    if name in live["stale"] or name not in live["metrics"]:
+        live["metrics"][name] = EXPENSIVE_METRICS[name](live["G"])
+        live["stale"].discard(name)
+    return live["metrics"][name]
+
+def summary(live):
+    """
+    The cheap, always up-to-date metrics of the live graph
+    """
+    return {
+        "nodes": live["num_nodes"],
+        "ties": live["num_edges"],
+        "density": density(live),
+        "ei_indices": {attr_name: ei_index(live, attr_name) for attr_name in live["attribute_counts"]},
+        "stale": sorted(live["stale"]),
+    }
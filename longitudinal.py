@@ -0,0 +1,177 @@
+#Longitudinal networks: several waves of one panel over a shared node index
+#
+# Every wave is parsed as a normal upload (reading_data.read_uploaded_network) and mapped onto one node
+# index, the union of the actors of all waves. The first wave is kept whole and every later wave only as
+# its diff against the previous one: ties added, removed and reweighted. This is the only copy the server
+# keeps; a wave opened on its own is rebuilt from it (see wave_dataset). Replaying the diffs on one live
+# graph (see live_graph) updates density, degrees and the E-I tie counts per changed tie; betweenness and
+# closeness are recomputed only for waves whose ties actually changed.
+
+import hashlib
+import re
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+import live_graph
+from attribute_encoding import encode_attributes, attribute_value
+
+def wave_order(file_names):
+    """
+    Positions of the wave files sorted by name, numbers compared by value (wave2 before wave10)
+    """
+    def natural_key(name):
+        return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+    return sorted(range(len(file_names)), key=lambda i: natural_key(file_names[i]))
+
+def wave_ties(matrix):
+    """
+    Ties of a parsed matrix as {(u, v): weight} with u < v: each undirected tie once, without self-loops,
+    with the weight first read for it (as build_input keeps it)
+    """
+    row_names, col_names, rows, cols, values = matrix
+    ties = {}
+    for row, col, weight in zip(rows.tolist(), cols.tolist(), values.tolist()):
+        u, v = row_names[row], col_names[col]
+        if u != v:
+            ties.setdefault((u, v) if u < v else (v, u), weight)
+    return ties
+
+def wave_diff(previous, current):
+    """
+    Ties added, removed and reweighted from one wave to the next
+    """
+    return {
+        "added": {pair: weight for pair, weight in current.items() if pair not in previous},
+        "removed": [pair for pair in previous if pair not in current],
+        "reweighted": {pair: weight for pair, weight in current.items() if pair in previous and previous[pair] != weight},
+    }
+
+def load_waves(waves, names=None):
+    """
+    Builds a longitudinal dataset from parsed uploads in wave order.
+    Attributes are the panel's: the first value found for each actor, in wave order.
+    Returns a dictionary with the shared node index, the positions of every wave's actors in it, the attributes,
+    the ties of the first wave and the diffs.
+    """
+    nodes = list(dict.fromkeys(name for wave in waves for name in wave["matrix"][0]))
+    position = {node: i for i, node in enumerate(nodes)}
+
+    base, diffs, previous = None, [], None
+    for wave in waves:
+        current = wave_ties(wave["matrix"])
+        if previous is None:
+            base = current
+        else:
+            diffs.append(wave_diff(previous, current))
+        previous = current
+
+    frames = [wave["attributes"].astype(object) for wave in waves if len(wave["attributes"].columns)]
+    attributes = encode_attributes(reduce(lambda a, b: a.combine_first(b), frames)) if frames else pd.DataFrame(index=nodes)
+    attributes.index = attributes.index.astype(str)
+
+    names = list(names) if names else [f"Wave {k + 1}" for k in range(len(waves))]
+    return {
+        # The names are shown with the results, so they are part of the id
+        "id": hashlib.sha1("/".join([wave["id"] for wave in waves] + names).encode()).hexdigest(),
+        "wave_ids": [wave["id"] for wave in waves],
+        "names": names,
+        "nodes": nodes,
+        "wave_nodes": [np.array([position[name] for name in wave["matrix"][0]], dtype=np.int32) for wave in waves],
+        "attributes": attributes,
+        "base": base or {},
+        "diffs": diffs,
+    }
+
+def first_wave_graph_dict(longitudinal):
+    """
+    graph_dict of the first wave over the whole node index; actors that join later start out isolated
+    """
+    graph_dict = {node: {"targets": {}} for node in longitudinal["nodes"]}
+    for (u, v), weight in longitudinal["base"].items():
+        graph_dict[u]["targets"][v] = weight
+
+    attributes = longitudinal["attributes"]
+    for node in attributes.index:
+        if node in graph_dict:
+            values = {attr_name: attribute_value(attributes.at[node, attr_name]) for attr_name in attributes.columns}
+            graph_dict[node]["attributes"] = {attr_name: value for attr_name, value in values.items() if value is not None}
+
+    return graph_dict
+
+def ties_at(longitudinal, wave):
+    """
+    Ties of one wave, {(u, v): weight}, replayed from the first wave and the diffs up to it
+    """
+    ties = dict(longitudinal["base"])
+    for diff in longitudinal["diffs"][:wave]:
+        for pair in diff["removed"]:
+            del ties[pair]
+        ties.update(diff["added"])
+        ties.update(diff["reweighted"])
+    return ties
+
+def wave_dataset_id(longitudinal, wave):
+    return hashlib.sha1(f"{longitudinal['id']}/{wave}".encode()).hexdigest()
+
+def wave_dataset(longitudinal, wave):
+    """
+    One wave as a parsed upload, with the same shape as read_uploaded_network returns, rebuilt from the first
+    wave and the diffs. Ties are read in both directions, as from a symmetric matrix; the attributes are the panel's.
+    """
+    names = [longitudinal["nodes"][i] for i in longitudinal["wave_nodes"][wave].tolist()]
+    position = {name: i for i, name in enumerate(names)}
+
+    ties = ties_at(longitudinal, wave)
+    u = np.array([position[a] for a, _ in ties], dtype=np.int32)
+    v = np.array([position[b] for _, b in ties], dtype=np.int32)
+    weights = np.array(list(ties.values()))
+    rows, cols, values = np.concatenate([u, v]), np.concatenate([v, u]), np.concatenate([weights, weights])
+    order = np.lexsort((cols, rows))
+
+    attributes = longitudinal["attributes"]
+    attributes = attributes[attributes.index.isin(names)]
+    return {
+        "id": wave_dataset_id(longitudinal, wave),
+        "matrix": (names, list(names), rows[order], cols[order], values[order]),
+        "attributes": attributes,
+    }
+
+def apply_diff(live, diff):
+    """
+    Moves a live graph to the next wave, one tie at a time
+    """
+    for u, v in diff["removed"]:
+        live_graph.remove_edge(live, u, v)
+    for (u, v), weight in diff["added"].items():
+        live_graph.add_edge(live, u, v, weight)
+    for (u, v), weight in diff["reweighted"].items():
+        live_graph.update_weight(live, u, v, weight)
+
+def analyse_waves(longitudinal, centrality=True):
+    """
+    Replays the waves on one live graph. Returns one dictionary per wave with the live_graph summary
+    (nodes, ties, density, E-I indices), the size of its diff, the degrees and, with centrality, the exact
+    betweenness and closeness. These are only recomputed when the wave added or removed ties.
+    """
+    live = live_graph.make_live_graph(first_wave_graph_dict(longitudinal))
+
+    results = []
+    for wave, diff in enumerate([None] + longitudinal["diffs"]):
+        if diff is not None:
+            apply_diff(live, diff)
+
+        result = live_graph.summary(live)
+        result["wave"] = longitudinal["names"][wave]
+        result["added"] = len(diff["added"]) if diff else result["ties"]
+        result["removed"] = len(diff["removed"]) if diff else 0
+        result["reweighted"] = len(diff["reweighted"]) if diff else 0
+        result["degrees"] = dict(live["degrees"])
+        if centrality:
+            result["recomputed"] = bool(live["stale"])
+            result["betweenness"] = live_graph.get_metric(live, "betweenness")
+            result["closeness"] = live_graph.get_metric(live, "closeness")
+        results.append(result)
+
+    return results
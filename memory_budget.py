@@ -0,0 +1,204 @@
+#Memory planning for the analysis stages, so one large upload cannot exhaust the worker
+
+import logging
+import os
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# tracemalloc is process-wide: one stage is measured at a time, the others run unmeasured meanwhile
+trace_lock = threading.Lock()
+
+# Per-request memory budget, configurable through the environment (in megabytes)
+DEFAULT_BUDGET_MB = 1024
+
+# Rough per-object costs used by the estimates (bytes)
+BYTES_PER_CELL = 8             # float64 cell of a dense matrix
+BYTES_PER_SPARSE_TIE = 16      # value + row index + column index
+BYTES_PER_DICT_TIE = 250       # entry in graph_dict["targets"] plus the seen_edges tuple
+BYTES_PER_NX_NODE = 600        # networkx node with its attribute and adjacency dicts
+BYTES_PER_NX_TIE = 400         # networkx edge stored in both adjacency dicts
+BYTES_PER_LIST_TIE = 80        # tie direction as Python list entries (index and weight objects)
+
+# Exact betweenness costs roughly nodes * ties operations; beyond this it is sampled
+BETWEENNESS_WORK_LIMIT = 5e8
+MIN_BETWEENNESS_SAMPLES = 32
+
+# Rows of the matrix CSV parsed at once by the sparse reader (reading_data.MATRIX_CHUNK_ROWS)
+MATRIX_CHUNK_ROWS = 512
+
+# Landmarks of the distance oracle (graph_index.DEFAULT_LANDMARKS)
+DISTANCE_LANDMARKS = 16
+
+# Rows of the similarity matrix computed at once by the blocked blockmodeling variant
+BLOCKMODELING_BLOCK_ROWS = 256
+
+# Rows unpacked at once while bit-packing a matrix (bit_matrix.PACK_CHUNK_ROWS)
+PACK_CHUNK_ROWS = 512
+
+# The force layout moves every node in a Python loop on each iteration; larger networks get the spectral layout
+FORCE_LAYOUT_MAX_NODES = 2000
+# networkx lays out smaller graphs on dense n x n arrays
+FORCE_LAYOUT_DENSE_NODES = 500
+
+class MemoryBudgetError(ValueError):
+    """
+    Raised when no variant of a required stage fits in the memory budget
+    """
+
+def memory_budget():
+    """
+    Returns the per-request memory budget in bytes
+    """
+    return int(float(os.environ.get("NETWORK_MEMORY_BUDGET_MB", DEFAULT_BUDGET_MB)) * 1024 ** 2)
+
+def format_bytes(num_bytes):
+    """
+    Formats a byte count for the log
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def estimate_stage_memory(num_nodes, num_ties, binary=False):
+    """
+    Estimates the peak memory of every variant of each analysis stage from the node and tie counts.
+    binary networks compare bit-packed rows in blockmodeling (see bit_matrix).
+    Returns a dictionary of stage -> variant -> bytes
+    """
+    n, m = num_nodes, num_ties
+    dense_matrix = n * n * BYTES_PER_CELL
+    packed_matrix = n * -(-n // 64) * 8
+    # One block of row comparisons: booleans per cell, or 64-bit words of XOR-ed rows when binary
+    compare_bytes = packed_matrix if binary else n * n
+    sparse_matrix = m * BYTES_PER_SPARSE_TIE
+    graph_dict = m * BYTES_PER_DICT_TIE
+    nx_graph = n * BYTES_PER_NX_NODE + m * BYTES_PER_NX_TIE
+
+    return {
+        # read_csv frame, adjacency array and the adjacency DataFrame; the sparse reader holds one chunk of rows
+        "read_input": {
+            "dense": 3 * dense_matrix + graph_dict,
+            "sparse": 3 * sparse_matrix + graph_dict + 2 * MATRIX_CHUNK_ROWS * n * BYTES_PER_CELL,
+        },
+        # networkx graph, the three centrality dictionaries and the working set of one betweenness source
+        # (predecessor lists over the ties, distance, path count, dependency and stack entries per node).
+        # Sampling sources only shortens the run: each source needs the same working set, so it is no memory variant
+        "centrality": {
+            "exact": nx_graph + 3 * n * 100 + 5 * n * 100 + 2 * m * 8,
+        },
+        # symmetric tie matrix, ties into each group and the per-node counts (mixing_matrix)
+        "ei": {
+            "sparse": 6 * sparse_matrix + 6 * n * BYTES_PER_CELL,
+            # bit-packed ties, one AND-ed copy, a chunk of unpacked rows and the transposed ties they come from
+            "packed": 2 * packed_matrix + 2 * min(PACK_CHUNK_ROWS, n) * n + 2 * sparse_matrix + 6 * n * BYTES_PER_CELL,
+        },
+        # A @ A for the triangle counts (about twice the ties on sparse networks), components and two BFS sweeps
+        "structure": {
+            "sparse": 8 * sparse_matrix + 8 * n * BYTES_PER_CELL,
+        },
+        # CSR index plus one int32 distance row per landmark
+        "distances": {
+            "landmarks": sparse_matrix + (DISTANCE_LANDMARKS + 2) * n * 4,
+        },
+        # similarity, distance and linkage matrices, plus one block of comparisons
+        "blockmodeling": {
+            "exact": 3 * dense_matrix + n * compare_bytes,
+            "blocked": 3 * dense_matrix + BLOCKMODELING_BLOCK_ROWS * compare_bytes,
+            # modularity communities (blockmodeling.community_blockmodeling): sparse products plus the
+            # ties as Python lists for the local moving loop
+            "communities": 6 * sparse_matrix + 2 * m * BYTES_PER_LIST_TIE + n * BYTES_PER_NX_NODE,
+        },
+        # networkx graph plus the displacement arrays of the Fruchterman-Reingold layout
+        "layout": {
+            "force": nx_graph + (3 * dense_matrix if n < FORCE_LAYOUT_DENSE_NODES else 4 * sparse_matrix + 8 * n * BYTES_PER_CELL),
+            # normalized adjacency products and the Lanczos vectors of the eigensolver
+            "spectral": nx_graph + 4 * sparse_matrix + 24 * n * BYTES_PER_CELL,
+        },
+    }
+
+def plan_analysis(num_nodes, num_ties, budget=None, binary=False):
+    """
+    Picks the cheapest variant of every stage that keeps within the budget, preferring exact and dense ones.
+    binary tells whether every tie has value 1 (see estimate_stage_memory).
+    Raises MemoryBudgetError if the graph cannot be read or analysed at all within the budget.
+    """
+    if budget is None:
+        budget = memory_budget()
+
+    estimates = estimate_stage_memory(num_nodes, num_ties, binary)
+    stages = {}
+
+    # Stages listed in order of preference; None means the stage can be skipped
+    preferences = {
+        "read_input": ["dense", "sparse"],
+        # Dense-ish networks count E-I ties from bit-packed rows, sparse ones from the tie list
+        "ei": ["packed", "sparse"] if estimates["ei"]["packed"] < estimates["ei"]["sparse"] else ["sparse", "packed"],
+        "centrality": ["exact"],
+        "structure": ["sparse", None],
+        "distances": ["landmarks", None],
+        "blockmodeling": ["exact", "blocked", "communities", None],
+        "layout": ["force", "spectral", None],
+    }
+
+    for stage, variants in preferences.items():
+        for variant in variants:
+            if variant is None:
+                stages[stage] = {"variant": "skip", "estimate": 0}
+                break
+            if estimates[stage][variant] <= budget:
+                stages[stage] = {"variant": variant, "estimate": estimates[stage][variant]}
+                break
+        else:
+            cheapest = min(estimates[stage].values())
+            raise MemoryBudgetError(
+                f"This network ({num_nodes} nodes, {num_ties} ties) needs about {format_bytes(cheapest)} "
+                f"to run the {stage} stage, but the memory budget is {format_bytes(budget)}. "
+                "Please upload a smaller network."
+            )
+
+    # Betweenness is sampled once exact computation takes too long; this bounds time, the memory estimate stays
+    if num_nodes * max(num_ties, 1) > BETWEENNESS_WORK_LIMIT:
+        samples = max(MIN_BETWEENNESS_SAMPLES, int(BETWEENNESS_WORK_LIMIT / max(num_ties, 1)))
+        stages["centrality"].update(variant="approximate", samples=min(samples, num_nodes))
+
+    if num_nodes > FORCE_LAYOUT_MAX_NODES and stages["layout"]["variant"] == "force":
+        stages["layout"] = {"variant": "spectral", "estimate": estimates["layout"]["spectral"]}
+
+    if stages["blockmodeling"]["variant"] == "blocked":
+        stages["blockmodeling"]["block_rows"] = BLOCKMODELING_BLOCK_ROWS
+
+    return {"budget": budget, "nodes": num_nodes, "ties": num_ties, "stages": stages}
+
+def measure_stage(plan, stage, func, *args, **kwargs):
+    """
+    Runs func and, with NETWORK_TRACE_MEMORY=1, logs its peak memory (tracemalloc) next to the planned estimate.
+    Tracing slows the stage down, so it is off by default. While another stage of this process is being
+    measured, func runs unmeasured rather than resetting that stage's peak.
+    """
+    if os.environ.get("NETWORK_TRACE_MEMORY", "0") != "1" or not trace_lock.acquire(blocking=False):
+        return func(*args, **kwargs)
+
+    try:
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        try:
+            result = func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not already_tracing:
+                tracemalloc.stop()
+    finally:
+        trace_lock.release()
+
+    planned = plan["stages"][stage]
+    logger.info("%s (%s): estimated %s, measured peak %s, budget %s", stage, planned["variant"],
+                format_bytes(planned["estimate"]), format_bytes(peak), format_bytes(plan["budget"]))
+
+    return result
@@ -0,0 +1,94 @@
+#E-I index at the network, group and node level from one mixing-matrix pass
+
+import numpy as np
+import scipy.sparse
+
+from attribute_encoding import attribute_codes
+from bit_matrix import pack_ties, group_tie_counts
+from temp_e_i import as_sparse, clean_matrix
+
+def symmetric_ties(matrix):
+    """
+    Returns the matrix as a sparse, symmetric, binary CSR matrix without self-loops (ties ignore direction and weight)
+    """
+    sparse_matrix = as_sparse(matrix)
+    if sparse_matrix is None:
+        sparse_matrix = scipy.sparse.coo_matrix(np.nan_to_num(np.asarray(matrix, dtype=float)))
+
+    ties = clean_matrix(sparse_matrix).tocoo()
+    off_diagonal = ties.row != ties.col
+    return scipy.sparse.csr_matrix((ties.data[off_diagonal], (ties.row[off_diagonal], ties.col[off_diagonal])),
+                                   shape=ties.shape)
+
+def ei_ratio(external, internal):
+    """
+    (E - I) / (E + I), elementwise, with 0 where there are no ties
+    """
+    external = np.asarray(external, dtype=float)
+    internal = np.asarray(internal, dtype=float)
+    total = external + internal
+    return np.divide(external - internal, total, out=np.zeros_like(total), where=total > 0)
+
+def ei_decomposition(matrix, attribute_column, packed_ties=None):
+    """
+    Computes the E-I index of the whole network, of each attribute group and of each node with sparse products.
+    attribute_column (a categorical Series, or any values) must be aligned with the matrix rows;
+    nodes with a missing value take no part.
+    packed_ties (bit_matrix.pack_ties of a binary matrix) replaces the sparse products with popcounts.
+
+    Returns a dictionary with:
+        categories - the attribute values, in the order of the mixing matrix
+        mixing     - k x k tie counts between groups (each tie counted from both ends)
+        network    - whole-network E-I index
+        groups     - E-I index of each group, from its members' internal and external ties
+        nodes      - E-I index of each node
+        internal, external - per-node internal and external tie counts
+    """
+    # Integer codes of the attribute (-1 for missing values), straight from categorical columns
+    codes, categories = attribute_codes(attribute_column)
+    valid = codes >= 0
+    k = len(categories)
+    n = len(codes)
+
+    # Indicator matrix: one column per group
+    membership = scipy.sparse.csr_matrix((np.ones(valid.sum()), (np.flatnonzero(valid), codes[valid])), shape=(n, k))
+
+    # Ties from each node into each group, then group-by-group tie counts
+    if packed_ties is not None:
+        ties_to_groups = scipy.sparse.csr_matrix(group_tie_counts(packed_ties, codes, k).astype(float))
+    else:
+        ties_to_groups = symmetric_ties(matrix) @ membership
+    mixing = np.asarray((membership.T @ ties_to_groups).todense())
+
+    # Per-node internal ties are the ties into the node's own group
+    internal = np.zeros(n)
+    internal[valid] = np.asarray(ties_to_groups[np.flatnonzero(valid), codes[valid]]).ravel()
+    external = np.asarray(ties_to_groups.sum(axis=1)).ravel() - internal
+    external[~valid] = 0
+
+    group_internal = np.diag(mixing)
+    group_external = mixing.sum(axis=1) - group_internal
+
+    # Each tie appears twice in the mixing matrix, once from each end
+    network_internal = group_internal.sum() / 2
+    network_external = group_external.sum() / 2
+
+    return {
+        "categories": list(categories),
+        "mixing": mixing,
+        "network": float(ei_ratio(network_external, network_internal)),
+        "groups": dict(zip(categories, ei_ratio(group_external, group_internal).tolist())),
+        "nodes": ei_ratio(external, internal),
+        "internal": internal,
+        "external": external,
+    }
+
+def attribute_ei(matrix, attributes, packed=False):
+    """
+    Runs ei_decomposition for every column of the attribute DataFrame.
+    matrix is the adjacency DataFrame from read_input; attributes are aligned to its rows by node.
+    packed counts the ties of a binary matrix from its bit-packed rows (the "packed" variant of memory_budget)
+    """
+    aligned = attributes.reindex(matrix.index)
+    packed_ties = pack_ties(matrix) if packed else None
+    return {attr_name: ei_decomposition(matrix, aligned[attr_name], packed_ties) for attr_name in attributes.columns}
@@ -0,0 +1,103 @@
+#Global structure of a network from sparse products, near-linear in the number of ties
+
+import numpy as np
+import scipy.sparse
+from scipy.sparse import csgraph
+
+from mixing_matrix import symmetric_ties
+from temp_e_i import as_sparse
+
+def directed_ties(matrix):
+    """
+    Returns the matrix as a sparse binary CSR matrix keeping tie direction, without self-loops
+    """
+    sparse_matrix = as_sparse(matrix)
+    if sparse_matrix is None:
+        sparse_matrix = scipy.sparse.coo_matrix(np.nan_to_num(np.asarray(matrix, dtype=float)))
+
+    ties = sparse_matrix.tocoo()
+    keep = (ties.row != ties.col) & (ties.data != 0)
+    return scipy.sparse.csr_matrix((np.ones(keep.sum(), dtype=np.int8), (ties.row[keep], ties.col[keep])),
+                                   shape=ties.shape)
+
+def reciprocity(arcs):
+    """
+    Share of directed ties that are returned
+    """
+    if arcs.nnz == 0:
+        return 0
+    return arcs.multiply(arcs.T).nnz / arcs.nnz
+
+def triangle_counts(ties):
+    """
+    Number of triangles through each node: the diagonal of A^3 / 2, from (A @ A) restricted to the ties of A
+    """
+    return np.asarray((ties @ ties).multiply(ties).sum(axis=1)).ravel() / 2
+
+def eccentricity(ties, node):
+    """
+    Largest hop distance from node within its component, and the node that reaches it
+    """
+    distances = csgraph.shortest_path(ties, method="D", unweighted=True, indices=node)
+    distances[np.isinf(distances)] = -1
+    farthest = int(np.argmax(distances))
+    return int(distances[farthest]), farthest
+
+def diameter_bounds(ties, labels, largest):
+    """
+    Double-sweep bounds on the diameter of the largest component: the eccentricity of the node farthest
+    from a start node is a lower bound, and twice the start node's eccentricity an upper bound
+    """
+    members = np.flatnonzero(labels == largest)
+    degrees = np.diff(ties.indptr)[members]
+    start = members[np.argmax(degrees)]
+
+    start_eccentricity, farthest = eccentricity(ties, start)
+    sweep_eccentricity, _ = eccentricity(ties, farthest)
+
+    return max(start_eccentricity, sweep_eccentricity), 2 * start_eccentricity
+
+def global_metrics(matrix):
+    """
+    Density, clustering, components, degree distribution, reciprocity and diameter bounds in one pass.
+    matrix is the adjacency matrix (dense, sparse or a DataFrame); tie weights are ignored and
+    reciprocity is only reported when the matrix is not symmetric.
+    """
+    ties = symmetric_ties(matrix)
+    n = ties.shape[0]
+    degrees = np.diff(ties.indptr)
+    m = ties.nnz // 2
+
+    # Clustering from per-node triangles and connected triples
+    triangles = triangle_counts(ties)
+    triples = degrees * (degrees - 1) / 2
+    local_clustering = np.divide(triangles, triples, out=np.zeros(n), where=triples > 0)
+
+    num_components, labels = csgraph.connected_components(ties, directed=False)
+    component_sizes = np.bincount(labels) if n > 0 else np.zeros(0, dtype=int)
+    largest = int(np.argmax(component_sizes)) if n > 0 else 0
+
+    metrics = {
+        "nodes": n,
+        "ties": m,
+        "density": 2 * m / (n * (n - 1)) if n > 1 else 0,
+        "transitivity": float(triangles.sum() / triples.sum()) if triples.sum() > 0 else 0,
+        "average_clustering": float(local_clustering.mean()) if n > 0 else 0,
+        "triangles": int(round(triangles.sum() / 3)),
+        "components": num_components,
+        "largest_component": int(component_sizes.max()) if n > 0 else 0,
+        "degree_distribution": np.bincount(degrees).tolist() if n > 0 else [],
+        "mean_degree": float(degrees.mean()) if n > 0 else 0,
+        "max_degree": int(degrees.max()) if n > 0 else 0,
+        "reciprocity": None,
+        "diameter": (0, 0),
+    }
+
+    arcs = directed_ties(matrix)
+    if (arcs != arcs.T).nnz > 0:
+        metrics["reciprocity"] = reciprocity(arcs)
+
+    if m > 0:
+        metrics["diameter"] = diameter_bounds(ties, labels, largest)
+
+    return metrics
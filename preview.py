@@ -0,0 +1,79 @@
+#Cheap first view of an uploaded network, shown while the full analysis runs
+#
+# Everything here comes from the parsed tie triplets in a few vectorized passes: the undirected ties (each
+# pair once, without self-loops), the degrees, the density, and the PREVIEW_NODES nodes of highest degree
+# with the ties among them as Cytoscape elements. Node positions are those of an earlier force layout when
+# one is given (see app.start_analysis), otherwise the circular layout.
+
+import numpy as np
+import scipy.sparse
+
+from calc_render import calculate_positions
+
+# Nodes drawn in the preview, and actors listed as most central
+PREVIEW_NODES = 200
+TOP_ACTORS = 5
+
+def aligned_ties(matrix):
+    """
+    Node names (the row names, then column names that are not rows) and the (row, column) positions of the ties
+    among them, so columns in another order than the rows, or extra columns, land on the right node
+    """
+    row_names, col_names, rows, cols, values = matrix
+    names = list(dict.fromkeys(list(row_names) + list(col_names)))
+    position = {name: i for i, name in enumerate(names)}
+    col_positions = np.array([position[name] for name in col_names], dtype=np.int64)
+    return names, np.asarray(rows, dtype=np.int64), col_positions[np.asarray(cols, dtype=np.int64)]
+
+def directed_matrix(matrix):
+    """
+    Node names and the uploaded (directed, weighted) ties as a square sparse matrix over them
+    """
+    names, u, v = aligned_ties(matrix)
+    ties = scipy.sparse.csr_matrix((np.asarray(matrix[4]), (u, v)), shape=(len(names), len(names)))
+    return names, ties
+
+def undirected_ties(matrix):
+    """
+    Node names and the (u, v) positions of the undirected ties, u < v, each pair once
+    """
+    names, u, v = aligned_ties(matrix)
+    keep = u != v
+    pairs = np.unique(np.minimum(u[keep], v[keep]) * len(names) + np.maximum(u[keep], v[keep]))
+    return names, pairs // max(len(names), 1), pairs % max(len(names), 1)
+
+def central_actors(centrality, top=TOP_ACTORS):
+    """
+    The top actors of a node -> value mapping, highest value first
+    """
+    return sorted(centrality.items(), key=lambda item: -item[1])[:top]
+
+def preview_network(matrix, positions=None, num_nodes=PREVIEW_NODES):
+    """
+    Density, degrees and a drawing of the highest-degree nodes of a parsed matrix.
+    Returns a dictionary with the node and tie counts, the density, the top actors by degree,
+    the number of nodes drawn and their Cytoscape elements.
+    """
+    names, u, v = undirected_ties(matrix)
+    n = len(names)
+    degrees = np.bincount(u, minlength=n) + np.bincount(v, minlength=n)
+
+    top = np.argsort(-degrees, kind="stable")[:num_nodes]
+    shown = np.zeros(n, dtype=bool)
+    shown[top] = True
+    ties = shown[u] & shown[v]
+
+    circular = calculate_positions({names[i]: {} for i in top})
+    positions = positions or {}
+    elements = [{'data': {'id': names[i], 'label': names[i]}, 'position': positions.get(names[i], circular[names[i]])}
+                for i in top]
+    elements += [{'data': {'source': names[a], 'target': names[b]}} for a, b in zip(u[ties].tolist(), v[ties].tolist())]
+
+    return {
+        "nodes": n,
+        "ties": len(u),
+        "density": 2 * len(u) / (n * (n - 1)) if n > 1 else 0,
+        "central_actors": [(names[i], int(degrees[i])) for i in top[:TOP_ACTORS]],
+        "shown": len(top),
+        "elements": elements,
+    }
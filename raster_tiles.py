@@ -0,0 +1,266 @@
+#Server-side raster tiles of networks too large for Cytoscape
+#
+# Nodes and ties are drawn with vectorized NumPy into 256 x 256 PNG tiles of a zoomable map, as on a web map:
+# zoom level z covers the laid-out network with 2^z x 2^z tiles. Each tie is clipped to the tile and sampled
+# once per pixel, and overlapping ties darken the pixel, so dense regions stay readable at every zoom. A tile
+# only depends on the dataset, its layout and the tile coordinates, so tiles are kept per zoom level in the
+# results store. Below VIEWPORT_MAX_NODES nodes in view, the Dash app shows them as Cytoscape elements instead.
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from calc_render import calculate_positions
+from graph_index import BLOCK_COLORS, tie_weight
+from preview import undirected_ties
+
+TILE_SIZE = 256
+MAX_ZOOM = 12
+
+# Networks with more ties than this are shown as tiles; NETWORK_RASTER_MIN_TIES=0 turns the tiles off
+DEFAULT_RASTER_MIN_TIES = 50000
+
+# Nodes in view below which the Dash app switches to interactive Cytoscape elements
+VIEWPORT_MAX_NODES = 300
+
+# Width of the map in the browser, used to pick the zoom level whose tiles match the screen resolution
+VIEW_PIXELS = 800
+
+# Margin around the layout in the unit square of zoom level 0
+PADDING = 0.02
+
+# Tie samples drawn at once, bounding the memory of one tile whatever the number of ties
+SAMPLE_CHUNK = 1 << 22
+
+# Shade added by every tie crossing a pixel: 1 - (1 - TIE_SHADE)^ties
+TIE_SHADE = 0.3
+TIE_RGB = np.array([70, 70, 70], dtype=float)
+BACKGROUND_RGB = np.array([255, 255, 255], dtype=float)
+NODE_RGB = np.array([int(BLOCK_COLORS[0][i:i + 2], 16) for i in (1, 3, 5)], dtype=np.uint8)
+
+def raster_min_ties():
+    return int(os.environ.get("NETWORK_RASTER_MIN_TIES", DEFAULT_RASTER_MIN_TIES))
+
+def use_raster(num_ties):
+    """
+    True if a network with this many ties is shown as map tiles rather than Cytoscape elements
+    """
+    return 0 < raster_min_ties() < num_ties
+
+def build_scene(matrix, positions=None):
+    """
+    The undirected ties of a parsed matrix and the node positions scaled to the unit square of zoom level 0
+    (y pointing down, as on screen). positions are the layout stage's (node -> {"x", "y"}); without them the
+    nodes are placed in a circle. Nodes without a position are left out, with their ties.
+    """
+    names, sources, targets = undirected_ties(matrix)
+    if positions is None:
+        positions = calculate_positions({name: {} for name in names})
+
+    xy = np.array([[positions[name]["x"], positions[name]["y"]] if name in positions else [np.nan, np.nan]
+                   for name in names], dtype=float).reshape(-1, 2)
+    placed = ~np.isnan(xy[:, 0])
+    keep = placed[sources] & placed[targets]
+
+    origin = np.nanmin(xy, axis=0) if placed.any() else np.zeros(2)
+    span = max(float(np.nanmax(xy - origin)) if placed.any() else 0, 1e-9)
+    world = PADDING + (xy - origin) / span * (1 - 2 * PADDING)
+
+    return {"names": names, "xy": world, "placed": placed, "sources": sources[keep], "targets": targets[keep],
+            "origin": origin, "span": span}
+
+def layout_position(scene, world):
+    """
+    Converts unit-square coordinates back to the layout's, for Cytoscape
+    """
+    return scene["origin"] + (world - PADDING) / (1 - 2 * PADDING) * scene["span"]
+
+def clip_segments(a, b, low, high):
+    """
+    Liang-Barsky clipping of the segments a -> b to the square [low, high]^2.
+    Returns the parameters t0 <= t1 of the visible part; segments outside have t0 > t1.
+    """
+    d = b - a
+    t0 = np.zeros(len(a))
+    t1 = np.ones(len(a))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for axis in range(2):
+            for p, q in ((-d[:, axis], a[:, axis] - low), (d[:, axis], high - a[:, axis])):
+                t = q / p
+                entering = p < 0
+                leaving = p > 0
+                t0 = np.where(entering, np.maximum(t0, t), t0)
+                t1 = np.where(leaving, np.minimum(t1, t), t1)
+                # Parallel to this edge of the square and outside it
+                t0 = np.where((p == 0) & (q < 0), 2, t0)
+    return t0, t1
+
+def draw_ties(counts, a, b):
+    """
+    Adds every segment a -> b (pixel coordinates) to the per-pixel tie counts, one sample per pixel along it
+    """
+    size = counts.shape[0]
+    steps = np.ceil(np.abs(b - a).max(axis=1)).astype(np.int64) + 1
+
+    start = 0
+    while start < len(a):
+        # As many segments as fit in one chunk of samples (at least one)
+        stop = start + max(1, int(np.searchsorted(np.cumsum(steps[start:]), SAMPLE_CHUNK)))
+        segment_steps = steps[start:stop]
+        segment = np.repeat(np.arange(start, stop), segment_steps)
+        offsets = np.arange(len(segment)) - np.repeat(np.cumsum(segment_steps) - segment_steps, segment_steps)
+        t = offsets / np.maximum(steps[segment] - 1, 1)
+
+        points = np.floor(a[segment] + (b[segment] - a[segment]) * t[:, None]).astype(np.int64)
+        inside = ((points >= 0) & (points < size)).all(axis=1)
+        flat = points[inside, 1] * size + points[inside, 0]
+        counts += np.bincount(flat, minlength=size * size).reshape(size, size)
+        start = stop
+
+def node_radius(z):
+    return min(1 + z // 2, 6)
+
+def draw_nodes(image, points, radius):
+    """
+    Paints a disc of NODE_RGB around every point (pixel coordinates)
+    """
+    size = image.shape[0]
+    dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    disc = dx ** 2 + dy ** 2 <= radius ** 2
+    stencil = np.stack([dx[disc], dy[disc]], axis=1)
+
+    pixels = (np.floor(points).astype(np.int64)[:, None, :] + stencil[None, :, :]).reshape(-1, 2)
+    inside = ((pixels >= 0) & (pixels < size)).all(axis=1)
+    image[pixels[inside, 1], pixels[inside, 0]] = NODE_RGB
+
+def render_tile(scene, z, x, y):
+    """
+    RGB image (TILE_SIZE x TILE_SIZE x 3, uint8) of tile (x, y) at zoom level z
+    """
+    origin = np.array([x, y], dtype=float) * TILE_SIZE
+    points = scene["xy"] * (TILE_SIZE * 2 ** z) - origin
+    radius = node_radius(z)
+
+    # Only the ties whose bounding box touches the tile are clipped and drawn
+    a, b = points[scene["sources"]], points[scene["targets"]]
+    low, high = np.minimum(a, b), np.maximum(a, b)
+    touching = (high >= 0).all(axis=1) & (low < TILE_SIZE).all(axis=1)
+    a, b = a[touching], b[touching]
+    t0, t1 = clip_segments(a, b, -1, TILE_SIZE + 1)
+    visible = t0 <= t1
+    a, b, t0, t1 = a[visible], b[visible], t0[visible, None], t1[visible, None]
+
+    counts = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.int64)
+    draw_ties(counts, a + (b - a) * t0, a + (b - a) * t1)
+    shade = 1 - (1 - TIE_SHADE) ** counts
+    image = (BACKGROUND_RGB + (TIE_RGB - BACKGROUND_RGB) * shade[:, :, None]).round().astype(np.uint8)
+
+    placed = points[scene["placed"]]
+    near = ((placed >= -radius) & (placed < TILE_SIZE + radius)).all(axis=1)
+    draw_nodes(image, placed[near], radius)
+    return image
+
+def encode_png(image):
+    """
+    PNG file of an RGB uint8 image, written with zlib alone
+    """
+    height, width, _ = image.shape
+    # Filter type 0 (none) in front of every row
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 3)], axis=1).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+def tile_png(scene, z, x, y):
+    return encode_png(render_tile(scene, z, x, y))
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def viewport_zoom(x0, x1):
+    """
+    Zoom level whose tiles show the viewport [x0, x1] at about one tile pixel per screen pixel
+    """
+    width = max(x1 - x0, 1e-9)
+    return int(np.clip(np.round(np.log2(VIEW_PIXELS / (width * TILE_SIZE))), 0, MAX_ZOOM))
+
+def tile_images(tile_url, x0, x1, y0, y1):
+    """
+    Plotly layout images of the tiles covering the viewport (unit-square coordinates).
+    tile_url is formatted with z, x and y.
+    """
+    z = viewport_zoom(x0, x1)
+    tiles = 2 ** z
+    columns = range(max(int(np.floor(x0 * tiles)), 0), min(int(np.floor(x1 * tiles)), tiles - 1) + 1)
+    rows = range(max(int(np.floor(y0 * tiles)), 0), min(int(np.floor(y1 * tiles)), tiles - 1) + 1)
+    return [{"source": tile_url.format(z=z, x=x, y=y), "xref": "x", "yref": "y", "x": x / tiles, "y": y / tiles,
+             "sizex": 1 / tiles, "sizey": 1 / tiles, "xanchor": "left", "yanchor": "top", "sizing": "stretch",
+             "layer": "below"} for x in columns for y in rows]
+
+def tile_figure(tile_url):
+    """
+    Plotly figure of the whole network as tiles: an empty plot over the unit square, y pointing down
+    """
+    return {
+        "data": [],
+        "layout": {
+            "xaxis": {"range": [0, 1], "visible": False},
+            "yaxis": {"range": [1, 0], "visible": False, "scaleanchor": "x"},
+            "images": tile_images(tile_url, 0, 1, 0, 1),
+            "margin": {"l": 0, "r": 0, "t": 0, "b": 0},
+            "dragmode": "pan",
+            "uirevision": "tiles",
+        },
+    }
+
+def viewport_rect(relayout, previous=(0, 1, 0, 1)):
+    """
+    The viewport (x0, x1, y0, y1) after a Plotly relayout event; previous when the axes did not move
+    """
+    x0, x1, y0, y1 = previous
+    relayout = relayout or {}
+    if relayout.get("xaxis.autorange") or relayout.get("autosize"):
+        x0, x1, y0, y1 = 0, 1, 0, 1
+    if "xaxis.range[0]" in relayout:
+        x0, x1 = sorted((relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]))
+    elif "xaxis.range" in relayout:
+        x0, x1 = sorted(relayout["xaxis.range"])
+    if "yaxis.range[0]" in relayout:
+        y0, y1 = sorted((relayout["yaxis.range[0]"], relayout["yaxis.range[1]"]))
+    elif "yaxis.range" in relayout:
+        y0, y1 = sorted(relayout["yaxis.range"])
+    return x0, x1, y0, y1
+
+def viewport_nodes(scene, rect):
+    """
+    Positions (in scene["names"]) of the nodes inside the viewport
+    """
+    x0, x1, y0, y1 = rect
+    xy = scene["xy"]
+    with np.errstate(invalid="ignore"):
+        inside = scene["placed"] & (xy[:, 0] >= x0) & (xy[:, 0] <= x1) & (xy[:, 1] >= y0) & (xy[:, 1] <= y1)
+    return np.flatnonzero(inside)
+
+def viewport_elements(scene, nodes, graph_dict):
+    """
+    Cytoscape elements of the given nodes, at their layout positions, and of the ties among them
+    """
+    names = scene["names"]
+    shown = np.zeros(len(names), dtype=bool)
+    shown[nodes] = True
+    ties = shown[scene["sources"]] & shown[scene["targets"]]
+
+    elements = []
+    for i, (x, y) in zip(nodes.tolist(), layout_position(scene, scene["xy"][nodes]).tolist()):
+        node_data = {'id': names[i], 'label': names[i]}
+        node_data.update(graph_dict.get(names[i], {}).get("attributes", {}))
+        elements.append({'data': node_data, 'position': {'x': x, 'y': y}})
+    for u, v in zip(scene["sources"][ties].tolist(), scene["targets"][ties].tolist()):
+        elements.append({'data': {'source': names[u], 'target': names[v],
+                                  'weight': tie_weight(graph_dict, names[u], names[v])}})
+    return elements
@@ -1,23 +1,60 @@
 #Code for reading in network data and modifying network data
 
 import pandas as pd
+import numpy as np
+import csv
+import hashlib
+import io
 import os
-
-def read_matrix(file_path, file_name, sep=','):
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from attribute_encoding import encode_attributes
+from binary_storage import save_matrix_frame, save_sparse_matrix, save_attribute_table, sparse_matrix_frame
+
+def read_matrix(file_path, file_name, sep=',', storage="csv"):
+    """
+    Reads a matrix CSV and saves a copy to the "Network Data" directory.
+    storage="npy" or "csr" saves a memory-mappable binary copy instead of a CSV (see binary_storage).
+    With storage="csr" the matrix is streamed in row chunks and never held densely; a sparse DataFrame
+    with the node names in the first column, as in CSV mode, is returned.
+    """
     # Ensure the "Network Data" directory exists
     output_dir = os.path.join(os.path.dirname(file_path), "Network Data")
     os.makedirs(output_dir, exist_ok=True)
 
+    if storage == "csr":
+        import scipy.sparse
+        row_names, col_names, rows, cols, values = read_sparse_matrix(os.path.join(file_path, file_name), sep)
+        matrix = scipy.sparse.csr_matrix((values, (rows, cols)), shape=(len(row_names), len(col_names)))
+        # The label column is named as pandas names it in CSV mode
+        label_name = pd.read_csv(os.path.join(file_path, file_name), sep=sep, nrows=0).columns[0]
+        save_sparse_matrix(matrix, os.path.join(output_dir, os.path.splitext(file_name)[0]), row_names, col_names,
+                           label_name)
+        return sparse_matrix_frame(matrix, row_names, col_names).reset_index(names=label_name)
+
     # Read the matrix from the CSV file
     matrix = pd.read_csv(os.path.join(file_path, file_name), sep=sep)
 
     # Save the matrix to the "Network Data" directory with the same file name
     output_path = os.path.join(output_dir, file_name)
-    matrix.to_csv(output_path, sep=sep, index=False)
+    save_network_matrix(matrix, output_path, sep, storage, index=False)
 
     return matrix
 
-def read_binary_edgelist_undirected(filepath, file_name, sep=','):
+def save_network_matrix(matrix, output_path, sep=',', storage="csv", index=True):
+    """
+    Saves a matrix to output_path as a CSV, or as a binary directory (output_path without .csv)
+    when storage is "npy" (dense) or "csr" (sparse)
+    """
+    if storage == "csv":
+        matrix.to_csv(output_path, sep=sep, index=index)
+    elif storage in ("npy", "csr"):
+        save_matrix_frame(matrix, os.path.splitext(output_path)[0], sparse=storage == "csr")
+    else:
+        raise ValueError("Invalid storage. Choose 'csv', 'npy' or 'csr'.")
+
+def read_binary_edgelist_undirected(filepath, file_name, sep=',', storage="csv"):
     # Ensure the "Network Data" directory exists
     output_dir = os.path.join(os.path.dirname(filepath), "Network Data")
     os.makedirs(output_dir, exist_ok=True)
@@ -43,11 +80,11 @@ def read_binary_edgelist_undirected(filepath, file_name, sep=','):
 
     # Save the matrix to the "Network Data" directory with the same file name
     output_path = os.path.join(output_dir, f"{os.path.splitext(file_name)[0]}_matrix.csv")
-    matrix.to_csv(output_path, sep=sep)
+    save_network_matrix(matrix, output_path, sep, storage)
 
     return matrix
 
-def read_binary_edgelist_directed(filepath, file_name, sep=','):
+def read_binary_edgelist_directed(filepath, file_name, sep=',', storage="csv"):
     # Ensure the "Network Data" directory exists
     output_dir = os.path.join(os.path.dirname(filepath), "Network Data")
     os.makedirs(output_dir, exist_ok=True)
@@ -72,12 +109,12 @@ def read_binary_edgelist_directed(filepath, file_name, sep=','):
 
     # Save the matrix to the "Network Data" directory with the same file name
     output_path = os.path.join(output_dir, f"{os.path.splitext(file_name)[0]}_directed_matrix.csv")
-    matrix.to_csv(output_path, sep=sep)
+    save_network_matrix(matrix, output_path, sep, storage)
 
     return matrix
 
 
-def read_valued_edgelist(filepath, file_name, sep=','):
+def read_valued_edgelist(filepath, file_name, sep=',', storage="csv"):
     # Ensure the "Network Data" directory exists
     output_dir = os.path.join(os.path.dirname(filepath), "Network Data")
     os.makedirs(output_dir, exist_ok=True)
@@ -102,11 +139,11 @@ def read_valued_edgelist(filepath, file_name, sep=','):
 
     # Save the matrix to the "Network Data" directory with the same file name
     output_path = os.path.join(output_dir, f"{os.path.splitext(file_name)[0]}_valued_matrix.csv")
-    matrix.to_csv(output_path, sep=sep)
+    save_network_matrix(matrix, output_path, sep, storage)
 
     return matrix
 
-def read_attribute_file(filepath, file_name, sep=","):
+def read_attribute_file(filepath, file_name, sep=",", storage="csv"):
     # Ensure the "Network Data" directory exists
     output_dir = os.path.join(os.path.dirname(filepath), "Network Data")
     os.makedirs(output_dir, exist_ok=True)
@@ -119,10 +156,158 @@ def read_attribute_file(filepath, file_name, sep=","):
 
     #Save the attribute file to the "Network Data" directory with the same file name
     output_path = os.path.join(output_dir, f"{os.path.splitext(file_name)[0]}_attributes.csv")
-    attributes.to_csv(output_path, sep=sep, index=False)
+    if storage == "csv":
+        attributes.to_csv(output_path, sep=sep, index=False)
+    else:
+        save_attribute_table(attributes, os.path.splitext(output_path)[0])
 
     return attributes
 
+# Rows of the matrix parsed at once; peak memory of the parser is about MATRIX_CHUNK_ROWS * n * 8 bytes per worker
+MATRIX_CHUNK_ROWS = 512
+
+def iter_line_blocks(lines, chunk_rows=MATRIX_CHUNK_ROWS):
+    """
+    Groups an iterable of byte lines into blocks of chunk_rows lines
+    """
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) >= chunk_rows:
+            yield b"".join(block)
+            block = []
+    if block:
+        yield b"".join(block)
+
+def parse_matrix_block(block, num_columns, sep=','):
+    """
+    Parses a block of matrix rows and keeps only the nonzero cells. Blank cells count as 0.
+    Plain numeric rows go through np.loadtxt; anything else (blanks, quoted cells) through pandas' C parser,
+    which unquotes the names the same way the header is read.
+    Returns the row names and the block-local (row, column, value) triplets.
+    """
+    values = None
+    # Splitting at the first separator does not unquote, so blocks with quotes skip the fast path
+    if b'"' not in block:
+        try:
+            lines = [line.split(sep.encode(), 1) for line in block.splitlines() if line.strip()]
+            names = [line[0].decode('utf-8').strip() for line in lines]
+            values = np.loadtxt(io.BytesIO(b"\n".join(line[1] for line in lines)), delimiter=sep, ndmin=2)
+        except (ValueError, IndexError):
+            values = None
+    if values is None:
+        try:
+            frame = pd.read_csv(io.BytesIO(block), sep=sep, header=None, index_col=0, dtype={0: str})
+            values = frame.to_numpy(dtype=np.float64, na_value=0)
+        except (ValueError, pd.errors.ParserError) as e:
+            raise ValueError(f"The relational file could not be read: {e}")
+        names = [str(name).strip() for name in frame.index]
+
+    if values.shape[1] != num_columns:
+        raise ValueError(f"The relational file has rows with {values.shape[1]} values, expected {num_columns}.")
+
+    rows, cols = np.nonzero(values)
+    return names, rows.astype(np.int32), cols.astype(np.int32), values[rows, cols]
+
+def parse_matrix_lines(lines, sep=',', chunk_rows=MATRIX_CHUNK_ROWS, workers=1):
+    """
+    Parses the byte lines of a square matrix CSV chunk_rows rows at a time, keeping only the nonzero cells,
+    so memory grows with the number of ties rather than n^2. Lines can come from a file or an upload stream.
+    With workers > 1 the chunks are parsed on a thread pool while the next ones are read.
+    Returns the row names, the column names and the (row, column, value) triplets of the nonzero cells.
+    Raises ValueError if the file is not a square numeric matrix.
+    """
+    lines = iter(lines)
+    header = next(lines, b"").decode('utf-8-sig').strip()
+    if not header:
+        raise ValueError("The relational file is empty.")
+    col_names = [name.strip() for name in next(csv.reader([header], delimiter=sep))[1:]]
+
+    row_names, rows, cols, values = [], [], [], []
+
+    def collect(result):
+        names, block_rows, block_cols, block_values = result
+        rows.append(block_rows + len(row_names))
+        cols.append(block_cols)
+        values.append(block_values)
+        row_names.extend(names)
+
+    blocks = iter_line_blocks(lines, chunk_rows)
+    if workers > 1:
+        # Keep a bounded number of blocks in flight so memory stays at a few chunks
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for block in blocks:
+                pending.append(pool.submit(parse_matrix_block, block, len(col_names), sep))
+                if len(pending) >= 2 * workers:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+    else:
+        for block in blocks:
+            collect(parse_matrix_block(block, len(col_names), sep))
+
+    if len(row_names) != len(col_names):
+        raise ValueError(f"The relational file must be a square matrix, got {len(row_names)} rows "
+                         f"and {len(col_names)} columns.")
+
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int32)
+    values = np.concatenate(values) if values else np.zeros(0)
+
+    # Keep integer ties as integers, like the dense reader
+    if np.all(values == np.round(values)):
+        values = values.astype(np.int64)
+
+    return row_names, col_names, rows, cols, values
+
+def read_sparse_matrix(file_path, sep=',', chunk_rows=MATRIX_CHUNK_ROWS, workers=1):
+    """
+    Reads a square matrix CSV in row chunks, keeping only the nonzero cells (see parse_matrix_lines)
+    """
+    with open(file_path, 'rb') as f:
+        return parse_matrix_lines(f, sep, chunk_rows, workers)
+
+def read_upload_lines(stream, digest):
+    """
+    Yields the lines of an uploaded file while feeding its bytes to a hashlib digest
+    """
+    for line in stream:
+        digest.update(line)
+        yield line
+
+def dataset_id(*file_digests):
+    """
+    Id of a dataset from the digests of its files, None for a file that was not given.
+    Each file is hashed on its own, so moving bytes from one file to the other changes the id.
+    """
+    digest = hashlib.sha1()
+    for file_digest in file_digests:
+        digest.update(b"\x00" if file_digest is None else b"\x01" + file_digest.digest())
+    return digest.hexdigest()
+
+def read_uploaded_network(relational_stream, attribute_stream=None, sep=','):
+    """
+    Parses an uploaded relational file (and optional attribute file) straight from their binary streams,
+    without saving them or writing copies to "Network Data".
+    Returns a dataset dictionary with the parsed matrix, the attribute DataFrame and a content hash as its id.
+    """
+    relational_digest = hashlib.sha1()
+    attribute_digest = None
+
+    # The matrix is parsed in row chunks as it is read
+    matrix = parse_matrix_lines(read_upload_lines(relational_stream, relational_digest), sep)
+
+    if attribute_stream is not None:
+        data = attribute_stream.read()
+        attribute_digest = hashlib.sha1(data)
+        # Attributes are factorized once here into integer codes and a category dictionary
+        attributes = encode_attributes(pd.read_csv(io.BytesIO(data), sep=sep, index_col=0, encoding='utf-8-sig'))
+    else:
+        attributes = pd.DataFrame(index=matrix[0])
+
+    return {"id": dataset_id(relational_digest, attribute_digest), "matrix": matrix, "attributes": attributes}
+
 #tests
 #read_matrix("", "StateMigration2023.csv")
 #read_binary_edgelist_undirected("", "MadreSana_wave1.csv")
@@ -0,0 +1,162 @@
+#Persistent store of analysis results, shared by every worker process and kept across restarts
+#
+# Results are pickled into one SQLite table keyed by dataset fingerprint (the content hash of the upload),
+# analysis name and parameters. The database runs in WAL mode so several processes can read and write it
+# at once; when it grows past its size limit the least recently used results are deleted.
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "results.sqlite")
+DEFAULT_MAX_MB = 256
+
+# Bumped when a stored analysis changes shape, so older results are ignored
+STORE_VERSION = 2
+
+# Returned by lookup when nothing is stored, since None can be a stored result
+MISSING = object()
+
+def store_path():
+    return os.environ.get("NETWORK_RESULTS_DB", DEFAULT_PATH)
+
+def max_bytes():
+    return int(float(os.environ.get("NETWORK_RESULTS_MAX_MB", DEFAULT_MAX_MB)) * 1024 ** 2)
+
+def enabled():
+    """
+    NETWORK_RESULTS_DB set to an empty string turns the store off
+    """
+    return store_path() != ""
+
+def connect():
+    """
+    Opens the store, creating it on first use. Connections are short-lived, one per call, so they are never
+    shared between threads or across a fork.
+    """
+    path = store_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("""CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY, dataset TEXT, analysis TEXT, value BLOB, size INTEGER, last_used REAL)""")
+    connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+    return connection
+
+def result_key(dataset_id, analysis, params):
+    """
+    Key of one result: the dataset fingerprint, the analysis name and its parameters (anything JSON-serializable)
+    """
+    return hashlib.sha1(json.dumps([STORE_VERSION, dataset_id, analysis, params], sort_keys=True, default=str)
+                        .encode()).hexdigest()
+
+def lookup(dataset_id, analysis, params):
+    """
+    The stored result, or MISSING. A hit marks the result as recently used.
+    """
+    if not enabled():
+        return MISSING
+
+    key = result_key(dataset_id, analysis, params)
+    connection = connect()
+    try:
+        row = connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return MISSING
+        with connection:
+            connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+    finally:
+        connection.close()
+
+    try:
+        return pickle.loads(row[0])
+    except Exception:
+        return MISSING
+
+def store(dataset_id, analysis, params, value):
+    """
+    Stores a result, then evicts the least recently used results until the store is back under its size limit
+    """
+    if not enabled():
+        return
+
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    limit = max_bytes()
+    if len(data) > limit:
+        return
+
+    connection = connect()
+    try:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                               (result_key(dataset_id, analysis, params), dataset_id, analysis, data, len(data), time.time()))
+            evict(connection, limit)
+    finally:
+        connection.close()
+
+def append(dataset_id, analysis, params, item):
+    """
+    Appends an item to a stored list (an empty one on a miss) in one write transaction, so appends from
+    several processes are never lost and every process sees them in the same order. Returns the whole list.
+    """
+    key = result_key(dataset_id, analysis, params)
+    connection = connect()
+    connection.isolation_level = None
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            items = pickle.loads(row[0]) + [item] if row is not None else [item]
+            data = pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL)
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, dataset_id, analysis, data, len(data), time.time()))
+            evict(connection, max_bytes())
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.close()
+    return items
+
+def evict(connection, limit):
+    """
+    Deletes the least recently used results while the stored total is over limit bytes
+    """
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    if total <= limit:
+        return
+
+    for key, size in connection.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+        connection.execute("DELETE FROM results WHERE key = ?", (key,))
+        total -= size
+        if total <= limit:
+            break
+
+def cached_call(dataset_id, analysis, params, func, *args, **kwargs):
+    """
+    Returns the stored result of this analysis, computing and storing it on a miss
+    """
+    value = lookup(dataset_id, analysis, params)
+    if value is MISSING:
+        value = func(*args, **kwargs)
+        store(dataset_id, analysis, params, value)
+    return value
+
+def clear(dataset_id=None):
+    """
+    Removes the stored results of one dataset, or all of them
+    """
+    connection = connect()
+    try:
+        with connection:
+            if dataset_id is None:
+                connection.execute("DELETE FROM results")
+            else:
+                connection.execute("DELETE FROM results WHERE dataset = ?", (dataset_id,))
+    finally:
+        connection.close()
@@ -1,27 +1,27 @@
 import pandas as pd
-import networkx as nx
-import scipy
+import scipy.sparse
 import numpy as np
-import os
-import json
-import networkx as nx
-from calc_render import*
-#from temp_e_i import*
-import dash
-from dash import dcc, html
-import dash_cytoscape as cyto
-from dash.dependencies import Input, Output
-from dash import dcc, html, Input, Output, State
 
 import transforming_data as transform
-from scipy.stats import norm
+from attribute_encoding import attribute_codes
+from temp_ei import max_ei
 
 def clean_matrix(matrix):
     """
     Symmetrizes the matrix by maximum to ignore tie direction
     Makes the matrix binary to ignore tie weight
+    Sparse matrices stay sparse
     """
 
+    sparse_matrix = as_sparse(matrix)
+    if sparse_matrix is not None:
+        # Symmetrize by maximum and make binary without densifying
+        sparse_matrix = sparse_matrix.tocsr()
+        sparse_matrix = sparse_matrix.maximum(sparse_matrix.T).tocsr()
+        sparse_matrix.data = (sparse_matrix.data > 0).astype(np.int8)
+        sparse_matrix.eliminate_zeros()
+        return sparse_matrix
+
     # Symmetrize the matrix
     matrix = transform.symmetrize_maximum(matrix)
 
@@ -33,29 +33,22 @@ def clean_matrix(matrix):
 def calc_ei(matrix, attribute_column):
     """
     Calculates the E-I index for a given matrix.
+    Sparse matrices (scipy or sparse DataFrames) are counted from their nonzero cells only.
     """
 
+    sparse_matrix = as_sparse(matrix)
+    if sparse_matrix is not None:
+        return calc_sparse_ei(sparse_matrix, attribute_column)
+
     # Ensure matrix is a NumPy array
     matrix = np.array(matrix)
 
-    # Convert attribute_column to a NumPy array for proper indexing
-    attribute_column = np.array(attribute_column).flatten()
-
-    # Get the number of nodes in the matrix
-    n = matrix.shape[0]
-
-    # Initialize counters for internal and external ties
-    I = 0
-    E = 0
-
-    # Iterate through the upper triangle of the matrix
-    for i in range(n):
-        for j in range(i + 1, n):
-            if matrix[i, j] == 1:
-                if attribute_column[i] == attribute_column[j]:
-                    I += 1
-                else:
-                    E += 1
+    # Compare integer attribute codes over the ties in the upper triangle; ties of nodes with a missing value are left out
+    codes, _ = attribute_codes(attribute_column)
+    rows, cols = np.nonzero(np.triu(matrix == 1, k=1))
+    keep = (codes[rows] >= 0) & (codes[cols] >= 0)
+    I = int(np.sum(codes[rows[keep]] == codes[cols[keep]]))
+    E = int(keep.sum()) - I
 
     # Avoid division by zero
     if E + I == 0:
@@ -66,6 +59,35 @@ def calc_ei(matrix, attribute_column):
     
     return ei_index
 
+def as_sparse(matrix):
+    """
+    Returns the matrix as a scipy COO matrix if it is stored sparsely, otherwise None
+    """
+    if scipy.sparse.issparse(matrix):
+        return matrix.tocoo()
+    if isinstance(matrix, pd.DataFrame) and hasattr(matrix, "sparse") and len(matrix.columns) > 0 \
+            and all(isinstance(dtype, pd.SparseDtype) for dtype in matrix.dtypes):
+        return matrix.sparse.to_coo()
+    return None
+
+def calc_sparse_ei(matrix, attribute_column):
+    """
+    Calculates the E-I index from the nonzero cells of a sparse matrix, with the same counting rules as calc_ei
+    """
+    matrix = matrix.tocoo()
+    codes, _ = attribute_codes(attribute_column)
+
+    # Only ties of value 1 in the upper triangle between nodes that both have a value are counted
+    upper = (matrix.row < matrix.col) & (matrix.data == 1) & (codes[matrix.row] >= 0) & (codes[matrix.col] >= 0)
+
+    I = int(np.sum(codes[matrix.row[upper]] == codes[matrix.col[upper]]))
+    E = int(upper.sum()) - I
+
+    # Avoid division by zero
+    if E + I == 0:
+        return 0
+
+    return (E - I) / (E + I)
 
 def generate_ei_permutation(matrix, num_ties):
     """
@@ -89,89 +111,6 @@ def generate_ei_permutation(matrix, num_ties):
 
     return matrix
 
-'''def ei_test(matrix, attribute_column, num_permutations=50):
-    """
-    Performs a permutation test for the E-I index.
-    """
-
-    # Clean the matrix
-    matrix = clean_matrix(matrix)
-
-    # Calculate the observed E-I index
-    observed_ei = calc_ei(matrix, attribute_column)
-
-    # Convert matrix to NumPy array before summing
-    num_ties = int(np.sum(matrix.to_numpy()) // 2)
-
-    # Initialize a list to store E-I permutation scores
-    ei_indices = []
-
-    # Perform the permutations
-    while len(ei_indices) < num_permutations:
-        permuted_matrix = generate_ei_permutation(np.zeros_like(matrix), num_ties)
-        ei_indices.append(calc_ei(permuted_matrix, attribute_column))
-
-    # Calculate the standard deviation of E-I indices
-    ei_std_dev = np.std(ei_indices)
-
-    # Calculate the mean of E-I indices
-    ei_mean = np.mean(ei_indices)
-
-    # Calculate the z-score
-    ei_z_score = (observed_ei - ei_mean) / ei_std_dev
-
-    # Calculate the p-value for a two-tailed test
-    p_value = 2 * (1 - norm.cdf(abs(ei_z_score)))
-
-    # Calculate the confidence interval
-    confidence_interval = [ei_mean - 1.96 * ei_std_dev, ei_mean + 1.96 * ei_std_dev]
-
-    return observed_ei, p_value, confidence_interval'''
-
-def ei_test(matrix, attribute_column, num_permutations=50):
-    """
-    Performs a permutation test for the E-I index.
-    The test is performed by randomly permuting the edges in the matrix and calculating the E-I index for each permutation.
-    The p-value is calculated as the proportion of permutations that have an E-I index greater than or equal to the observed E-I index.
-    """
-
-    # Clean the matrix
-    matrix = clean_matrix(matrix)
-    matrix = matrix.to_numpy()
-    # Calculate the observed E-I index
-    observed_ei = calc_ei(matrix, attribute_column)
-
-    # Initialize a lit to to store E-I permutation scores
-    ei_indices = []
-
-    # Convert num_ties to an integer
-    num_ties = int(np.sum(matrix) // 2)
-
-    # Perform the permutations
-    while len(ei_indices) < num_permutations:
-        permuted_matrix = generate_ei_permutation(np.zeros_like(matrix), num_ties)
-        ei_indices.append(calc_ei(permuted_matrix, attribute_column))
-    # Calculate the standard deviation of E-I indices
-    ei_std_dev = np.std(ei_indices)
-
-    if ei_std_dev == 0:
-        ei_std_dev = 1e-10
-
-    # Calculate the mean of E-I indices
-    ei_mean = np.sum(ei_indices) / num_permutations
-
-    # Calculate how many standard deviations the observed E-I index is away from the mean
-    ei_z_score = (observed_ei - ei_mean) / ei_std_dev
-    
-    # Calculate the p-value for a two-tailed test
-    p_value = 2 * (1 - norm.cdf(abs(ei_z_score)))
-
-    # Calculate the confidence interval for the E-I mean
-    confidence_interval = [ei_mean - 1.96 * ei_std_dev, ei_mean + 1.96 * ei_std_dev]
-
-    return observed_ei, p_value, confidence_interval
-
-
 def min_ei(matrix, num_ties, attribute_column):
     """
     Creates a permutation that minimizes the number of external ties
@@ -215,13 +154,17 @@ def rescaled_ei(matrix, attribute_column):
 
     # Initialize the observed E-I index and the number of unique ties
     observed_ei = calc_ei(matrix, attribute_column)
-    num_ties = np.sum(matrix) // 2
+    num_ties = int(np.sum(np.asarray(matrix)) // 2)
 
     # Calculate the minimum and maximum E-I indices
     min_ei_index = min_ei(matrix, num_ties, attribute_column)
     max_ei_index = max_ei(matrix, num_ties, attribute_column)
 
     # Rescale the observed E-I index
-    rescaled_ei_index = (max_ei_index - min_ei_index) * (observed_ei - min_ei_index) / (max_ei_index - min_ei_index) + min_ei_index
+    actual_scale = max_ei_index - min_ei_index
+    if actual_scale == 0:
+        actual_scale = 1e-10
+
+    rescaled_ei_index = (max_ei_index - min_ei_index) * (observed_ei - min_ei_index) / actual_scale + min_ei_index
 
     return rescaled_ei_index
\ No newline at end of file
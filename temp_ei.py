@@ -1,9 +1,10 @@
 # Temporary file for testing cohesion and homophily of network data
 import numpy as np
 import transforming_data as transform
-from scipy.stats import norm
 import pandas as pd
 
+from attribute_encoding import attribute_codes
+
 def clean_matrix(matrix):
     """
     Symmetrizes the matrix by maximum to ignore tie direction
@@ -31,23 +32,19 @@ def calc_ei(matrix, attribute_column):
     It is calculated as the difference between the number of edges within blocks and the number of edges between blocks.
     """
 
-    # Get the number of nodes in the matrix
-    n = matrix.shape[0]
-
     # Convert the matrix to a numpy array
     matrix = np.array(matrix)
 
-    # Initialize variables to count edges within and between blocks
-    I = 0
-    E = 0
+    # Compare integer attribute codes over the ties in the upper triangle; ties of nodes with a missing value are left out
+    codes, _ = attribute_codes(attribute_column)
+    rows, cols = np.nonzero(np.triu(matrix == 1, k=1))
+    keep = (codes[rows] >= 0) & (codes[cols] >= 0)
+    I = int(np.sum(codes[rows[keep]] == codes[cols[keep]]))
+    E = int(keep.sum()) - I
 
-    # Iterate through the upper triangle of the matrix to count edges
-    for i in range(n):
-        for j in range(i + 1, n):
-            if matrix[i, j] == 1 and attribute_column[i] == attribute_column[j]:
-                I += 1
-            elif matrix[i, j] == 1 and attribute_column[i] != attribute_column[j]:
-                E += 1
+    # No ties between nodes with a value
+    if E + I == 0:
+        return 0
 
     # Calculate the E-I index
     ei_index = (E - I) / (E + I)
@@ -77,12 +74,75 @@ def generate_ei_permutation(matrix, num_ties):
 
     return new_matrix
 
-def ei_test(matrix, attribute_column, num_permutations=100):
+def analytic_ei_counts(matrix, attribute_column):
+    """
+    Counts what the analytic test needs from the cleaned (symmetric, binary) ties:
+    the internal and total ties, the number of dyads, and the number of dyads within groups.
+    Nodes with a missing attribute value are left out.
+    """
+    from mixing_matrix import symmetric_ties
+
+    ties = symmetric_ties(matrix)
+    codes, _ = attribute_codes(attribute_column)
+    valid = codes >= 0
+
+    # Ties between nodes that both have a value, counted once
+    upper = ties.tocoo()
+    keep = (upper.row < upper.col) & valid[upper.row] & valid[upper.col]
+    num_ties = int(keep.sum())
+    internal = int(np.sum(codes[upper.row[keep]] == codes[upper.col[keep]]))
+
+    n = int(valid.sum())
+    group_sizes = np.bincount(codes[valid])
+    num_dyads = n * (n - 1) // 2
+    internal_dyads = int(np.sum(group_sizes * (group_sizes - 1) // 2))
+
+    return internal, num_ties, num_dyads, internal_dyads
+
+def analytic_ei_test(matrix, attribute_column, alpha=0.05):
+    """
+    Exact test of the E-I index against random tie placement, without permutations.
+    If the observed number of ties is placed uniformly at random over all dyads, the number of internal ties
+    follows a hypergeometric distribution fixed by the group sizes and the tie count, and E-I = (ties - 2 * internal) / ties.
+    Returns the observed E-I index, the two-tailed p-value and the central (1 - alpha) interval of E-I under the null.
+    """
+    from scipy.stats import hypergeom
+
+    internal, num_ties, num_dyads, internal_dyads = analytic_ei_counts(matrix, attribute_column)
+    if num_ties == 0:
+        return 0, 1.0, [0, 0]
+
+    observed_ei = (num_ties - 2 * internal) / num_ties
+    null = hypergeom(num_dyads, internal_dyads, num_ties)
+
+    # Two-tailed p-value: twice the smaller tail, capped at 1
+    p_value = min(1.0, 2 * min(null.cdf(internal), null.sf(internal - 1)))
+
+    # More internal ties means a lower E-I index, so the interval bounds swap
+    low_internal, high_internal = null.ppf(alpha / 2), null.isf(alpha / 2)
+    confidence_interval = [float((num_ties - 2 * high_internal) / num_ties), float((num_ties - 2 * low_internal) / num_ties)]
+
+    return observed_ei, float(p_value), confidence_interval
+
+def ei_test(matrix, attribute_column, num_permutations=100, method="analytic"):
     """
-    Performs a permutation test for the E-I index.
+    Tests the E-I index against random tie placement.
+    method="analytic" (the default) uses the exact hypergeometric null distribution (see analytic_ei_test).
+    method="sequential" permutes until significance at the 5% level is settled, up to num_permutations
+    (see sequential_ei_test).
+    method="permutation" performs a permutation test, kept to validate the analytic results:
     The test is performed by randomly permuting the edges in the matrix and calculating the E-I index for each permutation.
     The p-value is calculated as the proportion of permutations that have an E-I index greater than or equal to the observed E-I index.
+    Returns the observed E-I index, the p-value, the confidence interval and the number of permutations used.
     """
+    if method == "analytic":
+        return analytic_ei_test(matrix, attribute_column) + (0,)
+    elif method == "sequential":
+        return sequential_ei_test(matrix, attribute_column, max_permutations=num_permutations)
+    elif method != "permutation":
+        raise ValueError("Invalid method. Choose 'analytic', 'sequential' or 'permutation'.")
+
+    from scipy.stats import norm
 
     # Clean the matrix
     matrix = clean_matrix(matrix)
@@ -119,7 +179,69 @@ def ei_test(matrix, attribute_column, num_permutations=100):
     # Calculate the confidence interval for the E-I mean
     confidence_interval = [ei_mean - 1.96 * ei_std_dev, ei_mean + 1.96 * ei_std_dev]
 
-    return observed_ei, p_value, confidence_interval
+    return observed_ei, p_value, confidence_interval, num_permutations
+
+def random_internal_ties(codes, num_ties, rng):
+    """
+    Places num_ties ties uniformly at random over the dyads of the nodes and counts how many fall within a group.
+    Dyads are drawn as linear indices into the upper triangle and decoded to (i, j) pairs, so no matrix is built.
+    """
+    n = len(codes)
+    num_dyads = n * (n - 1) // 2
+    k = rng.choice(num_dyads, size=num_ties, replace=False)
+
+    # Row i of the upper triangle starts at linear index i * (2n - i - 1) / 2
+    i = n - 2 - np.floor(np.sqrt(-8 * k + 4 * n * (n - 1) - 7) / 2 - 0.5).astype(np.int64)
+    j = k + i + 1 - num_dyads + (n - i) * (n - i - 1) // 2
+
+    return int(np.sum(codes[i] == codes[j]))
+
+def sequential_ei_test(matrix, attribute_column, alpha=0.05, max_permutations=10000, batch_size=100,
+                       confidence=0.999, seed=None):
+    """
+    Permutation test for the E-I index that stops as soon as significance at alpha is settled.
+    After each batch of permutations a Clopper-Pearson interval (at the given confidence) is put on the
+    smaller tail probability; the test stops once twice that interval lies entirely below or above alpha,
+    or after max_permutations. Easy cases stop after one batch, so max_permutations can be raised for hard ones.
+    Returns the observed E-I index, the two-tailed p-value, the 95% interval of the permuted E-I indices
+    and the number of permutations used.
+    """
+    from scipy.stats import beta
+
+    internal, num_ties, _, _ = analytic_ei_counts(matrix, attribute_column)
+    if num_ties == 0:
+        return 0, 1.0, [0, 0], 0
+
+    codes, _ = attribute_codes(attribute_column)
+    codes = codes[codes >= 0]
+    rng = np.random.default_rng(seed)
+    observed_ei = (num_ties - 2 * internal) / num_ties
+
+    ei_indices = []
+    lower, upper = 0, 0  # permutations at least as extreme as observed, in each direction
+    while len(ei_indices) < max_permutations:
+        for _ in range(min(batch_size, max_permutations - len(ei_indices))):
+            permuted_internal = random_internal_ties(codes, num_ties, rng)
+            ei_indices.append((num_ties - 2 * permuted_internal) / num_ties)
+            lower += ei_indices[-1] <= observed_ei
+            upper += ei_indices[-1] >= observed_ei
+
+        # Clopper-Pearson bounds on the smaller tail probability
+        used = len(ei_indices)
+        tail = min(lower, upper)
+        tail_low = beta.ppf((1 - confidence) / 2, tail, used - tail + 1) if tail > 0 else 0.0
+        tail_high = beta.ppf(1 - (1 - confidence) / 2, tail + 1, used - tail)
+        if 2 * tail_high < alpha or 2 * tail_low > alpha:
+            break
+
+    used = len(ei_indices)
+    p_value = min(1.0, 2 * (min(lower, upper) + 1) / (used + 1))
+
+    ei_mean = np.mean(ei_indices)
+    ei_std_dev = np.std(ei_indices)
+    confidence_interval = [float(ei_mean - 1.96 * ei_std_dev), float(ei_mean + 1.96 * ei_std_dev)]
+
+    return observed_ei, float(p_value), confidence_interval, used
 
 def max_ei(matrix, num_ties, attribute_column):
     """
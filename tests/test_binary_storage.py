@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import reading_data
+import transforming_data
+
+@pytest.fixture
+def matrix_file(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "ties.csv").write_text(",A,B,C\nA,0,2,0\nB,1,0,0\nC,0,3,0\n")
+    return str(data_dir)
+
+def test_csr_read_has_the_shape_of_csv_mode(matrix_file):
+    dense = reading_data.read_matrix(matrix_file, "ties.csv")
+    sparse = reading_data.read_matrix(matrix_file, "ties.csv", storage="csr")
+
+    assert list(sparse.columns) == list(dense.columns) == ["Unnamed: 0", "A", "B", "C"]
+    assert list(sparse.index) == list(dense.index)
+    assert sparse.iloc[:, 0].tolist() == dense.iloc[:, 0].tolist() == ["A", "B", "C"]
+    assert np.array_equal(sparse.iloc[:, 1:].to_numpy(), dense.iloc[:, 1:].to_numpy())
+
+@pytest.mark.parametrize("storage", ["npy", "csr"])
+def test_binary_directory_reads_like_the_csv(matrix_file, storage):
+    csv_frame = pd.read_csv(f"{matrix_file}/ties.csv")
+    transforming_data.write_matrix(csv_frame, f"{matrix_file}/out/", "ties.csv", storage=storage)
+
+    frame = transforming_data.read_matrix(f"{matrix_file}/out", "ties")
+    assert list(frame.columns) == list(csv_frame.columns)
+    assert frame.iloc[:, 0].tolist() == ["A", "B", "C"]
+    assert np.array_equal(frame.iloc[:, 1:].to_numpy(), csv_frame.iloc[:, 1:].to_numpy())
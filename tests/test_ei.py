@@ -0,0 +1,113 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse
+
+import live_graph
+import temp_e_i
+import temp_ei
+from bit_matrix import pack_ties
+from mixing_matrix import ei_decomposition
+from temp_ei import ei_test
+
+@pytest.fixture
+def network():
+    """
+    A random binary symmetric network of 40 nodes and an attribute missing for every fifth node
+    """
+    G = nx.gnp_random_graph(40, 0.15, seed=3)
+    matrix = pd.DataFrame(nx.to_numpy_array(G, nodelist=range(40), dtype=int))
+    values = ["a", "b", "c", "b"]
+    attribute = pd.Series([None if i % 5 == 0 else values[i % 4] for i in range(40)])
+    return G, matrix, attribute
+
+def test_ei_variants_agree_with_missing_values(network):
+    G, matrix, attribute = network
+
+    # Ties of nodes without a value are left out: count the rest by hand
+    kept = [(u, v) for u, v in G.edges() if attribute.notna()[u] and attribute.notna()[v]]
+    internal = sum(attribute[u] == attribute[v] for u, v in kept)
+    expected = (len(kept) - 2 * internal) / len(kept)
+    assert len(kept) < G.number_of_edges()
+
+    graph_dict = {str(node): {"targets": {}, "attributes": {"group": attribute[node]} if attribute.notna()[node] else {}}
+                  for node in G.nodes()}
+    for u, v in G.edges():
+        graph_dict[str(u)]["targets"][str(v)] = 1
+    live = live_graph.make_live_graph(graph_dict)
+
+    variants = {
+        "dense": temp_e_i.calc_ei(matrix, attribute),
+        "sparse": temp_e_i.calc_ei(scipy.sparse.csr_matrix(matrix.to_numpy()), attribute),
+        "temp_ei": temp_ei.calc_ei(matrix, attribute),
+        "mixing": ei_decomposition(matrix, attribute)["network"],
+        "packed": ei_decomposition(matrix, attribute, pack_ties(matrix))["network"],
+        "analytic": temp_ei.analytic_ei_test(matrix, attribute)[0],
+        "live_graph": live_graph.ei_index(live, "group"),
+    }
+    for name, value in variants.items():
+        assert value == pytest.approx(expected), name
+
+def test_ei_of_network_without_values_is_zero(network):
+    G, matrix, attribute = network
+    missing = pd.Series([None] * len(attribute))
+
+    assert temp_e_i.calc_ei(matrix, missing) == 0
+    assert temp_e_i.calc_ei(scipy.sparse.csr_matrix(matrix.to_numpy()), missing) == 0
+    assert temp_ei.calc_ei(matrix, missing) == 0
+    assert ei_decomposition(matrix, missing)["network"] == 0
+
+@pytest.fixture
+def homophilous():
+    """
+    Two groups of 30 nodes, dense within the groups and sparse between them
+    """
+    G = nx.stochastic_block_model([30, 30], [[0.3, 0.02], [0.02, 0.3]], seed=5)
+    matrix = pd.DataFrame(nx.to_numpy_array(G, nodelist=range(60), dtype=int))
+    attribute = pd.Series(["x"] * 30 + ["y"] * 30)
+    return matrix, attribute
+
+def test_ei_test_methods_agree(homophilous):
+    matrix, attribute = homophilous
+    observed = temp_e_i.calc_ei(matrix, attribute)
+
+    for method in ("analytic", "sequential", "permutation"):
+        observed_ei, p_value, confidence_interval, permutations = ei_test(matrix, attribute, num_permutations=200,
+                                                                          method=method)
+        assert observed_ei == pytest.approx(observed), method
+        assert p_value < 0.05, method
+        assert confidence_interval[0] < confidence_interval[1], method
+        assert observed_ei < confidence_interval[0], method
+
+def test_sequential_ei_test_stops_early(homophilous):
+    matrix, attribute = homophilous
+
+    *_, permutations = ei_test(matrix, attribute, num_permutations=10000, method="sequential")
+    assert 0 < permutations < 10000
+    assert ei_test(matrix, attribute, method="analytic")[3] == 0
+    assert ei_test(matrix, attribute, num_permutations=30, method="permutation")[3] == 30
+
+def test_sequential_ei_test_settles_non_significance(network):
+    G, matrix, attribute = network
+
+    # Group membership does not matter in a random network, so the test stops as soon as p is clearly above 5%
+    observed_ei, p_value, _, permutations = ei_test(matrix, attribute, num_permutations=10000, method="sequential")
+    assert ei_test(matrix, attribute)[1] > 0.2
+    assert p_value > 0.05
+    assert 0 < permutations < 10000
+
+def test_ei_test_rejects_unknown_method(homophilous):
+    matrix, attribute = homophilous
+    with pytest.raises(ValueError):
+        ei_test(matrix, attribute, method="bootstrap")
+
+def test_rescaled_ei_lies_between_extremes(homophilous):
+    matrix, attribute = homophilous
+    num_ties = int(np.asarray(matrix).sum() // 2)
+
+    rescaled = temp_e_i.rescaled_ei(matrix, attribute)
+    low = temp_e_i.min_ei(np.asarray(matrix), num_ties, attribute)
+    high = temp_ei.max_ei(np.asarray(matrix), num_ties, attribute)
+    assert low <= rescaled <= high
+    assert rescaled == pytest.approx(temp_ei.rescaled_ei(matrix, attribute))
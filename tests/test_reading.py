@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from reading_data import parse_matrix_lines
+
+def matrix_lines(text):
+    return [line.encode() + b"\n" for line in text.strip().splitlines()]
+
+@pytest.mark.parametrize("chunk_rows", [1, 512])
+def test_quoted_names_are_unquoted_like_the_header(chunk_rows):
+    lines = matrix_lines('''
+,"A","B, Jr.",C
+"A",0,1,0
+"B, Jr.",1,0,2
+C,0,2,0
+''')
+    row_names, col_names, rows, cols, values = parse_matrix_lines(lines, chunk_rows=chunk_rows)
+
+    assert col_names == ["A", "B, Jr.", "C"]
+    assert row_names == col_names
+    assert sorted(zip(rows.tolist(), cols.tolist(), values.tolist())) == [(0, 1, 1), (1, 0, 1), (1, 2, 2), (2, 1, 2)]
+
+def test_plain_and_blank_cells():
+    lines = matrix_lines('''
+,A,B
+A,0,1
+B,,0
+''')
+    row_names, col_names, rows, cols, values = parse_matrix_lines(lines)
+
+    assert row_names == col_names == ["A", "B"]
+    assert (rows.tolist(), cols.tolist(), values.tolist()) == ([0], [1], [1])
+    assert values.dtype == np.int64
+
+def test_non_square_matrix_is_rejected():
+    with pytest.raises(ValueError):
+        parse_matrix_lines(matrix_lines(",A,B\nA,0,1\n"))
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from network_metrics import global_metrics
+from preview import directed_matrix, undirected_ties
+
+def test_columns_are_matched_to_rows_by_name():
+    # The columns are in another order than the rows: A -> B, B -> C, C -> A
+    matrix = (["A", "B", "C"], ["C", "A", "B"], np.array([0, 1, 2]), np.array([2, 0, 1]), np.array([1, 1, 1]))
+    names, ties = directed_matrix(matrix)
+
+    assert names == ["A", "B", "C"]
+    assert sorted(zip(*ties.nonzero())) == [(0, 1), (1, 2), (2, 0)]
+    metrics = global_metrics(ties)
+    assert metrics["ties"] == 3
+    assert metrics["triangles"] == 1
+    assert metrics["reciprocity"] == pytest.approx(0)
+
+def test_extra_columns_become_nodes():
+    # D only appears as a column
+    matrix = (["A", "B"], ["A", "B", "D"], np.array([0, 1]), np.array([2, 0]), np.array([2, 5]))
+    names, ties = directed_matrix(matrix)
+
+    assert names == ["A", "B", "D"]
+    assert ties.shape == (3, 3)
+    assert ties[0, 2] == 2 and ties[1, 0] == 5
+    assert global_metrics(ties)["nodes"] == 3
+
+    names, u, v = undirected_ties(matrix)
+    assert sorted(zip(u.tolist(), v.tolist())) == [(0, 1), (0, 2)]
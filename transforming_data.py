@@ -3,29 +3,43 @@
 import os
 import pandas as pd
 
+from binary_storage import save_matrix_frame, load_matrix_frame
+
 def read_matrix(file_path, file_name, sep='\t'):
 
     """
     Reads a matrix from a given CSV file and file path
+    A binary matrix directory (see binary_storage) is memory-mapped instead of parsed; either way the
+    node labels are the first column
     """
 
     # Ensure the "Network Data" directory exists
     output_dir = os.path.join(os.path.dirname(file_path), "Network Data")
     os.makedirs(output_dir, exist_ok=True)
 
+    # Binary matrices are opened without parsing
+    if os.path.isdir(os.path.join(file_path, file_name)):
+        return load_matrix_frame(os.path.join(file_path, file_name), labels_as_column=True)
+
     # Read the matrix from the CSV file into a Pandas DataFrame
     matrix = pd.read_csv(os.path.join(file_path, file_name), sep=sep)
 
     return matrix
 
-def write_matrix(matrix, file_path, file_name, sep='\t'):
+def write_matrix(matrix, file_path, file_name, sep='\t', storage="csv"):
+    """
+    Writes a matrix as a CSV, or as a binary matrix directory when storage is "npy" (dense) or "csr" (sparse)
+    """
     # Ensure the file_path exists
     output_dir = os.path.join(os.path.dirname(file_path))
     os.makedirs(output_dir, exist_ok=True)
 
     # Save the matrix to the chosen filepath with the same file name
     output_path = os.path.join(output_dir, file_name)
-    matrix.to_csv(output_path, sep=sep, index=False)
+    if storage == "csv":
+        matrix.to_csv(output_path, sep=sep, index=False)
+    else:
+        save_matrix_frame(matrix, os.path.splitext(output_path)[0], sparse=storage == "csr")
 
     return "Symmetrized matrix saved to " + output_path
 